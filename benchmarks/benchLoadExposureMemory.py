@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Compare the peak memory of assembling a post-ISR MaskedImage from an fpC
+and fpM the old way (convertF, copy for variance, sub-image for the
+overlap) and with sdssNullIsr.fillMaskedImage.
+
+Each method runs in a fresh process; the reported number is the growth of
+the peak resident set size during assembly, after the inputs are read.
+"""
+import multiprocessing
+import os
+import resource
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tests", "data", "dr7", "runs")
+DATA_ID = dict(run=5754, camcol=3, field=280, filter="r")
+PEDESTAL = 1000
+GAIN = 4.72
+OVERLAP = 128
+
+
+def maxRssMB():
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    scale = 1024.0**2 if sys.platform == "darwin" else 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def legacy(fpC, mask):
+    import lsst.afw.image as afwImage
+    import lsst.geom as geom
+    image = fpC.convertF().getMaskedImage().getImage()
+    image -= PEDESTAL
+    var = afwImage.ImageF(image, True)
+    var /= GAIN
+    mi = afwImage.MaskedImageF(image, mask, var)
+    bbox = mi.getBBox()
+    extent = bbox.getDimensions() - geom.Extent2I(0, OVERLAP)
+    return afwImage.MaskedImageF(mi, geom.BoxI(bbox.getBegin(), extent))
+
+
+def fused(fpC, mask):
+    import lsst.afw.image as afwImage
+    import lsst.geom as geom
+    from lsst.obs.sdss.sdssNullIsr import fillMaskedImage
+    bbox = fpC.getBBox()
+    bbox = geom.BoxI(bbox.getBegin(), bbox.getDimensions() - geom.Extent2I(0, OVERLAP))
+    mi = afwImage.MaskedImageF(bbox)
+    nRows = bbox.getHeight()
+    fillMaskedImage(mi, fpC.getMaskedImage().getImage().array[:nRows], mask.array[:nRows], PEDESTAL, GAIN)
+    return mi
+
+
+def measure(name, queue):
+    import lsst.daf.persistence as dafPersist
+    butler = dafPersist.Butler(root=ROOT)
+    fpC = butler.get("fpC", DATA_ID)
+    mask = butler.get("fpM", DATA_ID)
+    before = maxRssMB()
+    mi = globals()[name](fpC, mask)
+    queue.put((name, maxRssMB() - before, mi.getHeight()))
+
+
+if __name__ == "__main__":
+    ctx = multiprocessing.get_context("spawn")
+    for name in ("legacy", "fused"):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=measure, args=(name, queue))
+        proc.start()
+        result = queue.get()
+        proc.join()
+        print("%-8s peak RSS growth %7.1f MB (%d rows)" % result)
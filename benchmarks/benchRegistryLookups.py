@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Time the registry lookups SdssMapper makes against a synthetic registry
+of about a million frames, with the indexes created by the registry
+generation scripts and with the old unique index only.
+
+The queries have the form issued by lsst.daf.persistence's registry
+lookups: SELECT DISTINCT of the missing keys, constrained by the given ones.
+"""
+from optparse import OptionParser
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from lsst.obs.sdss.registryUtils import createRawIndexes
+
+FILTERS = "ugriz"
+
+QUERIES = [
+    ("map a frame", "SELECT DISTINCT rerun FROM raw WHERE run=? AND camcol=? AND field=? AND filter=?",
+     lambda r: (r.run, r.camcol, r.field, r.filter)),
+    ("subset(run, camcol)", "SELECT DISTINCT field, filter FROM raw WHERE run=? AND camcol=?",
+     lambda r: (r.run, r.camcol)),
+    ("subset(run)", "SELECT DISTINCT camcol, field, filter FROM raw WHERE run=?",
+     lambda r: (r.run,)),
+    ("subset(run, filter)", "SELECT DISTINCT camcol, field FROM raw WHERE run=? AND filter=?",
+     lambda r: (r.run, r.filter)),
+    ("subset(filter, camcol, field)",
+     "SELECT DISTINCT run FROM raw WHERE filter=? AND camcol=? AND field=?",
+     lambda r: (r.filter, r.camcol, r.field)),
+]
+
+
+class Frame(object):
+    def __init__(self, run, camcol, field, filter):
+        self.run = run
+        self.camcol = camcol
+        self.field = field
+        self.filter = filter
+
+
+def makeRegistry(path, nRun, nField, newIndexes):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run INT, rerun INT, filter TEXT, camcol INT, field INT,
+        taiObs TEXT, strip TEXT)""")
+    conn.execute("CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)")
+    rows = ((run, 40, filter, camcol, field, "2005-10-21T05:25:00.499000000", "82S")
+            for run in range(1000, 1000 + nRun) for camcol in range(1, 7)
+            for field in range(11, 11 + nField) for filter in FILTERS)
+    conn.executemany("INSERT INTO raw VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)", rows)
+    if newIndexes:
+        createRawIndexes(conn)
+    else:
+        conn.execute("CREATE UNIQUE INDEX uq_raw ON raw (run, filter, camcol, field)")
+    conn.commit()
+    return conn
+
+
+def timeQueries(conn, frames):
+    for name, sql, getArgs in QUERIES:
+        plan = " / ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, getArgs(frames[0])))
+        t0 = time.time()
+        for frame in frames:
+            conn.execute(sql, getArgs(frame)).fetchall()
+        dt = (time.time() - t0) / len(frames)
+        print("  %-32s %9.1f usec/query   %s" % (name, dt*1e6, plan))
+
+
+def main(nRun=200, nField=170, nQuery=200):
+    random.seed(42)
+    frames = [Frame(random.randrange(1000, 1000 + nRun), random.randint(1, 6),
+                    random.randrange(11, 11 + nField), random.choice(FILTERS)) for i in range(nQuery)]
+    tmpDir = tempfile.mkdtemp()
+    try:
+        for newIndexes in (False, True):
+            path = os.path.join(tmpDir, "registry%d.sqlite3" % newIndexes)
+            t0 = time.time()
+            conn = makeRegistry(path, nRun, nField, newIndexes)
+            nRows = conn.execute("SELECT COUNT(*) FROM raw").fetchone()[0]
+            print("%s: %d rows, built in %.1f sec, %.0f MB" %
+                  ("createRawIndexes" if newIndexes else "uq_raw only", nRows, time.time() - t0,
+                   os.path.getsize(path) / 1024.0**2))
+            timeQueries(conn, frames)
+            conn.close()
+            os.unlink(path)
+    finally:
+        os.rmdir(tmpDir)
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--nRun", type="int", default=200, help="number of runs (default=200)")
+    parser.add_option("--nField", type="int", default=170, help="fields per camcol (default=170)")
+    parser.add_option("--nQuery", type="int", default=200, help="queries of each kind (default=200)")
+    (options, args) = parser.parse_args()
+    main(options.nRun, options.nField, options.nQuery)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Time the selection of the frames overlapping coadd patches on a synthetic
+Stripe 82 registry, with the frame footprints and sky tiles written by
+genInputRegistry.py, against testing every frame's polygon in turn as
+WcsSelectImagesTask does (without the cost of reading each calexp's WCS).
+
+The registry has every camcol of nRun runs alternating between the north
+and south strips, each scanning the same stretch of RA with a random offset.
+"""
+from optparse import OptionParser
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+import lsst.sphgeom as sphgeom
+from lsst.obs.sdss.registryUtils import createFootprintTable, createRawIndexes, getSkyTiles
+from lsst.obs.sdss.sdssSelectImages import queryFootprints
+
+PIXEL_SCALE = 0.396 / 3600.0  # degrees
+FIELD_HEIGHT = 1361 * PIXEL_SCALE  # along the scan (RA), without the overlap
+FRAME_HEIGHT = 1489 * PIXEL_SCALE
+FRAME_WIDTH = 2048 * PIXEL_SCALE  # across the scan (Dec)
+CAMCOL_SPACING = 0.2539  # degrees in Dec between camcols of a strip
+STRIP_OFFSET = 0.2150  # degrees in Dec between the north and south strips
+
+
+def makeCorners(raCenter, decCenter, height=FRAME_HEIGHT, width=FRAME_WIDTH):
+    """Return the corners (RA, Dec), going around, of a frame near the equator"""
+    dra = 0.5 * height / np.cos(np.radians(decCenter))
+    ddec = 0.5 * width
+    corners = np.array([(raCenter - dra, decCenter - ddec), (raCenter + dra, decCenter - ddec),
+                        (raCenter + dra, decCenter + ddec), (raCenter - dra, decCenter + ddec)])
+    corners[:, 0] %= 360
+    return corners
+
+
+def makeRegistry(path, nRun, raMin, raMax, filters, pixelization):
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT,
+        run INT, rerun INT, filter TEXT, camcol INT, field INT,
+        taiObs TEXT, strip TEXT)""")
+    conn.execute("CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)")
+    createFootprintTable(conn)
+    nField = int((raMax - raMin) / FIELD_HEIGHT) + 1
+    radius = 0.5 * np.hypot(FRAME_HEIGHT, FRAME_WIDTH)
+    id = 0
+    for run in range(1000, 1000 + nRun):
+        strip = "82N" if run % 2 == 0 else "82S"
+        raStart = raMin + random.uniform(-0.5, 0.5)
+        rows = []
+        footprints = []
+        skyTiles = []
+        for camcol in range(1, 7):
+            decCenter = (camcol - 3.5) * CAMCOL_SPACING + (0.5 if strip == "82N" else -0.5) * STRIP_OFFSET
+            for field in range(11, 11 + nField):
+                raCenter = (raStart + (field - 11) * FIELD_HEIGHT) % 360
+                corners = makeCorners(raCenter, decCenter)
+                tiles = getSkyTiles(corners, pixelization)
+                for filter in filters:
+                    id += 1
+                    rows.append((id, run, 40, filter, camcol, field, "2005-10-21T05:25:00.499000000", strip))
+                    footprints.append([id] + corners.flatten().tolist() + [raCenter, decCenter, radius])
+                    skyTiles.extend((id, tile) for tile in tiles)
+        conn.executemany("INSERT INTO raw VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.executemany("INSERT INTO raw_footprint VALUES (%s)" % (", ".join("?"*12),), footprints)
+        conn.executemany("INSERT INTO raw_skyTile VALUES (?, ?)", skyTiles)
+    createRawIndexes(conn)
+    conn.commit()
+    return conn
+
+
+def selectAll(conn, patch, filter):
+    """Test the polygon of every frame of a filter against a patch, one at a time"""
+    patchPoly = sphgeom.ConvexPolygon.convexHull(
+        [sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(ra, dec)) for ra, dec in patch])
+    selected = []
+    for row in conn.execute("""SELECT raw.run, raw.camcol, raw.field,
+            ra1, dec1, ra2, dec2, ra3, dec3, ra4, dec4 FROM raw
+            JOIN raw_footprint AS fp ON fp.id = raw.id WHERE raw.filter = ?""", (filter,)):
+        corners = np.array(row[3:]).reshape(4, 2)
+        framePoly = sphgeom.ConvexPolygon.convexHull(
+            [sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(ra, dec)) for ra, dec in corners])
+        if patchPoly.intersects(framePoly):
+            selected.append(row[:3])
+    return selected
+
+
+def main(nRun=300, raMin=-5.0, raMax=5.0, filters="r", htmLevel=9, patchSize=0.44, nPatch=20):
+    random.seed(42)
+    pixelization = sphgeom.HtmPixelization(htmLevel)
+    filter = filters[0]
+    tmpDir = tempfile.mkdtemp()
+    path = os.path.join(tmpDir, "registry.sqlite3")
+    try:
+        t0 = time.time()
+        conn = makeRegistry(path, nRun, raMin, raMax, filters, pixelization)
+        nRows = conn.execute("SELECT COUNT(*) FROM raw").fetchone()[0]
+        print("%d frames in %d runs, built in %.1f sec, %.0f MB" %
+              (nRows, nRun, time.time() - t0, os.path.getsize(path) / 1024.0**2))
+
+        patches = [makeCorners(random.uniform(raMin, raMax) % 360, random.uniform(-1.0, 1.0),
+                               height=patchSize, width=patchSize) for i in range(nPatch)]
+        nSelected = []
+        t0 = time.time()
+        for patch in patches:
+            patchPoly = sphgeom.ConvexPolygon.convexHull(
+                [sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(ra, dec)) for ra, dec in patch])
+            footprints = queryFootprints(conn, patch, skyTileRanges=pixelization.envelope(patchPoly),
+                                         filter=filter)
+            nSelected.append(len(footprints.dataIds))
+        dtFootprints = (time.time() - t0) / nPatch
+        print("  registry footprints: %9.1f msec/patch, %.0f frames/patch" %
+              (dtFootprints*1e3, np.mean(nSelected)))
+
+        nCheck = min(nPatch, 3)
+        t0 = time.time()
+        for patch, n in zip(patches[:nCheck], nSelected[:nCheck]):
+            selected = selectAll(conn, patch, filter)
+            if len(selected) != n:
+                print("  WARNING: %d frames selected one at a time, %d from the footprints" %
+                      (len(selected), n))
+        dtAll = (time.time() - t0) / nCheck
+        print("  every frame in turn: %9.1f msec/patch (speedup %.0fx, before any calexp WCS reads)" %
+              (dtAll*1e3, dtAll / dtFootprints))
+        conn.close()
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
+        os.rmdir(tmpDir)
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--nRun", type="int", default=300, help="number of runs (default=300)")
+    parser.add_option("--raMin", type="float", default=-5.0,
+                      help="start of the runs, in degrees (default=-5)")
+    parser.add_option("--raMax", type="float", default=5.0, help="end of the runs, in degrees (default=5)")
+    parser.add_option("--filters", default="r",
+                      help="filters to register; the first is selected (default=r)")
+    parser.add_option("--htmLevel", type="int", default=9, help="HTM level of the sky tiles (default=9)")
+    parser.add_option("--patchSize", type="float", default=0.44, help="patch size in degrees (default=0.44)")
+    parser.add_option("--nPatch", type="int", default=20, help="number of patches to select (default=20)")
+    (options, args) = parser.parse_args()
+    main(options.nRun, options.raMin, options.raMax, options.filters, options.htmLevel, options.patchSize,
+         options.nPatch)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+"""Compare the peak memory of stitching N fields into a scanline band by band
+(lsst.obs.sdss.scanline.stitchFields) and frame by frame (convertfpC and
+the dense fpM mask of each field, copied into the output).
+
+The test frame stands in for every field.  Each run is in a fresh process;
+the reported number is the growth of the peak resident set size beyond the
+output MaskedImage itself, which should not depend on N when streaming.
+"""
+from optparse import OptionParser
+import multiprocessing
+import os
+import resource
+import sys
+
+RUNDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "tests", "data", "dr7", "runs",
+                      "5754", "40")
+FPC = os.path.join(RUNDIR, "corr", "3", "fpC-005754-r3-0280.fit.gz")
+FPM = os.path.join(RUNDIR, "objcs", "3", "fpM-005754-r3-0280.fit")
+TSFIELD = os.path.join(RUNDIR, "calibChunks", "3", "tsField-005754-3-40-0280.fit")
+PEDESTAL = 1000
+OVERLAP = 128
+
+
+def maxRssMB():
+    # ru_maxrss is in kB on Linux and bytes on macOS
+    scale = 1024.0**2 if sys.platform == "darwin" else 1024.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def bands(nFields, tsField, bandRows):
+    from lsst.obs.sdss.convertfpM import readfpMSpans
+    from lsst.obs.sdss.scanline import ScanlineField, stitchFields
+    fields = [ScanlineField(280 + k, FPC, readfpMSpans(FPM), tsField) for k in range(nFields)]
+    return stitchFields(fields, overlapSize=OVERLAP, pedestal=PEDESTAL, bandRows=bandRows)
+
+
+def frames(nFields, tsField, bandRows):
+    import lsst.afw.image as afwImage
+    from lsst.obs.sdss.convertfpC import convertfpC
+    from lsst.obs.sdss.convertfpM import convertfpM
+    mi = None
+    for k in range(nFields):
+        image = convertfpC(FPC, overlapSize=OVERLAP, pedestal=PEDESTAL).getImage().array
+        mask = convertfpM(FPM)
+        nRows = len(image)
+        if mi is None:
+            mi = afwImage.MaskedImageF(image.shape[1], nRows*nFields)
+            for planeName in mask.getMaskPlaneDict():
+                mi.getMask().addMaskPlane(planeName)
+        rows = slice(k*nRows, (k + 1)*nRows)
+        mi.image.array[rows] = image
+        mi.variance.array[rows] = image / tsField.gain
+        mi.mask.array[rows] = mask.array[:nRows]
+    return mi
+
+
+def measure(name, nFields, bandRows, queue):
+    from lsst.obs.sdss.converttsField import converttsField
+    tsField = converttsField(TSFIELD, "r")
+    before = maxRssMB()
+    mi = globals()[name](nFields, tsField, bandRows)
+    outputMB = mi.getWidth() * mi.getHeight() * (4 + 4 + 4) / 1024.0**2
+    queue.put((name, nFields, maxRssMB() - before - outputMB, outputMB))
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--nFields", default="1,4,16",
+                      help="comma-separated numbers of fields (default=1,4,16)")
+    parser.add_option("--bandRows", type="int", default=256, help="rows per band (default=256)")
+    (options, args) = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    for nFields in [int(n) for n in options.nFields.split(",")]:
+        for name in ("frames", "bands"):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=measure, args=(name, nFields, options.bandRows, queue))
+            proc.start()
+            result = queue.get()
+            proc.join()
+            print("%-7s %3d fields: peak RSS growth %7.1f MB beyond the %.0f MB output" % result)
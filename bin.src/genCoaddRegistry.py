@@ -29,22 +29,37 @@ import re
 import shutil
 import sqlite3
 import sys
+import lsst.sphgeom as sphgeom
+from lsst.obs.sdss.registryUtils import (DirectoryScanner, createRawIndexes, getFramesWithoutFootprint,
+                                         getRegisteredKeys, registerFootprints)
 
 
-def process(dirList, inputRegistry, outputRegistry="registry.sqlite3"):
-    if os.path.exists(outputRegistry):
+def process(dirList, inputRegistry, outputRegistry="registry.sqlite3", update=False,
+            asTransRoot=None, htmLevel=9):
+    if update:
+        if inputRegistry is not None:
+            print("Cannot use an input registry when updating.", file=sys.stderr)
+            sys.exit(1)
+        if not os.path.exists(outputRegistry):
+            print("Registry to update does not exist.", file=sys.stderr)
+            sys.exit(1)
+    elif os.path.exists(outputRegistry):
         print("Output registry exists; will not overwrite.", file=sys.stderr)
         sys.exit(1)
-    if inputRegistry is not None:
+    elif inputRegistry is not None:
         if not os.path.exists(inputRegistry):
             print("Input registry does not exist.", file=sys.stderr)
             sys.exit(1)
         shutil.copy(inputRegistry, outputRegistry)
 
     conn = sqlite3.connect(outputRegistry)
+    if update:
+        # The registry may be in use: apply the whole update in one
+        # transaction, so that a failure leaves it as it was
+        conn.isolation_level = None
+        conn.execute("BEGIN")
 
-    done = {}
-    if inputRegistry is None:
+    if inputRegistry is None and not update:
         # Create tables in new output registry.
         cmd = """CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT,
             run INT, filter TEXT, camcol INT, field INT)"""
@@ -53,31 +68,71 @@ def process(dirList, inputRegistry, outputRegistry="registry.sqlite3"):
         cmd = "CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)"
         # cmd += ", unique(id, skyTile), foreign key(id) references raw(id))"
         conn.execute(cmd)
-    else:
-        cmd = """SELECT run || '_B' || filter ||
-            '_C' || camcol || '_F' || field FROM raw"""
-        for row in conn.execute(cmd):
-            done[row[0]] = True
-
+    # Only an existing registry has frames to look up, which needs the
+    # indexes; those of a new one are created after the bulk load
+    checkRegistered = update or inputRegistry is not None
+    if checkRegistered:
+        createRawIndexes(conn, hasRerun=False, analyze=False)
+    scanner = DirectoryScanner(conn, update)
+
+    succeeded = False
     try:
+        runs = set()
         for dir in dirList:
             for filterDir in glob.iglob(os.path.join(dir, "*")):
-                processBand(filterDir, conn, done)
+                runs.update(processBand(filterDir, conn, scanner, commit=not update,
+                                        checkRegistered=checkRegistered))
+
+        if asTransRoot is not None:
+            # Sky tiles are HTM trixels, computed from the asTrans footprints of the frames
+            def getAsTransPath(run, rerun):
+                # The coadd pieces have no rerun: take the asTrans of the latest one
+                runDir = os.path.join(asTransRoot, str(run))
+                reruns = [int(name) for name in os.listdir(runDir) if name.isdigit()] \
+                    if os.path.isdir(runDir) else []
+                paths = [os.path.join(runDir, str(rerun), "astrom", "asTrans-%06d.fit" % (run,))
+                         for rerun in sorted(reruns, reverse=True)]
+                return next((path for path in paths if os.path.exists(path)), None)
+            nFootprints = registerFootprints(conn, getFramesWithoutFootprint(conn, runs, hasRerun=False),
+                                             getAsTransPath, sphgeom.HtmPixelization(htmLevel))
+            print("%d footprints registered" % (nFootprints,), file=sys.stderr)
+        succeeded = True
     finally:
-        print("Cleaning up...", file=sys.stderr)
-        conn.execute("CREATE INDEX ix_skyTile_id ON raw_skyTile (id)")
-        conn.execute("CREATE INDEX ix_skyTile_tile ON raw_skyTile (skyTile)")
-        conn.commit()
+        if succeeded or not update:
+            print("Cleaning up...", file=sys.stderr)
+            createRawIndexes(conn, hasRerun=False)
+            conn.commit()
+        else:
+            print("Update failed; leaving the registry unchanged", file=sys.stderr)
+            conn.rollback()
         conn.close()
 
 
-def processBand(filterDir, conn, done):
+def processBand(filterDir, conn, scanner, commit=True, checkRegistered=True):
+    """Register the coadd pieces of a filter directory and return the set of their runs
+
+    @param[in] commit  commit as the rows are inserted? If False, the caller commits.
+    @param[in] checkRegistered  skip the pieces already in the registry?  False
+        for a new registry, which has none of them yet.
+    """
+    runs = set()
+    registered = {}
     nProcessed = 0
     nSkipped = 0
     nUnrecognized = 0
     print(filterDir, "... started", file=sys.stderr)
-    for fits in glob.iglob(
-            os.path.join(filterDir, "fpC*_ts_coaddNorm_NN.fit.gz")):
+    # Take the mtime before listing, so files added during the scan are
+    # picked up by the next update
+    mtime = scanner.getMtime(filterDir)
+    if not scanner.needsScan(filterDir, mtime):
+        print(filterDir, "... unchanged", file=sys.stderr)
+        return runs
+    fitsList = glob.glob(os.path.join(filterDir, "fpC*_ts_coaddNorm_NN.fit.gz"))
+    nRemoved = scanner.getRemovedCount(filterDir, len(fitsList))
+    if nRemoved > 0:
+        print("Warning: %d files removed from %s are still registered" % (nRemoved, filterDir),
+              file=sys.stderr)
+    for fits in fitsList:
         m = re.search(r'/([ugriz])/fpC-(\d{6})-\1(\d)-(\d{4})_ts_coaddNorm_NN.fit.gz', fits)
         if not m:
             print("Warning: Unrecognized file:", fits, file=sys.stderr)
@@ -88,32 +143,54 @@ def processBand(filterDir, conn, done):
         camcol = int(camcol)
         run = int(run)
         field = int(field)
-        key = "%d_B%s_C%d_F%d" % (run, filter, camcol, field)
-        if key in done:
-            nSkipped += 1
-            continue
-
-        conn.execute("""INSERT INTO raw VALUES
+        if checkRegistered:
+            if filter not in registered:
+                # Only the frames of the filter being rescanned are looked up
+                registered[filter] = getRegisteredKeys(conn, ("run", "camcol", "field"), filter=filter)
+            if (run, camcol, field) in registered[filter]:
+                nSkipped += 1
+                continue
+
+        conn.execute("""INSERT OR IGNORE INTO raw VALUES
             (NULL, ?, ?, ?, ?)""", (run, filter, camcol, field))
+        runs.add(run)
 
         nProcessed += 1
-        if nProcessed % 100 == 0:
+        if commit and nProcessed % 100 == 0:
             conn.commit()
 
-    conn.commit()
+    scanner.record(filterDir, mtime, len(fitsList))
+    if commit:
+        conn.commit()
     print(filterDir,
           "... %d processed, %d skipped, %d unrecognized" %
           (nProcessed, nSkipped, nUnrecognized), file=sys.stderr)
+    return runs
 
 
 if __name__ == "__main__":
     parser = OptionParser(usage="""%prog [options] DIR ...
 
-DIR should contain a directory per filter containing coadd pieces.""")
+DIR should contain a directory per filter containing coadd pieces.
+
+With --update, the output registry is updated in place: only filter
+directories that changed since they were last registered are rescanned.
+
+With --asTransRoot, the footprint of each frame is computed from the
+asTrans file of its run under that directory (a 'runs' directory, as
+given to genInputRegistry.py) and recorded in raw_footprint, and the HTM
+trixels (of level --htmLevel) it overlaps in raw_skyTile.""")
     parser.add_option("-i", dest="inputRegistry", help="input registry")
     parser.add_option("-o", dest="outputRegistry", default="registry.sqlite3",
                       help="output registry (default=registry.sqlite3)")
+    parser.add_option("--update", dest="update", action="store_true", default=False,
+                      help="update the existing output registry with new coadd pieces")
+    parser.add_option("--asTransRoot", dest="asTransRoot",
+                      help="root directory of the runs' asTrans files, to record sky tiles")
+    parser.add_option("--htmLevel", dest="htmLevel", type="int", default=9,
+                      help="HTM level of the sky tiles (default=9)")
     (options, args) = parser.parse_args()
     if len(args) < 1:
         parser.error("Missing directory argument(s)")
-    process(args, options.inputRegistry, options.outputRegistry)
+    process(args, options.inputRegistry, options.outputRegistry, options.update,
+            options.asTransRoot, options.htmLevel)
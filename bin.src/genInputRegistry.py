@@ -23,30 +23,55 @@
 #
 
 import glob
+import itertools
+import multiprocessing
 from optparse import OptionParser
 import os
+import random
 import re
 import shutil
 import sqlite3
 import sys
+import time
 import lsst.daf.base as dafBase
+import lsst.sphgeom as sphgeom
 from lsst.afw.fits import readMetadata
+from lsst.obs.sdss.converttsField import getTsFieldTable
+from lsst.obs.sdss.registryUtils import (DirectoryScanner, createRawIndexes, getFramesWithoutFootprint,
+                                         getRegisteredKeys, registerFootprints)
 
 
-def process(dirList, inputRegistry, outputRegistry="registry.sqlite3"):
-    if os.path.exists(outputRegistry):
+def process(dirList, inputRegistry, outputRegistry="registry.sqlite3", nProc=1, update=False,
+            headerFree=False, nCheck=10, htmLevel=9):
+    if update:
+        if inputRegistry is not None:
+            print("Cannot use an input registry when updating.", file=sys.stderr)
+            sys.exit(1)
+        if not os.path.exists(outputRegistry):
+            print("Registry to update does not exist.", file=sys.stderr)
+            sys.exit(1)
+    elif os.path.exists(outputRegistry):
         print("Output registry exists; will not overwrite.", file=sys.stderr)
         sys.exit(1)
-    if inputRegistry is not None:
+    elif inputRegistry is not None:
         if not os.path.exists(inputRegistry):
             print("Input registry does not exist.", file=sys.stderr)
             sys.exit(1)
         shutil.copy(inputRegistry, outputRegistry)
 
     conn = sqlite3.connect(outputRegistry)
+    if update:
+        # The registry may be in use: keep its journal mode, and apply the
+        # whole update in one transaction so that a failure leaves it as it was
+        conn.isolation_level = None
+        conn.execute("BEGIN")
+    else:
+        # Nothing reads a new registry while it is being built, so trade
+        # durability for speed during the bulk load
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=OFF")
 
-    done = {}
-    if inputRegistry is None:
+    if inputRegistry is None and not update:
         # Create tables in new output registry.
         cmd = """CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT,
             run INT, rerun INT, filter TEXT, camcol INT, field INT,
@@ -56,91 +81,278 @@ def process(dirList, inputRegistry, outputRegistry="registry.sqlite3"):
         cmd = "CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)"
         # cmd += ", unique(id, skyTile), foreign key(id) references raw(id))"
         conn.execute(cmd)
-    else:
-        cmd = """SELECT run || '_R' || rerun || '_B' || filter ||
-            '_C' || camcol || '_F' || field FROM raw"""
-        for row in conn.execute(cmd):
-            done[row[0]] = True
+    # Only an existing registry has frames to look up, which needs the
+    # indexes; those of a new one are created after the bulk load
+    checkRegistered = update or inputRegistry is not None
+    if checkRegistered:
+        createRawIndexes(conn, analyze=False)
+    scanner = DirectoryScanner(conn, update)
+    # Sky tiles are HTM trixels, computed from the asTrans footprints of the frames
+    pixelization = sphgeom.HtmPixelization(htmLevel) if htmLevel is not None else None
 
+    pool = multiprocessing.Pool(nProc) if nProc > 1 else None
+    t0 = time.time()
+    nTotal = 0
+    succeeded = False
     try:
         for dir in dirList:
             if dir.endswith("runs"):
                 for runDir in glob.iglob(os.path.join(dir, "*")):
-                    processRun(runDir, conn, done)
+                    nTotal += processRun(runDir, conn, scanner, pool, headerFree, nCheck, pixelization,
+                                         checkRegistered=checkRegistered)
             else:
-                processRun(dir, conn, done)
+                nTotal += processRun(dir, conn, scanner, pool, headerFree, nCheck, pixelization,
+                                     checkRegistered=checkRegistered)
+        succeeded = True
     finally:
-        print("Cleaning up...", file=sys.stderr)
-        conn.execute("""CREATE UNIQUE INDEX uq_raw ON raw
-                (run, filter, camcol, field)""")
-        conn.execute("CREATE INDEX ix_skyTile_id ON raw_skyTile (id)")
-        conn.execute("CREATE INDEX ix_skyTile_tile ON raw_skyTile (skyTile)")
-        conn.commit()
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if succeeded or not update:
+            print("Cleaning up...", file=sys.stderr)
+            createRawIndexes(conn)
+            conn.commit()
+        else:
+            print("Update failed; leaving the registry unchanged", file=sys.stderr)
+            conn.rollback()
+        if not update:
+            # Leave a single self-contained file that read-only users can open
+            conn.execute("PRAGMA journal_mode=DELETE")
         conn.close()
+    elapsed = time.time() - t0
+    print("%d files registered in %.1f sec (%.1f files/sec)" %
+          (nTotal, elapsed, nTotal / max(elapsed, 1e-9)), file=sys.stderr)
+
+
+def readFrameInfo(frame):
+    """Return the registry row of a frame, reading its header
+
+    @param[in] frame  (path, run, rerun, filter, camcol, field) of an fpC file
+    """
+    fits, run, rerun, filter, camcol, field = frame
+    md = readMetadata(fits)
+    date = md.getScalar("DATE-OBS")
+    if date.find("-") != -1:
+        (year, month, day) = md.getScalar("DATE-OBS").split("-")
+    else:
+        (day, month, year) = md.getScalar("DATE-OBS").split("/")
+        year = 1900 + int(year)
+    (hour, minute, second) = md.getScalar("TAIHMS").split(":")
+    seconds = float(second)
+    second = int(seconds)
+    taiObs = dafBase.DateTime(int(year), int(month), int(day), int(hour),
+                              int(minute), second, dafBase.DateTime.TAI)
+    taiObs = dafBase.DateTime(taiObs.nsecs()
+                              + int((seconds - second) * 1000000000), dafBase.DateTime.TAI)
+    taiObs = taiObs.toString(dafBase.DateTime.UTC)[:-1]
+    strip = "%d%s" % (md.getScalar('STRIPE'), md.getScalar('STRIP'))
+    return (run, rerun, filter, camcol, field, taiObs, strip)
+
+
+def getCalibInfo(runDir, run, rerun, camcol):
+    """Return the TsFieldTable and strip of a (run, rerun, camcol) from its tsField files
+
+    @return (TsFieldTable, strip), or None if there are no tsField files
+    """
+    calibDir = os.path.join(runDir, str(rerun), "calibChunks", str(camcol))
+    tsFieldList = glob.glob(os.path.join(calibDir, "tsField-%06d-%d-*.fit" % (run, camcol)))
+    if len(tsFieldList) == 0:
+        return None
+    md = readMetadata(tsFieldList[0])
+    strip = "%d%s" % (md.getScalar('STRIPE'), md.getScalar('STRIP').strip())
+    return getTsFieldTable(calibDir, run, camcol), strip
+
+
+def deriveFrameInfo(frame, calibInfo):
+    """Return the registry row of a frame from its tsField data, or None if there is none
+
+    The tsField mjd is the TAI at which row 0 of the frame was read, as is
+    TAIHMS in the fpC header (which only has a precision of 0.01 sec).
+
+    @param[in] frame  (path, run, rerun, filter, camcol, field) of an fpC file
+    @param[in] calibInfo  (TsFieldTable, strip) as returned by getCalibInfo, or None
+    """
+    fits, run, rerun, filter, camcol, field = frame
+    if calibInfo is None:
+        return None
+    table, strip = calibInfo
+    idx = table.getRowIndex(field)
+    if idx is None:
+        return None
+    mjd = float(table.columns["mjd"][idx, table.filters.index(filter)])
+    taiObs = dafBase.DateTime(mjd, dafBase.DateTime.MJD, dafBase.DateTime.TAI)
+    taiObs = taiObs.toString(dafBase.DateTime.UTC)[:-1]
+    return (run, rerun, filter, camcol, field, taiObs, strip)
 
 
-def processRun(runDir, conn, done):
+def checkFrameInfo(derived, fromHeader, tolerance=0.02):
+    """Return whether a row derived from tsField data agrees with the one from the fpC header"""
+    def toNsecs(taiObs):
+        return dafBase.DateTime(taiObs + "Z", dafBase.DateTime.UTC).nsecs()
+    return derived[:5] == fromHeader[:5] and derived[6] == fromHeader[6] and \
+        abs(toNsecs(derived[5]) - toNsecs(fromHeader[5])) <= tolerance*1e9
+
+
+def processRun(runDir, conn, scanner, pool=None, headerFree=False, nCheck=10, pixelization=None,
+               batchSize=1000, checkRegistered=True):
+    """Register the frames of a run directory and return the number registered
+
+    @param[in] checkRegistered  skip the frames already in the registry?  False
+        for a new registry, which has none of the run's frames yet.
+    """
     nProcessed = 0
     nSkipped = 0
     nUnrecognized = 0
     print(runDir, "... started", file=sys.stderr)
-    for fits in glob.iglob(
-            os.path.join(runDir, "*", "corr", "[1-6]", "fpC*.fit.gz")):
-        m = re.search(r'(\d+)/corr/([1-6])/fpC-(\d{6})-([ugriz])\2-(\d{4}).fit.gz', fits)
-        if not m:
-            print("Warning: Unrecognized file:", fits, file=sys.stderr)
-            nUnrecognized += 1
+    t0 = time.time()
+    frames = []
+    scanned = []
+    registered = {}
+    nUnchanged = 0
+    for camcolDir in glob.iglob(os.path.join(runDir, "*", "corr", "[1-6]")):
+        # Take the mtime before listing, so files added during the scan
+        # are picked up by the next update
+        mtime = scanner.getMtime(camcolDir)
+        if not scanner.needsScan(camcolDir, mtime):
+            nUnchanged += 1
             continue
+        fitsList = glob.glob(os.path.join(camcolDir, "fpC*.fit.gz"))
+        nRemoved = scanner.getRemovedCount(camcolDir, len(fitsList))
+        if nRemoved > 0:
+            print("Warning: %d files removed from %s are still registered" % (nRemoved, camcolDir),
+                  file=sys.stderr)
+        scanned.append((camcolDir, mtime, len(fitsList)))
+        for fits in fitsList:
+            m = re.search(r'(\d+)/corr/([1-6])/fpC-(\d{6})-([ugriz])\2-(\d{4}).fit.gz', fits)
+            if not m:
+                print("Warning: Unrecognized file:", fits, file=sys.stderr)
+                nUnrecognized += 1
+                continue
 
-        (rerun, camcol, run, filter, field) = m.groups()
-        rerun = int(rerun)
-        camcol = int(camcol)
-        run = int(run)
-        field = int(field)
-        key = "%d_R%d_B%s_C%d_F%d" % (run, rerun, filter, camcol, field)
-        if key in done or rerun < 40:
-            nSkipped += 1
-            continue
+            (rerun, camcol, run, filter, field) = m.groups()
+            rerun = int(rerun)
+            camcol = int(camcol)
+            run = int(run)
+            field = int(field)
+            if rerun < 40:
+                nSkipped += 1
+                continue
+            if checkRegistered:
+                if (run, camcol) not in registered:
+                    # Only the frames of the camcols being rescanned are looked up
+                    registered[(run, camcol)] = getRegisteredKeys(conn, ("rerun", "filter", "field"),
+                                                                  run=run, camcol=camcol)
+                if (rerun, filter, field) in registered[(run, camcol)]:
+                    nSkipped += 1
+                    continue
+            frames.append((fits, run, rerun, filter, camcol, field))
 
-        md = readMetadata(fits)
-        date = md.getScalar("DATE-OBS")
-        if date.find("-") != -1:
-            (year, month, day) = md.getScalar("DATE-OBS").split("-")
-        else:
-            (day, month, year) = md.getScalar("DATE-OBS").split("/")
-            year = 1900 + int(year)
-        (hour, minute, second) = md.getScalar("TAIHMS").split(":")
-        seconds = float(second)
-        second = int(seconds)
-        taiObs = dafBase.DateTime(int(year), int(month), int(day), int(hour),
-                                  int(minute), second, dafBase.DateTime.TAI)
-        taiObs = dafBase.DateTime(taiObs.nsecs()
-                                  + int((seconds - second) * 1000000000), dafBase.DateTime.TAI)
-        taiObs = taiObs.toString(dafBase.DateTime.UTC)[:-1]
-        strip = "%d%s" % (md.getScalar('STRIPE'), md.getScalar('STRIP'))
-        conn.execute("""INSERT INTO raw VALUES
-            (NULL, ?, ?, ?, ?, ?, ?, ?)""",
-                     (run, rerun, filter, camcol, field, taiObs, strip))
-
-        nProcessed += 1
-        if nProcessed % 100 == 0:
-            conn.commit()
+    derived = []
+    if headerFree:
+        # Take the rows from the tsField files of each camcol, rather than
+        # decompressing every fpC; frames without tsField data fall back to
+        # their headers
+        calibInfo = {}
+        headerFrames = []
+        for frame in frames:
+            fits, run, rerun, filter, camcol, field = frame
+            if (rerun, camcol) not in calibInfo:
+                calibInfo[(rerun, camcol)] = getCalibInfo(runDir, run, rerun, camcol)
+            row = deriveFrameInfo(frame, calibInfo[(rerun, camcol)])
+            if row is None:
+                headerFrames.append(frame)
+            else:
+                derived.append((frame, row))
+        frames = headerFrames
+
+        # Cross-check a sample of the derived rows against the headers
+        sample = random.sample(derived, min(nCheck, len(derived)))
+        checkRows = (pool.map if pool is not None else map)(readFrameInfo, [frame for frame, row in sample])
+        nBad = 0
+        for (frame, row), fromHeader in zip(sample, checkRows):
+            if not checkFrameInfo(row, fromHeader):
+                print("Warning: %s: row %s from tsField does not match %s from header" %
+                      (frame[0], row, fromHeader), file=sys.stderr)
+                nBad += 1
+        print(runDir, "... %d rows from tsField; %d of %d checked against headers disagree" %
+              (len(derived), nBad, len(sample)), file=sys.stderr)
+
+    # Headers are read by the pool, rows inserted in batches in the caller
+    if pool is not None:
+        rows = pool.imap_unordered(readFrameInfo, frames, chunksize=16)
+    else:
+        rows = map(readFrameInfo, frames)
+    nFrames = len(frames) + len(derived)
+    batch = []
+    runs = set()
+    for row in itertools.chain((row for frame, row in derived), rows):
+        runs.add(row[0])
+        batch.append(row)
+        if len(batch) >= batchSize:
+            insertRows(conn, batch)
+            nProcessed += len(batch)
+            batch = []
+            print(runDir, "... %d/%d processed (%.1f files/sec)" %
+                  (nProcessed, nFrames, nProcessed / (time.time() - t0)), file=sys.stderr)
+    insertRows(conn, batch)
+    nProcessed += len(batch)
+    for camcolDir, mtime, nFiles in scanned:
+        scanner.record(camcolDir, mtime, nFiles)
+
+    if pixelization is not None:
+        def getAsTransPath(run, rerun):
+            return os.path.join(runDir, str(rerun), "astrom", "asTrans-%06d.fit" % (run,))
+        nFootprints = registerFootprints(conn, getFramesWithoutFootprint(conn, runs), getAsTransPath,
+                                         pixelization)
+        print(runDir, "... %d footprints registered" % (nFootprints,), file=sys.stderr)
 
-    conn.commit()
     print(runDir,
-          "... %d processed, %d skipped, %d unrecognized" %
-          (nProcessed, nSkipped, nUnrecognized), file=sys.stderr)
+          "... %d processed, %d skipped, %d unrecognized, %d directories unchanged in %.1f sec "
+          "(%.1f files/sec)" %
+          (nProcessed, nSkipped, nUnrecognized, nUnchanged, time.time() - t0,
+           nProcessed / max(time.time() - t0, 1e-9)), file=sys.stderr)
+    return nProcessed
+
+
+def insertRows(conn, rows):
+    conn.executemany("""INSERT OR IGNORE INTO raw VALUES
+        (NULL, ?, ?, ?, ?, ?, ?, ?)""", rows)
 
 
 if __name__ == "__main__":
     parser = OptionParser(usage="""%prog [options] DIR ...
 
 DIR may be either a root directory containing a 'raw' subdirectory
-or a visit subdirectory.""")
+or a visit subdirectory.
+
+With --update, the output registry is updated in place: only directories
+that changed since they were last registered are rescanned.
+
+With --noHeaders, taiObs and strip are taken from the tsField files of each
+camcol instead of the fpC headers, which are only read for a sample of
+frames (--nCheck per run) to check the result, and for frames without
+tsField data.
+
+The footprint of each frame is computed from the asTrans file of its run
+and recorded in raw_footprint, and the HTM trixels (of level --htmLevel)
+it overlaps in raw_skyTile.""")
     parser.add_option("-i", dest="inputRegistry", help="input registry")
     parser.add_option("-o", dest="outputRegistry", default="registry.sqlite3",
                       help="output registry (default=registry.sqlite3)")
+    parser.add_option("-j", dest="nProc", type="int", default=1,
+                      help="number of processes reading headers (default=1)")
+    parser.add_option("--update", dest="update", action="store_true", default=False,
+                      help="update the existing output registry with new frames")
+    parser.add_option("--noHeaders", dest="headerFree", action="store_true", default=False,
+                      help="take taiObs and strip from the tsField files rather than fpC headers")
+    parser.add_option("--nCheck", dest="nCheck", type="int", default=10,
+                      help="with --noHeaders, number of fpC headers per run to check (default=10)")
+    parser.add_option("--htmLevel", dest="htmLevel", type="int", default=9,
+                      help="HTM level of the sky tiles (default=9)")
+    parser.add_option("--noSkyTiles", dest="skyTiles", action="store_false", default=True,
+                      help="do not record frame footprints and sky tiles")
     (options, args) = parser.parse_args()
     if len(args) < 1:
         parser.error("Missing directory argument(s)")
-    process(args, options.inputRegistry, options.outputRegistry)
+    process(args, options.inputRegistry, options.outputRegistry, options.nProc, options.update,
+            options.headerFree, options.nCheck, options.htmLevel if options.skyTiles else None)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+
+import functools
+import multiprocessing
+from optparse import OptionParser
+import os
+import sys
+import time
+
+from lsst.obs.sdss.convertasTrans import fitAsTransTable, getAsTrans, getSidecarPath, writeWcsSidecar
+
+
+def fitExtension(args, stepSize, order):
+    infile, camcol, filt = args
+    return fitAsTransTable(getAsTrans(infile), camcol, filt, stepSize=stepSize, order=order)
+
+
+def process(asTransList, nProc=1, stepSize=50, order=4, clobber=False):
+    pool = multiprocessing.Pool(nProc) if nProc > 1 else None
+    try:
+        for infile in asTransList:
+            outfile = getSidecarPath(infile)
+            if os.path.exists(outfile) and not clobber:
+                print(outfile, "exists; skipping", file=sys.stderr)
+                continue
+
+            t0 = time.time()
+            asTrans = getAsTrans(infile)
+            extList = [(infile, camcol, filt) for camcol in asTrans.camcols for filt in asTrans.filters]
+            fitter = functools.partial(fitExtension, stepSize=stepSize, order=order)
+            if pool is not None:
+                rows = pool.map(fitter, extList)
+            else:
+                rows = [fitter(ext) for ext in extList]
+            writeWcsSidecar(outfile, rows)
+
+            print(infile, "... %d fields fit in %.1f sec" %
+                  (sum(len(r) for r in rows), time.time() - t0), file=sys.stderr)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="""%prog [options] ASTRANS ...
+
+Fit a TAN-SIP WCS for every field of each asTrans file and write them to a
+sidecar file next to it, which SdssMapper reads instead of fitting.""")
+    parser.add_option("-j", dest="nProc", type="int", default=1,
+                      help="number of processes (default=1)")
+    parser.add_option("--stepSize", dest="stepSize", type="int", default=50,
+                      help="spacing of the fit grid in pixels (default=50)")
+    parser.add_option("--order", dest="order", type="int", default=4,
+                      help="SIP polynomial order (default=4)")
+    parser.add_option("--clobber", dest="clobber", action="store_true", default=False,
+                      help="overwrite existing sidecar files")
+    (options, args) = parser.parse_args()
+    if len(args) < 1:
+        parser.error("Missing asTrans file argument(s)")
+    process(args, options.nProc, options.stepSize, options.order, options.clobber)
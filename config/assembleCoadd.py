@@ -1,6 +1,12 @@
 # overrides for pipe_tasks CoaddTask.ConfigClass
+from lsst.obs.sdss.sdssSelectImages import SdssSelectImagesTask
+
 config.subregionSize = (2500, 2500)
 config.sigmaClip = 5
 
 # Configs for deep coadd
 config.coaddName = 'deep'
+
+# Select the frames overlapping each patch from the footprints in the registry,
+# rather than by reading the WCS of every calexp
+config.select.retarget(SdssSelectImagesTask)
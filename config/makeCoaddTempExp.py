@@ -1,5 +1,11 @@
 # overrides for pipe_tasks CoaddTask.ConfigClass
+from lsst.obs.sdss.sdssSelectImages import SdssSelectImagesTask
+
 config.doOverwrite = True
 
 # Configs for deep coadd
 config.coaddName = 'deep'
+
+# Select the frames overlapping each patch from the footprints in the registry,
+# rather than by reading the WCS of every calexp
+config.select.retarget(SdssSelectImagesTask)
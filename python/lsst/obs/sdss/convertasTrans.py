@@ -19,20 +19,27 @@
 # the GNU General Public License along with this program.  If not,
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
+import os
 import sys
+import collections
 
 from astropy.io import fits
 import numpy as np
 
+import astshim as ast
 import lsst.afw.image as afwImage
-from lsst.afw.geom import makeSkyWcs
+from lsst.afw.geom import makeSkyWcs, makeTanSipWcs, SkyWcs
 import lsst.afw.table as afwTable
 import lsst.geom as geom
 import lsst.meas.astrom.sip as sip
 
+from lsst.obs.sdss.fileCache import FileCache
+
 deg2rad = np.pi / 180.
 rad2deg = 180. / np.pi
 
+TanSipSolution = collections.namedtuple("TanSipSolution", "crpix crval cd sipA sipB sipAp sipBp")
+
 
 class CoordinateMapper(object):
     # COMMENT mu nu are defined as:
@@ -176,6 +183,159 @@ def createWcs(x, y, mapper, order=4, cOffset=1.0):
     return wcs
 
 
+def skyToTangentPlane(ra_rad, dec_rad, ra0_rad, dec0_rad):
+    """Gnomonic projection of sky positions about a tangent point
+
+    @return standard coordinates xi, eta in degrees
+    """
+    cosDec = np.cos(dec_rad)
+    cosDec0 = np.cos(dec0_rad)
+    sinDec0 = np.sin(dec0_rad)
+    dRa = ra_rad - ra0_rad
+    cosC = sinDec0 * np.sin(dec_rad) + cosDec0 * cosDec * np.cos(dRa)
+    xi = cosDec * np.sin(dRa) / cosC
+    eta = (cosDec0 * np.sin(dec_rad) - sinDec0 * cosDec * np.cos(dRa)) / cosC
+    return xi * rad2deg, eta * rad2deg
+
+
+def _polyTerms(order, minOrder=1):
+    """Return the (p, q) powers of the SIP polynomial terms minOrder <= p + q <= order"""
+    return [(p, n - p) for n in range(minOrder, order + 1) for p in range(n, -1, -1)]
+
+
+def _fitPoly(u, v, values, terms, scale):
+    """Least-squares fit of values to sum(c_pq u^p v^q) for the given terms
+
+    u and v are scaled by 1/scale while fitting to keep the design matrix well conditioned.
+
+    @return coefficients with shape (len(terms), values.shape[1])
+    """
+    us = u / scale
+    vs = v / scale
+    design = np.stack([us**p * vs**q for p, q in terms], axis=1)
+    coeffs = np.linalg.lstsq(design, values, rcond=None)[0]
+    norm = np.array([scale**(p + q) for p, q in terms])
+    return coeffs / norm[:, np.newaxis]
+
+
+def _sipMatrices(terms, coeffs, order):
+    """Pack fitted coefficients into SIP A and B matrices indexed [p, q]"""
+    sipA = np.zeros((order + 1, order + 1))
+    sipB = np.zeros((order + 1, order + 1))
+    for (p, q), (a, b) in zip(terms, coeffs):
+        sipA[p, q] = a
+        sipB[p, q] = b
+    return sipA, sipB
+
+
+def fitTanSip(x, y, ra_rad, dec_rad, order=4):
+    """Fit a TAN-SIP solution directly to arrays of pixel and sky positions
+
+    The tangent point is at the first position, which is assumed to be
+    exact, so the polynomials have no constant term.  The linear terms of
+    the fit give the CD matrix and the remaining terms the SIP distortion.
+
+    @param[in] x, y  pixel positions (LSST convention)
+    @param[in] ra_rad, dec_rad  sky positions (radians)
+    @param[in] order  order of the SIP polynomials
+
+    @return a TanSipSolution; crpix and crval are (x, y) and (ra, dec) in degrees
+    """
+    crpix = np.array([x[0], y[0]], dtype=float)
+    crval = np.array([np.mod(ra_rad[0] * rad2deg, 360.0), dec_rad[0] * rad2deg])
+    xi, eta = skyToTangentPlane(ra_rad, dec_rad, ra_rad[0], dec_rad[0])
+
+    u = x - crpix[0]
+    v = y - crpix[1]
+    scale = max(np.abs(u).max(), np.abs(v).max(), 1.0)
+
+    # Forward: (xi, eta) = CD (u + f(u, v), v + g(u, v))
+    terms = _polyTerms(order)
+    coeffs = _fitPoly(u, v, np.stack([xi, eta], axis=1), terms, scale)
+    cd = np.array([[coeffs[terms.index((1, 0)), 0], coeffs[terms.index((0, 1)), 0]],
+                   [coeffs[terms.index((1, 0)), 1], coeffs[terms.index((0, 1)), 1]]])
+    distortion = coeffs.dot(np.linalg.inv(cd).T)
+    distortion[[terms.index((1, 0)), terms.index((0, 1))]] = 0.0
+    sipA, sipB = _sipMatrices(terms, distortion, order)
+
+    # Reverse: u = U + AP(U, V), with (U, V) the undistorted intermediate pixel positions
+    uv = np.stack([xi, eta], axis=1).dot(np.linalg.inv(cd).T)
+    reverseTerms = _polyTerms(order, minOrder=0)
+    reverse = _fitPoly(uv[:, 0], uv[:, 1], np.stack([u, v], axis=1) - uv, reverseTerms, scale)
+    sipAp, sipBp = _sipMatrices(reverseTerms, reverse, order)
+
+    return TanSipSolution(crpix=crpix, crval=crval, cd=cd, sipA=sipA, sipB=sipB, sipAp=sipAp, sipBp=sipBp)
+
+
+def makeWcsFromSolution(solution):
+    """Make a SkyWcs from a TanSipSolution"""
+    return makeTanSipWcs(crpix=geom.Point2D(*solution.crpix),
+                         crval=geom.SpherePoint(solution.crval[0], solution.crval[1], geom.degrees),
+                         cdMatrix=solution.cd,
+                         sipA=solution.sipA, sipB=solution.sipB,
+                         sipAp=solution.sipAp, sipBp=solution.sipBp)
+
+
+def createWcsVectorized(x, y, mapper, order=4):
+    """Create a TAN-SIP SkyWcs by fitting the mapper on NumPy arrays
+
+    This is equivalent to createWcs but solves the least-squares problem
+    directly rather than through a list of reference matches.
+    """
+    ra_rad, dec_rad = mapper.xyToRaDec(x, y)
+    return makeWcsFromSolution(fitTanSip(x, y, ra_rad, dec_rad, order=order))
+
+
+def createExactWcs(mapper):
+    """Create a SkyWcs that evaluates the asTrans transform exactly
+
+    The pixel to (mu, nu) polynomial and the rotation from great circle
+    coordinates to (RA, Dec) are encoded as AST mappings, so there is no
+    fit and no fit residual.  The inverse of the polynomial is iterative.
+    SkyWcs needs a PIXELS -> IWC -> SKY frame chain, so the great circle
+    coordinates (mu, nu), in degrees, serve as the intermediate world
+    coordinates: the polynomial maps PIXELS to IWC and the rotation IWC to SKY.
+
+    @param[in] mapper  CoordinateMapper for the field
+
+    @return an lsst.afw.geom.SkyWcs
+    """
+    m = mapper
+    # (x, y) in LSST pixels -> (col, row) in SDSS pixels
+    pixelToSdss = ast.ShiftMap([m.cOff, m.cOff])
+
+    # (col, row) -> (mu, nu) in degrees; rowm and colm are cubic in col and linear in row
+    coeff_f = []
+    for out, (zero, bRow, cCol) in enumerate([(m.a, m.b, m.c), (m.d, m.e, m.f)], 1):
+        coeff_f += [
+            [zero + bRow*m.dRow0 + cCol*m.dCol0, out, 0, 0],
+            [bRow*m.dRow1 + cCol*(1.0 + m.dCol1), out, 1, 0],
+            [bRow*m.dRow2 + cCol*m.dCol2, out, 2, 0],
+            [bRow*m.dRow3 + cCol*m.dCol3, out, 3, 0],
+            [bRow, out, 0, 1],
+        ]
+    sdssToMuNu = ast.PolyMap(np.array(coeff_f, dtype=float), 2, "IterInverse=1, TolInverse=1.0e-10")
+
+    # (mu, nu) -> (RA, Dec) in radians: rotate about the x axis by the inclination,
+    # measuring longitudes from the node
+    cosIncl = np.cos(m.incl_rad)
+    sinIncl = np.sin(m.incl_rad)
+    rotation = np.array([[1.0, 0.0, 0.0],
+                         [0.0, cosIncl, -sinIncl],
+                         [0.0, sinIncl, cosIncl]])
+    muNuToRaDec = ast.ZoomMap(2, deg2rad) \
+        .then(ast.ShiftMap([-m.node_rad, 0.0])) \
+        .then(ast.SphMap("UnitRadius=1").inverted()) \
+        .then(ast.MatrixMap(rotation)) \
+        .then(ast.SphMap("UnitRadius=1")) \
+        .then(ast.ShiftMap([m.node_rad, 0.0]))
+
+    frameDict = ast.FrameDict(ast.Frame(2, "Domain=PIXELS"), pixelToSdss.then(sdssToMuNu).simplified(),
+                              ast.Frame(2, "Domain=IWC"))
+    frameDict.addFrame("IWC", muNuToRaDec.simplified(), ast.SkyFrame("Domain=SKY, System=ICRS"))
+    return SkyWcs(frameDict)
+
+
 def validate(xs, ys, mapper, wcs):
     dists = []
     for i in range(len(xs)):
@@ -188,7 +348,56 @@ def validate(xs, ys, mapper, wcs):
     print(np.mean(dists), np.std(dists))
 
 
-def convertasTrans(infile, filt, camcol, field, stepSize=50, doValidate=False):
+class AsTransRun(object):
+    """The contents of a whole-run asTrans file, parsed into NumPy columns
+
+    Each camcol/filter extension is stored as a dict of column name to
+    array, plus a dict mapping field number to row index, so that looking up
+    the transform of one field is a dictionary hit plus a row index.
+
+    @param[in] node_rad  RA of the great circle's ascending node (radians)
+    @param[in] incl_rad  inclination of the great circle (radians)
+    @param[in] camcols  list of camcols in the file
+    @param[in] filters  list of filters in the file
+    @param[in] tables  dict of (camcol, filter): dict of column name: array
+    """
+    columns = ("field", "dRow0", "dRow1", "dRow2", "dRow3", "dCol0", "dCol1", "dCol2", "dCol3",
+               "a", "b", "c", "d", "e", "f")
+
+    def __init__(self, node_rad, incl_rad, camcols, filters, tables):
+        self.node_rad = node_rad
+        self.incl_rad = incl_rad
+        self.camcols = camcols
+        self.filters = filters
+        self.tables = tables
+        self.fieldIndex = dict((key, dict((int(fld), i) for i, fld in enumerate(table["field"])))
+                               for key, table in tables.items())
+
+    def getTable(self, camcol, filt):
+        """Return the dict of columns for one camcol/filter, or None if not present"""
+        return self.tables.get((camcol, filt))
+
+    def getRowIndex(self, camcol, filt, field):
+        """Return the row index of a field in its camcol/filter table, or None if not present"""
+        return self.fieldIndex.get((camcol, filt), {}).get(field)
+
+    def makeMapper(self, camcol, filt, field):
+        """Return a CoordinateMapper for one field, or None if the field is not present"""
+        idx = self.getRowIndex(camcol, filt, field)
+        if idx is None:
+            return None
+        table = self.tables[(camcol, filt)]
+        coeffs = [table[name][idx] for name in self.columns[1:]]
+        return CoordinateMapper(self.node_rad, self.incl_rad, *coeffs)
+
+
+def readAsTrans(infile):
+    """Parse every camcol/filter extension of an asTrans file
+
+    @param[in] infile  path to asTrans FITS file
+
+    @return an AsTransRun
+    """
     with fits.open(infile) as hdulist:
         t0 = hdulist[0].header['ccdarray']
         if t0 != 'photo':
@@ -198,65 +407,252 @@ def convertasTrans(infile, filt, camcol, field, stepSize=50, doValidate=False):
         filters = hdulist[0].header['filters']
         node_deg = hdulist[0].header['node']
         incl_deg = hdulist[0].header['incl']
-        node_rad = node_deg * deg2rad
-        incl_rad = incl_deg * deg2rad
 
         cList = [int(cc) for cc in camcols.split()]
         fList = filters.split()
 
-        try:
-            cIdx = cList.index(camcol)
-        except Exception:
-            print("Cannot extract data for camcol %s" % (camcol))
+        tables = {}
+        for cIdx, camcol in enumerate(cList):
+            for fIdx, filt in enumerate(fList):
+                ext = cIdx * len(fList) + (fIdx + 1)
+                if ext >= len(hdulist):
+                    continue
+                ehdr = hdulist[ext].header
+                edat = hdulist[ext].data
+                # Leave out extensions that are not where we expect them,
+                # so that lookups for them fail
+                if ehdr['CAMCOL'] != camcol or ehdr['FILTER'] != filt or edat is None:
+                    continue
+                table = dict((name, np.array(edat.field(name), dtype=np.float64))
+                             for name in AsTransRun.columns)
+                table["field"] = np.array(edat.field("field"), dtype=np.int32)
+                tables[(camcol, filt)] = table
+
+    return AsTransRun(node_deg * deg2rad, incl_deg * deg2rad, cList, fList, tables)
+
+
+# Whole-run asTrans files are shared by every field, camcol and filter of a run
+_asTransCache = FileCache(maxSize=16)
+
+
+def getAsTrans(infile):
+    """Return the parsed contents of an asTrans file, reading it only on a cache miss
+
+    @param[in] infile  path to asTrans FITS file
+
+    @return an AsTransRun
+    """
+    return _asTransCache.get(infile, readAsTrans)
+
+
+# Dimensions of an fpC frame, including the overlap with the next field
+FRAME_WIDTH = 2048
+FRAME_HEIGHT = 1489
+
+
+def makeFitGrid(stepSize=50):
+    """Return the flattened x, y pixel grid, covering an fpC frame, used to fit TAN-SIP solutions"""
+    x = np.arange(0, FRAME_WIDTH+stepSize, stepSize)
+    y = np.arange(0, FRAME_HEIGHT+stepSize, stepSize)
+    coords = np.meshgrid(x, y)
+    xs = np.ravel(coords[0]).astype(np.float64)
+    ys = np.ravel(coords[1]).astype(np.float64)
+    return xs, ys
+
+
+def fitAsTransTable(asTrans, camcol, filt, stepSize=50, order=4):
+    """Fit TAN-SIP solutions for every field of one camcol/filter of an asTrans file
+
+    @param[in] asTrans  an AsTransRun
+    @param[in] camcol  camera column
+    @param[in] filt  filter name
+    @param[in] stepSize  spacing (pixels) of the grid used to fit the SIP polynomials
+    @param[in] order  order of the SIP polynomials
+
+    @return a NumPy structured array with dtype makeSidecarDtype(order), one row per field
+    """
+    table = asTrans.getTable(camcol, filt)
+    if table is None:
+        return np.zeros(0, dtype=makeSidecarDtype(order))
+
+    xs, ys = makeFitGrid(stepSize)
+    rows = np.zeros(len(table["field"]), dtype=makeSidecarDtype(order))
+    for i, field in enumerate(table["field"]):
+        mapper = asTrans.makeMapper(camcol, filt, int(field))
+        ra_rad, dec_rad = mapper.xyToRaDec(xs, ys)
+        solution = fitTanSip(xs, ys, ra_rad, dec_rad, order=order)
+        rows[i] = (camcol, filt, field) + tuple(solution)
+    return rows
+
+
+# Sky footprints of every field of one camcol/filter of an asTrans file:
+# fields (nfield,) field numbers; corners (nfield, 4, 2) (RA, Dec) of the frame
+# corners, going around the edge; centers (nfield, 2) (RA, Dec) of the frame
+# centers; radii (nfield,) radii of the circles about the centers that
+# contain the frames.  All angles in degrees.
+AsTransFootprints = collections.namedtuple("AsTransFootprints", "fields corners centers radii")
+
+
+def angularSeparation(ra1, dec1, ra2, dec2):
+    """Return the angular separation between points (radians in, radians out; arrays broadcast)"""
+    sinDDec = np.sin(0.5*(dec2 - dec1))
+    sinDRa = np.sin(0.5*(ra2 - ra1))
+    return 2*np.arcsin(np.sqrt(sinDDec**2 + np.cos(dec1)*np.cos(dec2)*sinDRa**2))
+
+
+def computeFootprints(asTrans, camcol, filt, width=FRAME_WIDTH, height=FRAME_HEIGHT):
+    """Compute the footprints of every field of one camcol/filter in one evaluation
+
+    The asTrans coefficients of all fields are broadcast against the frame
+    corners, so no per-field mapper or WCS is built.
+
+    @param[in] asTrans  an AsTransRun
+    @param[in] camcol  camera column
+    @param[in] filt  filter name
+    @param[in] width, height  dimensions of the frames (pixels)
+
+    @return an AsTransFootprints, with no fields if the camcol/filter is not in the file
+    """
+    table = asTrans.getTable(camcol, filt)
+    if table is None:
+        return AsTransFootprints(np.zeros(0, dtype=np.int32), np.zeros((0, 4, 2)), np.zeros((0, 2)),
+                                 np.zeros(0))
+
+    mapper = CoordinateMapper(asTrans.node_rad, asTrans.incl_rad,
+                              *[table[name][:, np.newaxis] for name in AsTransRun.columns[1:]])
+    x = np.array([[-0.5, width - 0.5, width - 0.5, -0.5, 0.5*(width - 1)]])
+    y = np.array([[-0.5, -0.5, height - 0.5, height - 0.5, 0.5*(height - 1)]])
+    ra_rad, dec_rad = mapper.xyToRaDec(x, y)
+    ra_rad %= 2*np.pi
+
+    # The frame edges are close to great circles, so the circle about the
+    # center through the farthest corner contains the frame
+    radii = angularSeparation(ra_rad[:, 4:], dec_rad[:, 4:], ra_rad[:, :4], dec_rad[:, :4]).max(axis=1)
+    return AsTransFootprints(fields=table["field"].copy(),
+                             corners=np.stack([ra_rad[:, :4], dec_rad[:, :4]], axis=-1) * rad2deg,
+                             centers=np.stack([ra_rad[:, 4], dec_rad[:, 4]], axis=-1) * rad2deg,
+                             radii=radii * rad2deg)
+
+
+def makeSidecarDtype(order=4):
+    """Return the dtype of the rows of a precomputed WCS sidecar file"""
+    sipShape = (order + 1, order + 1)
+    return np.dtype([("camcol", np.int32), ("filter", "U1"), ("field", np.int32),
+                     ("crpix", np.float64, (2,)), ("crval", np.float64, (2,)), ("cd", np.float64, (2, 2)),
+                     ("sipA", np.float64, sipShape), ("sipB", np.float64, sipShape),
+                     ("sipAp", np.float64, sipShape), ("sipBp", np.float64, sipShape)])
+
+
+def getSidecarPath(infile):
+    """Return the path of the precomputed WCS sidecar file for an asTrans file"""
+    root, ext = os.path.splitext(infile)
+    return root + "-wcs.npy"
+
+
+class WcsSidecar(object):
+    """Precomputed TAN-SIP solutions for every field of a run, memory-mapped from disk
+
+    @param[in] path  path of the sidecar file written by writeWcsSidecar
+    """
+
+    def __init__(self, path):
+        self.rows = np.load(path, mmap_mode="r")
+        self.index = dict(((int(camcol), str(filt), int(field)), i) for i, (camcol, filt, field) in
+                          enumerate(zip(self.rows["camcol"], self.rows["filter"], self.rows["field"])))
+
+    def getSolution(self, camcol, filt, field):
+        """Return the TanSipSolution for a field, or None if it is not present"""
+        idx = self.index.get((camcol, filt, field))
+        if idx is None:
             return None
+        row = self.rows[idx]
+        return TanSipSolution(*[np.array(row[name]) for name in TanSipSolution._fields])
+
+
+def writeWcsSidecar(outfile, rows):
+    """Write precomputed TAN-SIP solutions to a sidecar file
 
-        try:
-            fIdx = fList.index(filt)
-        except Exception:
-            print("Cannot extract data for filter %s" % (filt))
+    The file is written under a temporary name and renamed into place, so
+    readers never see a partial file.
+
+    @param[in] outfile  path of the sidecar file
+    @param[in] rows  structured array(s) as returned by fitAsTransTable
+    """
+    tmpfile = outfile + ".tmp.npy"
+    np.save(tmpfile, np.concatenate(rows) if isinstance(rows, list) else rows)
+    os.rename(tmpfile, outfile)
+
+
+_sidecarCache = FileCache(maxSize=16)
+
+
+def readSidecarWcs(infile, filt, camcol, field):
+    """Return the precomputed TAN-SIP SkyWcs for a field from the sidecar of an asTrans file
+
+    @param[in] infile  path to asTrans FITS file
+    @param[in] filt  filter name
+    @param[in] camcol  camera column
+    @param[in] field  field number
+
+    @return an lsst.afw.geom.SkyWcs, or None if there is no up to date sidecar
+        or the field is not in it
+    """
+    sidecarFile = getSidecarPath(infile)
+    try:
+        if os.stat(sidecarFile).st_mtime < os.stat(infile).st_mtime:
             return None
+    except OSError:
+        return None
+    solution = _sidecarCache.get(sidecarFile, WcsSidecar).getSolution(camcol, filt, field)
+    if solution is None:
+        return None
+    return makeWcsFromSolution(solution)
 
-        ext = cIdx * len(fList) + (fIdx + 1)
-        ehdr = hdulist[ext].header
-        edat = hdulist[ext].data
 
-    if ehdr['CAMCOL'] != camcol or ehdr['FILTER'] != filt:
-        print("Extracted incorrect header; fix me")
+def convertasTrans(infile, filt, camcol, field, stepSize=50, doValidate=False, useMatcher=False,
+                   exact=False):
+    """Convert the asTrans entry of one field to a TAN-SIP SkyWcs
+
+    @param[in] infile  path to asTrans FITS file
+    @param[in] filt  filter name
+    @param[in] camcol  camera column
+    @param[in] field  field number
+    @param[in] stepSize  spacing (pixels) of the grid used to fit the SIP polynomials
+    @param[in] doValidate  print statistics of the fit residuals?
+    @param[in] useMatcher  fit using lsst.meas.astrom.sip reference matches instead of NumPy?
+    @param[in] exact  return a WCS encoding the exact asTrans transform (see createExactWcs)
+        instead of fitting a TAN-SIP?
+
+    @return an lsst.afw.geom.SkyWcs, or None if the field is not in the file
+    """
+    asTrans = getAsTrans(infile)
+
+    if camcol not in asTrans.camcols:
+        print("Cannot extract data for camcol %s" % (camcol))
         return None
 
-    fields = edat.field('field').tolist()
-    try:
-        fIdx = fields.index(field)
-    except Exception:
-        print("Cannot extract data for field %d" % (field))
+    if filt not in asTrans.filters:
+        print("Cannot extract data for filter %s" % (filt))
         return None
 
-    dRow0 = edat.field('dRow0')[fIdx]
-    dRow1 = edat.field('dRow1')[fIdx]
-    dRow2 = edat.field('dRow2')[fIdx]
-    dRow3 = edat.field('dRow3')[fIdx]
+    if asTrans.getTable(camcol, filt) is None:
+        print("Extracted incorrect header; fix me")
+        return None
 
-    dCol0 = edat.field('dCol0')[fIdx]
-    dCol1 = edat.field('dCol1')[fIdx]
-    dCol2 = edat.field('dCol2')[fIdx]
-    dCol3 = edat.field('dCol3')[fIdx]
+    mapper = asTrans.makeMapper(camcol, filt, field)
+    if mapper is None:
+        print("Cannot extract data for field %d" % (field))
+        return None
 
-    a = edat.field('a')[fIdx]
-    b = edat.field('b')[fIdx]
-    c = edat.field('c')[fIdx]
-    d = edat.field('d')[fIdx]
-    e = edat.field('e')[fIdx]
-    f = edat.field('f')[fIdx]
+    if exact:
+        return createExactWcs(mapper)
 
     # We need to fit for a TAN-SIP
-    x = np.arange(0, 1489+stepSize, stepSize)
-    y = np.arange(0, 2048+stepSize, stepSize)
-    coords = np.meshgrid(x, y)
-    xs = np.ravel(coords[0]).astype(np.float)
-    ys = np.ravel(coords[1]).astype(np.float)
-    mapper = CoordinateMapper(node_rad, incl_rad, dRow0, dRow1, dRow2, dRow3, dCol0, dCol1, dCol2, dCol3,
-                              a, b, c, d, e, f)
-    wcs = createWcs(xs, ys, mapper)
+    xs, ys = makeFitGrid(stepSize)
+    if useMatcher:
+        wcs = createWcs(xs, ys, mapper)
+    else:
+        wcs = createWcsVectorized(xs, ys, mapper)
 
     if doValidate:
         validate(xs, ys, mapper, wcs)
@@ -0,0 +1,179 @@
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import sys
+import os
+import gzip
+
+from astropy.io import fits
+import numpy as np
+
+import lsst.afw.image as afwImage
+import lsst.daf.base as dafBase
+import lsst.log
+import lsst.pex.exceptions as pexExcept
+from lsst.afw.geom import makeSkyWcs
+
+try:
+    # A faster, drop-in replacement for gzip, if installed
+    from isal import igzip as gzipModule
+except ImportError:
+    gzipModule = gzip
+
+FITS_BLOCK = 2880
+
+
+def openfpC(infile):
+    """Open an fpC file for streaming reads, decompressing it on the fly if gzipped"""
+    if infile.endswith(".gz"):
+        return gzipModule.open(infile, "rb")
+    return open(infile, "rb")
+
+
+def readHeader(stream):
+    """Read a FITS header from a stream, leaving it positioned at the start of the data
+
+    @return an astropy.io.fits.Header
+    """
+    blocks = []
+    while True:
+        block = stream.read(FITS_BLOCK)
+        if len(block) < FITS_BLOCK:
+            raise RuntimeError("Truncated FITS header")
+        blocks.append(block)
+        if any(block[i:i + 8] == b"END     " for i in range(0, FITS_BLOCK, 80)):
+            break
+    return fits.Header.fromstring(b"".join(blocks).decode("ascii"))
+
+
+def readRows(stream, header, nRows):
+    """Read the next rows of 16-bit image data from a stream
+
+    @param[in] stream  stream positioned at the start of the rows to read
+    @param[in] header  FITS header of the image
+    @param[in] nRows  number of rows to read
+
+    @return the raw (unscaled, big-endian int16) pixels, shape (nRows, NAXIS1)
+    """
+    if header['BITPIX'] != 16:
+        raise RuntimeError("Cannot read fpC with BITPIX=%s" % (header['BITPIX'],))
+    nCols = header['NAXIS1']
+    nBytes = 2 * nCols * nRows
+    buff = stream.read(nBytes)
+    if len(buff) != nBytes:
+        raise RuntimeError("Truncated FITS data")
+    return np.frombuffer(buff, dtype='>i2').reshape(nRows, nCols)
+
+
+def scaleRows(raw, header, out=None, pedestal=0):
+    """Convert raw 16-bit pixels to float32 physical values
+
+    @param[in] raw  raw pixels, as returned by readRows
+    @param[in] header  FITS header of the image
+    @param[out] out  float32 array with the shape of raw to fill; allocated if None
+    @param[in] pedestal  number of counts to subtract from the physical values
+
+    @return the float32 array of physical values
+    """
+    if out is None:
+        out = np.empty(raw.shape, dtype=np.float32)
+    # float32 represents every 16-bit value exactly
+    bscale = header.get('BSCALE', 1.0)
+    bzero = header.get('BZERO', 0.0)
+    if bscale == 1.0:
+        np.add(raw, bzero - pedestal, out=out, dtype=np.float32)
+    else:
+        np.multiply(raw, bscale, out=out, dtype=np.float32)
+        out += bzero - pedestal
+    return out
+
+
+def readfpCRaw(infile):
+    """Read the header and all raw pixels of an fpC file
+
+    @return (astropy.io.fits.Header, raw pixel array), see readRows
+    """
+    with openfpC(infile) as stream:
+        header = readHeader(stream)
+        return header, readRows(stream, header, header['NAXIS2'])
+
+
+def headerToPropertyList(header):
+    """Convert an astropy FITS header to an lsst.daf.base.PropertyList"""
+    md = dafBase.PropertyList()
+    for card in header.cards:
+        if card.keyword in ("", "END"):
+            continue
+        if card.keyword in ("COMMENT", "HISTORY"):
+            md.add(card.keyword, str(card.value))
+        else:
+            md.set(card.keyword, card.value, card.comment)
+    return md
+
+
+def convertfpC(infile, overlapSize=0, pedestal=0, cache=None):
+    """Read an fpC file straight into a float32 Exposure
+
+    The file is decompressed as a stream and only the rows that are kept
+    are decompressed and converted, directly into the image plane.
+
+    @param[in] infile  path to fpC FITS file (optionally gzipped)
+    @param[in] overlapSize  number of rows to drop from the top of the frame
+    @param[in] pedestal  number of counts to subtract
+    @param[in] cache  lsst.obs.sdss.frameCache.FrameCache of decompressed frames, or None;
+        if given, the frame is read from (or decompressed once into) the cache
+
+    @return an lsst.afw.image.ExposureF with the header as its metadata and
+        the header WCS, if any
+    """
+    if cache is not None:
+        header, raw = cache.get(infile, readfpCRaw)
+        nRows = header['NAXIS2'] - overlapSize
+        image = afwImage.ImageF(header['NAXIS1'], nRows)
+        scaleRows(raw[:nRows], header, out=image.array, pedestal=pedestal)
+    else:
+        with openfpC(infile) as stream:
+            header = readHeader(stream)
+            nRows = header['NAXIS2'] - overlapSize
+            image = afwImage.ImageF(header['NAXIS1'], nRows)
+            scaleRows(readRows(stream, header, nRows), header, out=image.array, pedestal=pedestal)
+
+    exposure = afwImage.ExposureF(afwImage.MaskedImageF(image))
+    md = headerToPropertyList(header)
+    try:
+        exposure.setWcs(makeSkyWcs(md, strip=True))
+    except pexExcept.TypeError as e:
+        # As in lsst.obs.base.exposureFromImage: the header has no usable WCS
+        lsst.log.Log.getLogger("obs.sdss.convertfpC").debug(
+            "wcs set to None; insufficient information found in metadata to create a valid wcs: %s",
+            e.args[0])
+    exposure.setMetadata(md)
+    return exposure
+
+
+if __name__ == '__main__':
+    infile = sys.argv[1]
+    outfile = sys.argv[2]
+
+    if not os.path.isfile(infile):
+        sys.exit(1)
+
+    convertfpC(infile).writeFits(outfile)
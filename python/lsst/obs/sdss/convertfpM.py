@@ -23,136 +23,219 @@
 import sys
 import os
 import re
+import collections
 from astropy.io import fits
+import numpy as np
 
+import lsst.afw.geom as afwGeom
+import lsst.log
 import lsst.afw.image as afwImage
 import lsst.geom as geom
 
 
-class Span(object):
-
-    def __init__(self, y, x1, x2):
-        self.y = y
-        self.x1 = x1
-        self.x2 = x2
-
-
-class Objmask(object):
-    nperspan = 6
-
-    def __init__(self, frow, cval, verbose=False):
-        self.refcntr = frow[0]
-        self.nspan = frow[1]
-        self.row0 = frow[2]
-        self.col0 = frow[3]
-        self.rmin = frow[4]
-        self.rmax = frow[5]
-        self.cmin = frow[6]
-        self.cmax = frow[7]
-        self.npix = frow[8]
-        self.span = frow[9]
-        if len(self.span) == 0:
-            self.nspan = 0  # some bogus fpM files
-
-        self.spans = []
-        npixcheck = 0
-        for i in range(self.nspan):
-            b1 = self.span[6*i + 0]
-            b2 = self.span[6*i + 1]
-            y = (b1 << 8) + b2
-            b1 = self.span[6*i + 2]
-            b2 = self.span[6*i + 3]
-            x1 = (b1 << 8) + b2
-            b1 = self.span[6*i + 4]
-            b2 = self.span[6*i + 5]
-            x2 = (b1 << 8) + b2
-            self.spans.append(Span(y, x1, x2))
-            for i in range(x1, x2+1):
-                npixcheck += 1
-
-        # Some fpM files are actually wrong and this test fails!
-        # So warn, not assert
-        # 5759/40/objcs/1/fpM-005759-r1-0011.fit
-        # Plane S_MASK_NOTCHECKED
-        if self.npix != npixcheck and verbose:
-            print("WARNING: npix != npixcheck (%d != %d)" % (self.npix, npixcheck))
-
-        self.cval = cval
-
-    def setMask(self, mask):
-        nrow = mask.getHeight()
-        ncol = mask.getWidth()
-
-        for i in range(self.nspan):
-            y = int(self.spans[i].y - self.row0)
-
-            if (y < 0 or y >= nrow):
-                continue
+SpanArrays = collections.namedtuple("SpanArrays", "y x1 x2")
+
+# Number of bytes per span in the span column of an objmask
+SPAN_BYTES = 6
+
+
+def decodeSpans(data):
+    """Decode the spans of every objmask in one plane of an fpM file
+
+    The span column of each objmask holds big-endian (y, x1, x2) uint16
+    triplets; all of them are decoded at once.  Objmasks whose npix does not
+    match their spans are logged.
+
+    @param[in] data  binary table data of one fpM plane
+
+    @return a SpanArrays of int32 arrays, in frame coordinates (row0, col0 removed)
+    """
+    spanCol = data.field('s')
+    nspan = np.array(data.field('nspan'), dtype=np.int64)
+    lengths = np.array([len(s) for s in spanCol], dtype=np.int64)
+    nspan[lengths == 0] = 0  # some bogus fpM files
+
+    chunks = [s[:SPAN_BYTES*n] for s, n in zip(spanCol, nspan) if n > 0]
+    if len(chunks) == 0:
+        empty = np.zeros(0, dtype=np.int32)
+        return SpanArrays(empty, empty, empty)
+
+    spans = np.concatenate(chunks).astype(np.uint8, copy=False).view('>u2').reshape(-1, 3)
+    spans = spans.astype(np.int32)
+    row0 = np.repeat(np.array(data.field('row0'), dtype=np.int32), nspan)
+    col0 = np.repeat(np.array(data.field('col0'), dtype=np.int32), nspan)
+
+    # Some fpM files are actually wrong and this test fails!
+    # So warn, not assert
+    # 5759/40/objcs/1/fpM-005759-r1-0011.fit
+    # Plane S_MASK_NOTCHECKED
+    spanPix = np.maximum(spans[:, 2] - spans[:, 1] + 1, 0)
+    hasSpans = nspan > 0
+    starts = np.cumsum(nspan[hasSpans]) - nspan[hasSpans]
+    npixcheck = np.add.reduceat(spanPix, starts)
+    npix = np.array(data.field('npix'))[hasSpans]
+    bad = np.flatnonzero(npix != npixcheck)
+    if len(bad) > 0:
+        lsst.log.Log.getLogger("obs.sdss.convertfpM").warn(
+            "%d of %d objmasks have npix != npixcheck (first: %d != %d)" %
+            (len(bad), len(npix), npix[bad[0]], npixcheck[bad[0]]))
+
+    return SpanArrays(spans[:, 0] - row0, spans[:, 1] - col0, spans[:, 2] - col0)
+
+
+def setMaskFromSpans(maskArray, spans, bitmask):
+    """OR a bitmask into every pixel covered by a set of spans
+
+    @param[in,out] maskArray  2-d mask pixel array, indexed [y, x]
+    @param[in] spans  SpanArrays in the coordinates of maskArray; spans are clipped to it
+    @param[in] bitmask  bitmask to set
+    """
+    nrow, ncol = maskArray.shape
+    x1 = np.maximum(spans.x1, 0)
+    x2 = np.minimum(spans.x2, ncol - 1)
+    good = (spans.y >= 0) & (spans.y < nrow) & (x2 >= x1)
+    y, x1, x2 = spans.y[good], x1[good], x2[good]
+    if len(y) == 0:
+        return
+
+    spanPix = x2 - x1 + 1
+    offsets = np.arange(spanPix.sum()) - np.repeat(np.cumsum(spanPix) - spanPix, spanPix)
+    maskArray[np.repeat(y, spanPix), np.repeat(x1, spanPix) + offsets] |= bitmask
+
+
+# Minimal sets of mask planes needed for LSST, and their LSST names
+minimalPlanes = ['S_MASK_INTERP', 'S_MASK_SATUR', 'S_MASK_CR']
+# The rest of the SDSS planes
+extraPlanes = ['S_MASK_NOTCHECKED', 'S_MASK_OBJECT', 'S_MASK_BRIGHTOBJECT',
+               'S_MASK_BINOBJECT', 'S_MASK_CATOBJECT', 'S_MASK_SUBTRACTED', 'S_MASK_GHOST']
+lsstPlaneNames = {'S_MASK_INTERP': 'INTRP', 'S_MASK_SATUR': 'SAT', 'S_MASK_CR': 'CR'}
+
+
+def getLsstPlaneName(plane):
+    """Return the LSST mask plane name for an SDSS fpM plane name"""
+    return lsstPlaneNames.get(plane, re.sub("S_MASK_", "", plane))
+
+
+class MaskSpans(object):
+    """The planes of an fpM file, kept as spans rather than a dense mask
+
+    @param[in] nRows, nCols  dimensions of the mask
+    @param[in] planeSpans  dict of LSST plane name: SpanArrays, in mask coordinates
+    """
+
+    def __init__(self, nRows, nCols, planeSpans):
+        self.nRows = nRows
+        self.nCols = nCols
+        self.planeSpans = planeSpans
+        self._mask = None
+
+    def getPlaneNames(self):
+        """Return the LSST names of the planes that were read"""
+        return list(self.planeSpans.keys())
+
+    def getSpans(self, planeName):
+        """Return the SpanArrays of a plane, clipped to the mask"""
+        spans = self.planeSpans[planeName]
+        x1 = np.maximum(spans.x1, 0)
+        x2 = np.minimum(spans.x2, self.nCols - 1)
+        good = (spans.y >= 0) & (spans.y < self.nRows) & (x2 >= x1)
+        return SpanArrays(spans.y[good], x1[good], x2[good])
+
+    def getSpanSet(self, planeName):
+        """Return a plane as an lsst.afw.geom.SpanSet"""
+        spans = self.getSpans(planeName)
+        return afwGeom.SpanSet([afwGeom.Span(int(y), int(x1), int(x2))
+                                for y, x1, x2 in zip(spans.y, spans.x1, spans.x2)])
+
+    def getMask(self):
+        """Return the planes as an lsst.afw.image.Mask, building it on first use"""
+        if self._mask is None:
+            mask = afwImage.Mask(geom.ExtentI(self.nCols, self.nRows))
+            for planeName, spans in self.planeSpans.items():
+                mask.addMaskPlane(planeName)
+                setMaskFromSpans(mask.array, spans, afwImage.Mask.getPlaneBitMask(planeName))
+            self._mask = mask
+        return self._mask
+
+
+def getSdssPlaneName(plane):
+    """Return the SDSS fpM plane name for a plane given as e.g. S_MASK_CR, CR or (LSST) INTRP"""
+    for sdssName, lsstName in lsstPlaneNames.items():
+        if plane == lsstName:
+            return sdssName
+    return plane if plane.startswith("S_MASK_") else "S_MASK_" + plane
 
-            x1 = self.spans[i].x1 - self.col0
-            x2 = self.spans[i].x2 - self.col0
 
-            if (x1 < 0):
-                x1 = 0
+def readfpMSpans(infile, allPlanes=False, planes=None):
+    """Read the planes of an fpM file as spans
 
-            if(x2 >= ncol):
-                x2 = ncol - 1
+    Only the HDUs of the requested planes are read.
 
-            mask.array[y, x1: x2 + 1] |= self.cval
+    @param[in] infile  path to fpM FITS file
+    @param[in] allPlanes  read all SDSS planes, rather than just INTERP, SATUR and CR?
+    @param[in] planes  iterable of plane names (see getSdssPlaneName) to read;
+        if not None, overrides allPlanes
 
+    @return a MaskSpans
+    """
+    if planes is not None:
+        planeList = [getSdssPlaneName(plane) for plane in planes]
+    elif allPlanes:
+        planeList = minimalPlanes + extraPlanes
+    else:
+        planeList = minimalPlanes
 
-def convertfpM(infile, allPlanes=False):
-    with fits.open(infile) as hdr:
+    with fits.open(infile, lazy_load_hdus=True) as hdr:
         hdr[0].header['RUN']
         hdr[0].header['CAMCOL']
         hdr[0].header['FIELD']
         nRows = hdr[0].header['MASKROWS']
         nCols = hdr[0].header['MASKCOLS']
-        hdr[0].header['NPLANE']
-
-        names = hdr[-1].data.names
+        nPlane = hdr[0].header['NPLANE']
+
+        # The plane names follow the planes; indexing it directly (rather than
+        # hdr[-1]) avoids loading every HDU
+        try:
+            attributes = hdr[nPlane + 1].data
+        except IndexError:
+            attributes = None
+        if attributes is None or "attributeName" not in attributes.names:
+            attributes = hdr[-1].data
+
+        names = attributes.names
         if ("attributeName" not in names) or ("Value" not in names):
             raise LookupError("Missing data in fpM header")
 
-        planes = hdr[-1].data.field("attributeName").tolist()
-        mask = afwImage.Mask(geom.ExtentI(nCols, nRows))
+        planes = attributes.field("attributeName").tolist()
 
-        # Minimal sets of mask planes needed for LSST
-        interpPlane = planes.index("S_MASK_INTERP") + 1
-        satPlane = planes.index("S_MASK_SATUR") + 1
-        crPlane = planes.index("S_MASK_CR") + 1
+        planeSpans = collections.OrderedDict()
+        for plane in planeList:
+            idx = planes.index(plane) + 1
+            try:
+                data = hdr[idx].data
+            except IndexError:
+                continue
 
-        interpBitMask = afwImage.Mask.getPlaneBitMask("INTRP")
-        satBitMask = afwImage.Mask.getPlaneBitMask("SAT")
-        crBitMask = afwImage.Mask.getPlaneBitMask("CR")
+            if data is None:
+                continue
 
-        listToSet = [(interpPlane, interpBitMask),
-                     (satPlane, satBitMask),
-                     (crPlane, crBitMask)]
+            planeSpans[getLsstPlaneName(plane)] = decodeSpans(data)
 
-        # Add the rest of the SDSS planes
-        if allPlanes:
-            for plane in ['S_MASK_NOTCHECKED', 'S_MASK_OBJECT', 'S_MASK_BRIGHTOBJECT',
-                          'S_MASK_BINOBJECT', 'S_MASK_CATOBJECT', 'S_MASK_SUBTRACTED', 'S_MASK_GHOST']:
-                idx = planes.index(plane) + 1
-                planeName = re.sub("S_MASK_", "", plane)
-                mask.addMaskPlane(planeName)
-                planeBitMask = afwImage.Mask.getPlaneBitMask(planeName)
-                listToSet.append((idx, planeBitMask))
+    return MaskSpans(nRows, nCols, planeSpans)
 
-        for plane, bitmask in listToSet:
-            if len(hdr) < plane:
-                continue
-
-            if hdr[plane].data is None:
-                continue
 
-            nmask = len(hdr[plane].data)
-            for i in range(nmask):
-                frow = hdr[plane].data[i]
-                Objmask(frow, bitmask).setMask(mask)
+def convertfpM(infile, allPlanes=False, asSpans=False, planes=None):
+    """Convert an fpM file to a mask
 
-    return mask
+    @param[in] infile  path to fpM FITS file
+    @param[in] allPlanes  read all SDSS planes, rather than just INTERP, SATUR and CR?
+    @param[in] asSpans  return a MaskSpans instead of an lsst.afw.image.Mask?
+    @param[in] planes  iterable of plane names to read; if not None, overrides allPlanes
+    """
+    maskSpans = readfpMSpans(infile, allPlanes=allPlanes, planes=planes)
+    if asSpans:
+        return maskSpans
+    return maskSpans.getMask()
 
 
 if __name__ == '__main__':
@@ -21,11 +21,16 @@
 #
 import sys
 import os
+import functools
+import threading
 from astropy.io import fits
 import numpy as num
 import lsst.afw.image as afwImage
 import lsst.afw.math as afwMath
 import lsst.meas.algorithms as measAlg
+
+from lsst.obs.sdss.fileCache import FileCache
+
 DEBUG = False
 
 filtToHdu = {'u': 1, 'g': 2, 'r': 3, 'i': 4, 'z': 5}
@@ -40,32 +45,57 @@ skMatrixPos2TriSeqPosT = [
 ]
 
 
-def convertpsField(infile, filt, trim=True, rcscale=0.001, MAX_ORDER_B=5, LSST_ORDER=4):
-    if filt not in filtToHdu:
-        print("INVALID FILTER", filt)
-        sys.exit(1)
+@functools.lru_cache(maxsize=None)
+def _coefficientRemap(nrow_b, ncol_b, rcscale, MAX_ORDER_B):
+    """Return the index and scale arrays mapping SDSS spatial coefficients to afw order
 
-    with open(infile, "rb") as buff:
-        pstruct = fits.getdata(buff, ext=filtToHdu[filt])
+    @return src, dst, scale: spaParamsTri[dst] = cmat.ravel()[src] * scale
+    """
+    k = num.arange(nrow_b * ncol_b)
+    row = k % nrow_b
+    col = k // nrow_b
+    src = row * MAX_ORDER_B + col
+    # Was originally written like this, but the SDSS code
+    # takes inputs as y,x instead of x,y meaning it was
+    # originally transposed
+    #
+    # idx         = row * MAX_ORDER_B + col
+    dst = num.array(skMatrixPos2TriSeqPosT)[col * MAX_ORDER_B + row]
+    scale = num.array([pow(rcscale, r) * pow(rcscale, c) for r, c in zip(row, col)])
+    return src, dst, scale
 
-    spaParList = [[]]*len(pstruct)
-    kernelList = []
-    for i in range(len(pstruct)):
-        nrow_b = pstruct[i][0]  # ny
-        ncol_b = pstruct[i][1]  # nx
-        cmat = pstruct[i][2].reshape((MAX_ORDER_B, MAX_ORDER_B))
-        krow = pstruct[i][4]  # RNROW
-        kcol = pstruct[i][5]  # RNCOL
-        # This is *not* transposed
-        karr = pstruct[i][7].reshape((krow, kcol)).astype(num.float64)
 
-        if trim:
-            karr = karr[10:41, 10:41]
+class PsFieldBand(object):
+    """The PSF model of one filter of a psField file
+
+    The eigen-kernels are decoded once into a read-only float64 cube, and
+    the afw FixedKernels made from it are cached, so repeated requests for
+    the same filter share them rather than decoding the file again; each
+    request gets its own PcaPsf.  The FixedKernels hold copies of the cube:
+    afw kernels own their images.
 
-        kim = afwImage.ImageD(karr)
-        kern = afwMath.FixedKernel(kim)
-        kernelList.append(kern)
+    @param[in] nrow_b, ncol_b  arrays of the number of spatial terms in y and x, per component
+    @param[in] cmat  array (ncomp, MAX_ORDER_B * MAX_ORDER_B) of spatial coefficients
+    @param[in] kernels  array (ncomp, krow, kcol) of eigen-kernel images
+    """
+
+    def __init__(self, nrow_b, ncol_b, cmat, kernels):
+        self.nrow_b = nrow_b
+        self.ncol_b = ncol_b
+        self.cmat = cmat
+        self.kernels = kernels
+        self.kernels.flags.writeable = False
+        self._kernelLists = {}
+        self._lock = threading.Lock()
+
+    def getKernels(self, trim=True):
+        """Return the eigen-kernel cube (a view, not a copy), optionally trimmed to 31x31"""
+        if trim:
+            return self.kernels[:, 10:41, 10:41]
+        return self.kernels
 
+    def getSpatialParameters(self, rcscale=0.001, MAX_ORDER_B=5, LSST_ORDER=4):
+        """Return the PolynomialFunction2D parameters of each component"""
         # NOTES:
 
         # Afw has the polynomial terms like:
@@ -97,38 +127,139 @@ def convertpsField(infile, filt, trim=True, rcscale=0.001, MAX_ORDER_B=5, LSST_O
         # cmat[1][2] = c7  x^2y^1
         # cmat[2][2] = c12 x^2y^2
         #
-        # This is quantified in skMatrixPos2TriSeqPosT
+        # This is quantified in skMatrixPos2TriSeqPosT, and applied to all
+        # components with the same number of terms at once
 
-        spaParamsTri = num.zeros(MAX_ORDER_B * MAX_ORDER_B)
-        for k in range(nrow_b * ncol_b):
-            row = k % nrow_b
-            col = k // nrow_b
-            coeff = cmat[row, col]
-            scale = pow(rcscale, row) * pow(rcscale, col)
-            scaledCoeff = coeff * scale
+        spaParamsTri = num.zeros((len(self.cmat), MAX_ORDER_B * MAX_ORDER_B))
+        for nrow_b, ncol_b in set(zip(self.nrow_b, self.ncol_b)):
+            comps = num.flatnonzero((self.nrow_b == nrow_b) & (self.ncol_b == ncol_b))
+            src, dst, scale = _coefficientRemap(nrow_b, ncol_b, rcscale, MAX_ORDER_B)
+            spaParamsTri[comps[:, num.newaxis], dst] = self.cmat[comps][:, src] * scale
 
-            # Was originally written like this, but the SDSS code
-            # takes inputs as y,x instead of x,y meaning it was
-            # originally transposed
-            #
-            # idx         = row * MAX_ORDER_B + col
+        nTerms = (LSST_ORDER + 1) * (LSST_ORDER + 2) // 2
+        return list(spaParamsTri[:, :nTerms])
 
-            idx = col * MAX_ORDER_B + row
-            spaParamsTri[skMatrixPos2TriSeqPosT[idx]] = scaledCoeff
+    def computeImages(self, x, y, trim=True, doNormalize=True, rcscale=0.001, MAX_ORDER_B=5,
+                      LSST_ORDER=4):
+        """Evaluate the PSF model at many positions at once
 
-            # print "%d y=%d x=%d %10.3e %2d %2d %10.3e" % \
-            # (i, row, col, cmat[row,col], idx, skMatrixPos2TriSeqPosT[idx], scaledCoeff)
+        This is equivalent to calling computeImage on the kernel of the
+        PcaPsf returned by getPsf for each position.
 
-        # print spaParamsTri
-        nTerms = (LSST_ORDER + 1) * (LSST_ORDER + 2) // 2
-        spaParamsTri = spaParamsTri[:nTerms]
-        spaParList[i] = spaParamsTri
-
-    spaFun = afwMath.PolynomialFunction2D(LSST_ORDER)
-    spatialKernel = afwMath.LinearCombinationKernel(kernelList, spaFun)
-    spatialKernel.setSpatialParameters(spaParList)
-    spatialPsf = measAlg.PcaPsf(spatialKernel)
-    return spatialPsf
+        @param[in] x, y  arrays of positions
+        @param[in] trim  use the 31x31 trimmed kernels?
+        @param[in] doNormalize  normalize each image to unit sum?
+
+        @return array (N, krow, kcol) of kernel images
+        """
+        weights = evaluatePolynomial2D(num.array(self.getSpatialParameters(rcscale, MAX_ORDER_B, LSST_ORDER)),
+                                       LSST_ORDER, x, y)
+        return combineKernelImages(weights, self.getKernels(trim), doNormalize)
+
+    def getKernelList(self, trim=True):
+        """Return the eigen-kernels as a list of afw FixedKernels, making them on first use"""
+        with self._lock:
+            if trim not in self._kernelLists:
+                # ImageD needs a writeable array, and FixedKernel copies it anyway
+                self._kernelLists[trim] = [afwMath.FixedKernel(afwImage.ImageD(karr.copy()))
+                                           for karr in self.getKernels(trim)]
+            return self._kernelLists[trim]
+
+    def getPsf(self, trim=True, rcscale=0.001, MAX_ORDER_B=5, LSST_ORDER=4):
+        """Return a new PcaPsf of this filter"""
+        spaFun = afwMath.PolynomialFunction2D(LSST_ORDER)
+        spatialKernel = afwMath.LinearCombinationKernel(self.getKernelList(trim), spaFun)
+        spatialKernel.setSpatialParameters(self.getSpatialParameters(rcscale, MAX_ORDER_B, LSST_ORDER))
+        return measAlg.PcaPsf(spatialKernel)
+
+
+def evaluatePolynomial2D(params, order, x, y):
+    """Evaluate PolynomialFunction2D functions at many positions
+
+    @param[in] params  array (ncomp, nTerms) of parameters, in afw order
+    @param[in] order  order of the polynomials
+    @param[in] x, y  arrays of positions
+
+    @return array (N, ncomp) of function values
+    """
+    x = num.asarray(x, dtype=num.float64).ravel()
+    y = num.asarray(y, dtype=num.float64).ravel()
+    terms = num.stack([x**(n - p) * y**p for n in range(order + 1) for p in range(n + 1)], axis=1)
+    return terms.dot(num.asarray(params).T)
+
+
+def combineKernelImages(weights, kernels, doNormalize=True):
+    """Combine a cube of basis kernel images with per-position weights
+
+    @param[in] weights  array (N, ncomp)
+    @param[in] kernels  array (ncomp, krow, kcol)
+    @param[in] doNormalize  normalize each image to unit sum?
+
+    @return array (N, krow, kcol)
+    """
+    images = num.tensordot(weights, kernels, axes=([1], [0]))
+    if doNormalize:
+        images /= images.sum(axis=(1, 2))[:, num.newaxis, num.newaxis]
+    return images
+
+
+def computePsfImages(psf, x, y, doNormalize=True):
+    """Evaluate a PcaPsf from convertpsField at many positions at once
+
+    @param[in] psf  PcaPsf whose kernel is a LinearCombinationKernel of fixed
+        kernels with PolynomialFunction2D spatial functions
+    @param[in] x, y  arrays of positions
+    @param[in] doNormalize  normalize each image to unit sum?
+
+    @return array (N, height, width) of kernel images
+    """
+    kernel = psf.getKernel()
+    kernels = []
+    for basis in kernel.getKernelList():
+        image = afwImage.ImageD(basis.getDimensions())
+        basis.computeImage(image, False)
+        kernels.append(image.array)
+    params = num.array(kernel.getSpatialParameters())
+    order = int(round((num.sqrt(8*params.shape[1] + 1) - 3)/2))
+    return combineKernelImages(evaluatePolynomial2D(params, order, x, y), num.stack(kernels), doNormalize)
+
+
+def readPsField(infile):
+    """Decode the PSF models of every filter of a psField file
+
+    @param[in] infile  path to psField FITS file
+
+    @return a dict of filter name: PsFieldBand
+    """
+    bands = {}
+    with fits.open(infile) as hdulist:
+        for filt, hdu in filtToHdu.items():
+            pstruct = hdulist[hdu].data
+            nrow_b = num.array(pstruct.field(0), dtype=int)
+            ncol_b = num.array(pstruct.field(1), dtype=int)
+            cmat = num.array(pstruct.field(2), dtype=num.float64).reshape(len(pstruct), -1)
+            # This is *not* transposed
+            kernels = num.stack([pstruct[i][7].reshape((pstruct[i][4], pstruct[i][5]))  # RNROW, RNCOL
+                                 for i in range(len(pstruct))]).astype(num.float64)
+            bands[filt] = PsFieldBand(nrow_b, ncol_b, cmat, kernels)
+    return bands
+
+
+# A psField file holds all five filters of a field
+_psFieldCache = FileCache(maxSize=32)
+
+
+def getPsField(infile):
+    """Return the decoded PSF models of a psField file, reading it only on a cache miss"""
+    return _psFieldCache.get(infile, readPsField)
+
+
+def convertpsField(infile, filt, trim=True, rcscale=0.001, MAX_ORDER_B=5, LSST_ORDER=4):
+    if filt not in filtToHdu:
+        print("INVALID FILTER", filt)
+        sys.exit(1)
+
+    return getPsField(infile)[filt].getPsf(trim, rcscale, MAX_ORDER_B, LSST_ORDER)
 
 
 def directCompare(infile, filt, x, y, soft_bias=1000, amp=30000, outfile="/tmp/sdss_psf.fits"):
@@ -22,15 +22,224 @@
 import sys
 import os
 import collections
+import glob
+import tempfile
 
 from astropy.io import fits
 import numpy as np
 
 import lsst.afw.image as afwImage
 import lsst.daf.base as dafBase
+from lsst.obs.sdss.fileCache import FileCache
 
 TsField = collections.namedtuple("TsField", "photoCalib gain dateAvg exptime airmass")
 
+# Per-field, per-filter columns of a tsField file needed to build a TsField
+tsFieldColumns = ("mjd", "airmass", "gain", "aa", "aaErr")
+
+
+# MJD of the 1970-01-01 epoch of lsst.daf.base.DateTime nanoseconds
+EPOCH_IN_MJD = 40587.0
+
+
+def computeFluxMag0(aa, aaErr, exptime=53.907456):
+    """Return the flux of a zero-magnitude source and its error
+
+    @param[in] aa, aaErr  tsField zero point (f0 = 10**(-0.4*aa) counts/second)
+        and its error; scalars or arrays
+    @param[in] exptime  exposure time (sec)
+
+    @return fluxMag0, fluxMag0Err (counts), with the shape of aa
+    """
+    # aa is float32 in the files; compute in double precision
+    fluxMag0 = 10**np.multiply(-0.4, aa, dtype=np.float64) * exptime
+    return fluxMag0, fluxMag0 * 0.4 * np.log(10.0) * aaErr
+
+
+def computeMjdTaiAvg(mjdTaiStart, exptime=53.907456):
+    """Return the MJD(TAI) at the middle of the exposure; scalar or array"""
+    return mjdTaiStart + 0.5 * exptime / 3600 / 24
+
+
+class PhotoCalibArrays(object):
+    """Photometric calibration and mid-exposure time of many fields at once
+
+    The zero points, their errors and the TAI timestamps are plain arrays;
+    lsst.afw.image.PhotoCalib and lsst.daf.base.DateTime objects are only
+    made for the fields they are requested for.
+
+    @param[in] aa, aaErr  arrays of tsField zero points and their errors
+    @param[in] mjd  array of MJD(TAI) at which row 0 was read
+    @param[in] exptime  exposure time (sec)
+    """
+
+    def __init__(self, aa, aaErr, mjd, exptime=53.907456):
+        self.exptime = exptime
+        self.fluxMag0, self.fluxMag0Err = computeFluxMag0(np.asarray(aa), np.asarray(aaErr), exptime)
+        self.mjdTaiAvg = computeMjdTaiAvg(np.asarray(mjd, dtype=np.float64), exptime)
+
+    def __len__(self):
+        return len(self.fluxMag0)
+
+    @property
+    def taiAvgNsecs(self):
+        """Mid-exposure times as TAI nanoseconds since 1970-01-01, as int64"""
+        return ((self.mjdTaiAvg - EPOCH_IN_MJD) * 86400e9).astype(np.int64)
+
+    @property
+    def zeroPoint(self):
+        """Magnitude zero points for fluxes in counts"""
+        return 2.5 * np.log10(self.fluxMag0)
+
+    def getPhotoCalib(self, index):
+        """Return the lsst.afw.image.PhotoCalib of one element"""
+        return afwImage.makePhotoCalibFromCalibZeroPoint(float(self.fluxMag0[index]),
+                                                         float(self.fluxMag0Err[index]))
+
+    def getDateAvg(self, index):
+        """Return the mid-exposure lsst.daf.base.DateTime of one element"""
+        return dafBase.DateTime(float(self.mjdTaiAvg[index]))
+
+
+def makeTsField(mjdTaiStart, airmass, gain, aa, aaErr, exptime=53.907456):
+    """Build a TsField from the tsField columns of one field and filter"""
+    dateAvg = dafBase.DateTime(computeMjdTaiAvg(mjdTaiStart, exptime))
+    fluxMag0, dfluxMag0 = computeFluxMag0(aa, aaErr, exptime)
+
+    photoCalib = afwImage.makePhotoCalibFromCalibZeroPoint(fluxMag0, dfluxMag0)
+
+    return TsField(
+        photoCalib=photoCalib,
+        gain=float(gain),
+        dateAvg=dateAvg,
+        exptime=exptime,
+        airmass=airmass,
+    )
+
+
+class TsFieldTable(object):
+    """The calibration columns of many tsField files, e.g. of a whole (run, camcol)
+
+    @param[in] filters  filter names, in column order
+    @param[in] fields  field numbers, one per row
+    @param[in] columns  dict of name: array of shape (len(fields), len(filters))
+        for each of tsFieldColumns
+    """
+
+    def __init__(self, filters, fields, columns):
+        order = np.argsort(fields, kind="stable")
+        self.filters = list(filters)
+        self.fields = np.asarray(fields)[order]
+        self.columns = dict((name, np.asarray(columns[name])[order]) for name in tsFieldColumns)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def getRowIndex(self, field):
+        """Return the row of a field, or None if the table does not include it"""
+        idx = np.searchsorted(self.fields, field)
+        if idx < len(self.fields) and self.fields[idx] == field:
+            return int(idx)
+        return None
+
+    def getTsField(self, field, filt, exptime=53.907456):
+        """Return the TsField of one field and filter (see converttsField)"""
+        idx = self.getRowIndex(field)
+        if idx is None:
+            raise LookupError("No tsField data for field %d" % (field,))
+        j = self.filters.index(filt)
+        return makeTsField(*[self.columns[name][idx, j] for name in tsFieldColumns], exptime=exptime)
+
+    def getPhotoCalibArrays(self, filt, exptime=53.907456):
+        """Return the PhotoCalibArrays of all fields in one filter, in field order"""
+        j = self.filters.index(filt)
+        return PhotoCalibArrays(self.columns["aa"][:, j], self.columns["aaErr"][:, j],
+                                self.columns["mjd"][:, j], exptime=exptime)
+
+    def writeto(self, outfile):
+        """Persist the table to a NumPy .npz file, atomically"""
+        fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(outfile)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                np.savez(out, filters=np.array(self.filters), fields=self.fields, **self.columns)
+            os.rename(tmpPath, outfile)
+        except Exception:
+            os.unlink(tmpPath)
+            raise
+
+    @classmethod
+    def readfrom(cls, infile):
+        """Read a table persisted with writeto"""
+        with np.load(infile) as data:
+            return cls([str(f) for f in data["filters"]], data["fields"],
+                       dict((name, data[name]) for name in tsFieldColumns))
+
+
+def readTsFieldTable(infiles):
+    """Read the calibration columns of a set of tsField files into one TsFieldTable
+
+    @param[in] infiles  paths to tsField FITS files; each may hold any number of fields
+    """
+    filters = None
+    fields = []
+    columns = dict((name, []) for name in tsFieldColumns)
+    for infile in infiles:
+        with fits.open(infile) as ptr:
+            filts = ptr[0].header['FILTERS'].split()
+            if filters is None:
+                filters = filts
+            idx = [filts.index(filt) for filt in filters]
+            data = ptr[1].data
+            fields.append(np.array(data.field('field'), dtype=np.int32))
+            for name in tsFieldColumns:
+                values = np.asarray(data.field(name))
+                columns[name].append(values[:, idx].astype(values.dtype.newbyteorder('=')))
+
+    if filters is None:
+        raise LookupError("No tsField files to read")
+    return TsFieldTable(filters, np.concatenate(fields),
+                        dict((name, np.concatenate(columns[name])) for name in tsFieldColumns))
+
+
+def getTsFieldTablePath(directory, run, camcol):
+    """Return the path of the persisted TsFieldTable of a (run, camcol)"""
+    return os.path.join(directory, "tsFieldTable-%06d-%d.npz" % (run, camcol))
+
+
+_tsFieldTableCache = FileCache(16)
+
+
+def getTsFieldTable(directory, run, camcol, persist=False):
+    """Return the TsFieldTable of all tsField files of a (run, camcol) in a directory
+
+    Tables are cached in memory, keyed by the mtime and size of each tsField
+    file, and read from a persisted table if there is one newer than all
+    tsField files.
+
+    @param[in] directory  directory holding the tsField files
+    @param[in] run, camcol  run and camcol of the files
+    @param[in] persist  persist the table next to the files when it is read from them?
+    """
+    infiles = sorted(glob.glob(os.path.join(directory, "tsField-%06d-%d-*.fit" % (run, camcol))))
+    stats = [os.stat(f) for f in infiles]
+    key = ((os.path.realpath(directory), run, camcol),
+           tuple((os.path.basename(f), st.st_mtime_ns, st.st_size) for f, st in zip(infiles, stats)))
+
+    def reader(path):
+        tablePath = getTsFieldTablePath(path, run, camcol)
+        if os.path.exists(tablePath) and \
+                os.path.getmtime(tablePath) >= max([st.st_mtime for st in stats] + [0]):
+            return TsFieldTable.readfrom(tablePath)
+        table = readTsFieldTable(infiles)
+        if persist:
+            try:
+                table.writeto(tablePath)
+            except (IOError, OSError):
+                pass  # e.g. a read-only data repository
+        return table
+
+    return _tsFieldTableCache.get(directory, reader, key=key)
+
 
 def converttsField(infile, filt, exptime=53.907456):
     """Extract data from a tsField table
@@ -60,20 +269,7 @@ def converttsField(infile, filt, exptime=53.907456):
         aa = ptr[1].data.field('aa')[0][idx]         # f0 = 10**(-0.4*aa) counts/second
         aaErr = ptr[1].data.field('aaErr')[0][idx]
 
-    # Conversions
-    dateAvg = dafBase.DateTime(mjdTaiStart + 0.5 * exptime / 3600 / 24)
-    fluxMag0 = 10**(-0.4 * aa) * exptime
-    dfluxMag0 = fluxMag0 * 0.4 * np.log(10.0) * aaErr
-
-    photoCalib = afwImage.makePhotoCalibFromCalibZeroPoint(fluxMag0, dfluxMag0)
-
-    return TsField(
-        photoCalib=photoCalib,
-        gain=gain,
-        dateAvg=dateAvg,
-        exptime=exptime,
-        airmass=airmass,
-    )
+    return makeTsField(mjdTaiStart, airmass, gain, aa, aaErr, exptime=exptime)
 
 
 if __name__ == '__main__':
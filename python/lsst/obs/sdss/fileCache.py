@@ -0,0 +1,87 @@
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import collections
+import os
+import threading
+
+__all__ = ["FileCache"]
+
+
+class FileCache(object):
+    """A process-wide, size-bounded LRU cache of data parsed from files.
+
+    Entries are keyed by (real path, mtime), so a file that is rewritten on
+    disk is parsed again on the next lookup and its stale entry is dropped.
+    Callers whose data come from several files may give their own keys.
+
+    @param[in] maxSize  maximum number of entries to keep
+    """
+
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def makeKey(path):
+        """Return the (real path, mtime) key for a file"""
+        path = os.path.realpath(path)
+        return (path, os.stat(path).st_mtime)
+
+    def get(self, path, reader, key=None):
+        """Return the cached value for a file, parsing it on a miss
+
+        @param[in] path  path of the file
+        @param[in] reader  callable taking the real path and returning the value to cache
+        @param[in] key  (identity, version) key of the entry; if None, makeKey(path).
+            The entries of other versions with the same identity are dropped.
+
+        @return the value returned by reader for this version of the file
+        """
+        if key is None:
+            key = self.makeKey(path)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        # Parse outside the lock; two threads racing on the same file simply
+        # both parse it and the last one in wins.
+        value = reader(os.path.realpath(path))
+
+        with self._lock:
+            for oldKey in [k for k in self._entries if k[0] == key[0] and k != key]:
+                del self._entries[oldKey]
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxSize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,200 @@
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Process SDSS frames as a stream of bands of rows
+
+SDSS frames are drift scanned, so their rows are in time order and the
+conversion to a post-ISR exposure (pedestal removal, variance from the gain,
+mask planes) only ever looks at one row at a time.  The generators here each
+do one of those steps on fixed-height bands of rows, and FrameBands chains
+them, so that a frame can be processed (or stitched to others) with only one
+band of it in memory, however large the output.
+"""
+import collections
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+from lsst.obs.sdss.convertfpC import openfpC, readHeader, readRows, scaleRows
+from lsst.obs.sdss.convertfpM import SpanArrays, setMaskFromSpans
+
+__all__ = ["FrameBand", "FrameBands", "iterMaskBands", "iterVarianceBands", "iterfpCBands",
+           "writeBands"]
+
+# One band of rows of a frame:
+# y0: row of the frame the band starts at
+# image: float32 array of the pixel values, shape (nRows of the band, nCols)
+# mask: int32 array of the mask bits
+# variance: float32 array of the variance
+FrameBand = collections.namedtuple("FrameBand", "y0 image mask variance")
+
+
+def iterfpCBands(stream, header, nRows, bandRows=256, pedestal=0, scale=1.0):
+    """Decompress and convert the rows of an fpC file one band at a time
+
+    @param[in] stream  stream positioned at the start of the data (see convertfpC.readHeader)
+    @param[in] header  FITS header of the frame
+    @param[in] nRows  number of rows to read
+    @param[in] bandRows  number of rows per band
+    @param[in] pedestal  number of counts to subtract
+    @param[in] scale  factor to multiply the values by, after subtracting the pedestal
+
+    @return generator of (y0, float32 image band)
+    """
+    for begin in range(0, nRows, bandRows):
+        band = scaleRows(readRows(stream, header, min(bandRows, nRows - begin)), header, pedestal=pedestal)
+        if scale != 1.0:
+            band *= scale
+        yield begin, band
+
+
+def iterMaskBands(maskSpans, bitmasks, nRows, nCols, bandRows=256):
+    """Rasterize the planes of an fpM file one band of rows at a time
+
+    @param[in] maskSpans  lsst.obs.sdss.convertfpM.MaskSpans
+    @param[in] bitmasks  dict of plane name: bitmask, for the planes to rasterize
+    @param[in] nRows, nCols  dimensions of the mask to produce
+    @param[in] bandRows  number of rows per band
+
+    @return generator of (y0, int32 mask band)
+    """
+    # Sort the spans of each plane by row, so each band's are a slice
+    planes = []
+    for planeName, bitmask in bitmasks.items():
+        spans = maskSpans.getSpans(planeName)
+        order = np.argsort(spans.y, kind="stable")
+        planes.append((SpanArrays(spans.y[order], spans.x1[order], spans.x2[order]), bitmask))
+
+    for begin in range(0, nRows, bandRows):
+        end = min(begin + bandRows, nRows)
+        band = np.zeros((end - begin, nCols), dtype=np.int32)
+        for spans, bitmask in planes:
+            lo, hi = np.searchsorted(spans.y, [begin, end])
+            setMaskFromSpans(band, SpanArrays(spans.y[lo:hi] - begin, spans.x1[lo:hi], spans.x2[lo:hi]),
+                             bitmask)
+        yield begin, band
+
+
+def iterVarianceBands(imageBands, gain, scale=1.0):
+    """Compute the variance of bands of pixels from their gain
+
+    @param[in] imageBands  iterable of (y0, image band), as yielded by iterfpCBands
+    @param[in] gain  gain (e-/DN)
+    @param[in] scale  factor the image bands were multiplied by (see iterfpCBands)
+
+    @return generator of (y0, image band, float32 variance band)
+    """
+    for y0, image in imageBands:
+        yield y0, image, np.divide(image, gain/scale, dtype=np.float32)
+
+
+class FrameBands(object):
+    """The post-ISR pixels of one frame, as an iterable of FrameBand
+
+    The fpC file is opened and its header read on construction; the pixels
+    are only decompressed as the bands are iterated over.  The overlap rows
+    at the top of the frame are never decompressed.  Use as a context
+    manager, or call close, to close the fpC file if the bands are not all
+    consumed.
+
+    @param[in] fpCPath  path to the fpC file
+    @param[in] maskSpans  lsst.obs.sdss.convertfpM.MaskSpans of the frame
+    @param[in] gain  gain (e-/DN)
+    @param[in] overlapSize  number of rows to drop from the top of the frame
+    @param[in] pedestal  number of counts to subtract
+    @param[in] bandRows  number of rows per band
+    @param[in] scale  factor to multiply the image by (after pedestal removal), e.g. to
+        put it on the photometric calibration of another frame
+
+    Attributes:
+    - nRows, nCols: dimensions of the frame without the overlap
+    - bitmasks: dict of mask plane name: bitmask of the planes of maskSpans
+    """
+
+    def __init__(self, fpCPath, maskSpans, gain, overlapSize=0, pedestal=0, bandRows=256, scale=1.0):
+        self.maskSpans = maskSpans
+        self.gain = gain
+        self.pedestal = pedestal
+        self.bandRows = bandRows
+        self.scale = scale
+
+        self.bitmasks = collections.OrderedDict()
+        for planeName in maskSpans.getPlaneNames():
+            afwImage.Mask.addMaskPlane(planeName)
+            self.bitmasks[planeName] = afwImage.Mask.getPlaneBitMask(planeName)
+
+        self._stream = openfpC(fpCPath)
+        try:
+            self.header = readHeader(self._stream)
+        except Exception:
+            self._stream.close()
+            raise
+        self.nRows = self.header['NAXIS2'] - overlapSize
+        self.nCols = self.header['NAXIS1']
+
+    def __iter__(self):
+        if self._stream is None:
+            raise RuntimeError("The bands of a frame can only be iterated over once")
+        try:
+            images = iterfpCBands(self._stream, self.header, self.nRows, bandRows=self.bandRows,
+                                  pedestal=self.pedestal, scale=self.scale)
+            variances = iterVarianceBands(images, self.gain, scale=self.scale)
+            masks = iterMaskBands(self.maskSpans, self.bitmasks, self.nRows, self.nCols, self.bandRows)
+            for (y0, image, variance), (maskY0, mask) in zip(variances, masks):
+                yield FrameBand(y0, image, mask, variance)
+        finally:
+            self.close()
+
+    def close(self):
+        """Close the fpC file"""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def writeBands(maskedImage, bands, y0=0):
+    """Write bands of rows into a MaskedImage
+
+    @param[in,out] maskedImage  lsst.afw.image.MaskedImageF to write to
+    @param[in] bands  FrameBands, or iterable of FrameBand
+    @param[in] y0  row of maskedImage the first row of the bands goes to
+
+    @return the number of rows written
+    """
+    for planeName in getattr(bands, "bitmasks", {}):
+        maskedImage.getMask().addMaskPlane(planeName)
+    image = maskedImage.getImage().array
+    mask = maskedImage.getMask().array
+    variance = maskedImage.getVariance().array
+    nRows = 0
+    for band in bands:
+        rows = slice(y0 + band.y0, y0 + band.y0 + len(band.image))
+        image[rows] = band.image
+        mask[rows] = band.mask
+        variance[rows] = band.variance
+        nRows += len(band.image)
+    return nRows
@@ -0,0 +1,128 @@
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+import hashlib
+import os
+import tempfile
+
+from astropy.io import fits
+import numpy as np
+
+__all__ = ["FrameCache"]
+
+
+class FrameCache(object):
+    """An on-disk cache of decompressed frames, shared between processes
+
+    Each entry holds the FITS header and the raw (unscaled) pixels of one
+    gzipped frame, the latter as a .npy file that is memory-mapped on later
+    reads instead of being decompressed again.  Entries are keyed by the
+    source path and mtime; the least recently used ones are removed once the
+    cache grows over its size budget.  SdssMapper reads fpCFloat (and so
+    sdssFrameBundleFloat) through the cache; other fpC reads do not use it.
+
+    @param[in] directory  directory holding the cache; created if needed
+    @param[in] maxBytes  size budget of the cache, in bytes
+    """
+
+    def __init__(self, directory, maxBytes):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _getPaths(self, infile):
+        """Return the (pixel, header) paths of the entry for a file"""
+        path = os.path.realpath(infile)
+        key = "%s:%d" % (path, os.stat(path).st_mtime_ns)
+        root = os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest())
+        return root + ".npy", root + ".hdr"
+
+    def get(self, infile, reader):
+        """Return the header and raw pixels of a frame, decompressing it on a miss
+
+        @param[in] infile  path of the (compressed) frame
+        @param[in] reader  callable taking the path and returning (astropy header, raw pixel array)
+
+        @return (astropy.io.fits.Header, pixel array); the array is a read-only memory map
+        """
+        dataPath, headerPath = self._getPaths(infile)
+        try:
+            with open(headerPath) as fd:
+                header = fits.Header.fromstring(fd.read())
+            data = np.load(dataPath, mmap_mode='r')
+            os.utime(dataPath)
+            return header, data
+        except (IOError, OSError, ValueError):
+            pass
+
+        header, data = reader(infile)
+        # Write the pixels last, as their presence marks a complete entry
+        self._write(headerPath, lambda fd: fd.write(header.tostring().encode("ascii")))
+        self._write(dataPath, lambda fd: np.save(fd, data))
+        self.evict()
+        return header, data
+
+    def _write(self, path, writer):
+        """Write a file atomically, so concurrent readers never see it partially written"""
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                writer(out)
+            os.rename(tmpPath, path)
+        except Exception:
+            os.unlink(tmpPath)
+            raise
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits its budget
+
+        Header files without pixels, and temporary files, left by interrupted
+        writes count towards the budget and are removed in the same way.
+        """
+        entries = {}
+        for name in os.listdir(self.directory):
+            root, ext = os.path.splitext(name)
+            if ext not in (".npy", ".hdr", ".tmp"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue  # removed by another process
+            # The pixels and header of an entry go together; temporary files alone
+            entry = entries.setdefault(name if ext == ".tmp" else root, [0, 0, []])
+            entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+            entry[2].append(path)
+
+        total = sum(size for mtime, size, paths in entries.values())
+        for mtime, size, paths in sorted(entries.values()):
+            if total <= self.maxBytes:
+                break
+            for path in paths:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def __len__(self):
+        return len([name for name in os.listdir(self.directory) if name.endswith(".npy")])
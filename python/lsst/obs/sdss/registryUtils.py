@@ -0,0 +1,203 @@
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Helpers shared by the registry generation scripts in bin.src"""
+import os
+
+import numpy as np
+
+import lsst.sphgeom as sphgeom
+from lsst.obs.sdss.convertasTrans import computeFootprints, getAsTrans
+
+__all__ = ["DirectoryScanner", "createRawIndexes", "createFootprintTable", "getFramesWithoutFootprint",
+           "getSkyTiles", "getRegisteredKeys", "registerFootprints"]
+
+# Columns of raw_footprint, after the id
+FOOTPRINT_COLUMNS = ("ra1", "dec1", "ra2", "dec2", "ra3", "dec3", "ra4", "dec4",
+                     "raCenter", "decCenter", "radius")
+
+
+def createRawIndexes(conn, hasRerun=True, analyze=True):
+    """Create the indexes of the raw and raw_skyTile tables, if they do not exist yet
+
+    Besides the uniqueness of (run, filter, camcol, field), raw gets covering
+    indexes for lookups down the run -> camcol -> field -> filter hierarchy of
+    SdssMapper.yaml, and for lookups by filter.
+
+    @param[in] conn  sqlite3 connection to the registry
+    @param[in] hasRerun  does the raw table have a rerun column?
+    @param[in] analyze  update the statistics of the query planner?
+    """
+    rerun = ", rerun" if hasRerun else ""
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_raw ON raw (run, filter, camcol, field)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_raw_run ON raw (run, camcol, field, filter%s)" % (rerun,))
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_raw_filter ON raw (filter, run, camcol, field%s)" % (rerun,))
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_skyTile_id ON raw_skyTile (id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_skyTile_tile ON raw_skyTile (skyTile, id)")
+    if analyze:
+        # Give the query planner statistics on the new indexes
+        conn.execute("ANALYZE")
+
+
+def createFootprintTable(conn):
+    """Create the raw_footprint table, if it does not exist yet
+
+    It holds the corners of each frame, going around its edge, and the
+    circle about its center that contains it; all in degrees.
+    """
+    conn.execute("""CREATE TABLE IF NOT EXISTS raw_footprint (id INTEGER PRIMARY KEY,
+        ra1 REAL, dec1 REAL, ra2 REAL, dec2 REAL, ra3 REAL, dec3 REAL, ra4 REAL, dec4 REAL,
+        raCenter REAL, decCenter REAL, radius REAL)""")
+
+
+def getSkyTiles(corners, pixelization):
+    """Return the ids of the pixels of a sky pixelization that may overlap a frame
+
+    @param[in] corners  array of shape (4, 2) of corner (RA, Dec) in degrees
+    @param[in] pixelization  lsst.sphgeom pixelization, e.g. an HtmPixelization
+    """
+    polygon = sphgeom.ConvexPolygon.convexHull(
+        [sphgeom.UnitVector3d(sphgeom.LonLat.fromDegrees(ra, dec)) for ra, dec in corners])
+    ids = []
+    for begin, end in pixelization.envelope(polygon):
+        ids.extend(range(begin, end))
+    return ids
+
+
+def getFramesWithoutFootprint(conn, runs, hasRerun=True):
+    """Return the (id, run, rerun, filter, camcol, field) of frames of some runs without a footprint
+
+    @param[in] conn  sqlite3 connection to the registry
+    @param[in] runs  collection of run numbers
+    @param[in] hasRerun  does the raw table have a rerun column? If not, rerun is None
+    """
+    createFootprintTable(conn)
+    runs = list(runs)
+    if len(runs) == 0:
+        return []
+    cmd = """SELECT id, run, %s, filter, camcol, field FROM raw
+        WHERE run IN (%s) AND id NOT IN (SELECT id FROM raw_footprint)""" % \
+        ("rerun" if hasRerun else "NULL", ", ".join("?"*len(runs)))
+    return conn.execute(cmd, runs).fetchall()
+
+
+def registerFootprints(conn, frames, getAsTransPath, pixelization):
+    """Record the corners and sky tiles of frames, from the asTrans files of their runs
+
+    @param[in] conn  sqlite3 connection to the registry
+    @param[in] frames  iterable of (id, run, rerun, filter, camcol, field) of frames in raw
+    @param[in] getAsTransPath  callable taking (run, rerun) and returning the asTrans path, or None
+    @param[in] pixelization  lsst.sphgeom pixelization whose ids go to raw_skyTile
+
+    @return the number of frames whose footprints were recorded
+    """
+    createFootprintTable(conn)
+    footprintCache = {}
+    footprints = []
+    skyTiles = []
+    for id, run, rerun, filter, camcol, field in frames:
+        path = getAsTransPath(run, rerun)
+        if path is None or not os.path.exists(path):
+            continue
+        key = (path, camcol, filter)
+        if key not in footprintCache:
+            # All fields of the camcol and filter at once
+            footprintCache[key] = computeFootprints(getAsTrans(path), camcol, filter)
+        fp = footprintCache[key]
+        idx = np.flatnonzero(fp.fields == field)
+        if len(idx) == 0:
+            continue
+        idx = idx[0]
+        row = [id] + fp.corners[idx].flatten().tolist() + fp.centers[idx].tolist()
+        footprints.append(tuple(row + [float(fp.radii[idx])]))
+        skyTiles.extend((id, tile) for tile in getSkyTiles(fp.corners[idx], pixelization))
+
+    conn.executemany("INSERT OR REPLACE INTO raw_footprint (id, %s) VALUES (%s)" %
+                     (", ".join(FOOTPRINT_COLUMNS), ", ".join("?"*(1 + len(FOOTPRINT_COLUMNS)))), footprints)
+    # The sky tiles of frames registered again are replaced
+    conn.executemany("DELETE FROM raw_skyTile WHERE id = ?", [(row[0],) for row in footprints])
+    conn.executemany("INSERT INTO raw_skyTile VALUES (?, ?)", skyTiles)
+    return len(footprints)
+
+
+def getRegisteredKeys(conn, columns, **where):
+    """Return the set of tuples of the given columns of the rows of the raw table
+
+    @param[in] conn  sqlite3 connection to the registry
+    @param[in] columns  names of the columns to return
+    @param[in] where  column=value restrictions on the rows, e.g. run=5754, camcol=3;
+        with a leading column of an index of createRawIndexes, only the matching rows are read
+    """
+    names = sorted(where)
+    cmd = "SELECT %s FROM raw" % (", ".join(columns),)
+    if names:
+        cmd += " WHERE " + " AND ".join("%s = ?" % (name,) for name in names)
+    return set(conn.execute(cmd, [where[name] for name in names]))
+
+
+class DirectoryScanner(object):
+    """Record the directories of a data tree that have been registered
+
+    The mtime and number of files of each directory are kept in a
+    scanned_dir table of the registry, so that an update only needs to
+    rescan the directories that changed since, and can tell when files were
+    removed from them.
+
+    @param[in] conn  sqlite3 connection to the registry
+    @param[in] update  skip directories that are unchanged since they were recorded?
+        If False, every directory is scanned (and recorded again).
+    """
+
+    def __init__(self, conn, update=False):
+        self.conn = conn
+        conn.execute("CREATE TABLE IF NOT EXISTS scanned_dir (path TEXT PRIMARY KEY, mtime REAL, nFiles INT)")
+        self.known = {}
+        if update:
+            for path, mtime, nFiles in conn.execute("SELECT path, mtime, nFiles FROM scanned_dir"):
+                self.known[path] = (mtime, nFiles)
+
+    @staticmethod
+    def _getPath(directory):
+        return os.path.realpath(directory)
+
+    def getMtime(self, directory):
+        """Return the mtime of a directory, to be passed to record after scanning it"""
+        return os.stat(directory).st_mtime
+
+    def needsScan(self, directory, mtime):
+        """Has a directory changed since it was last recorded?"""
+        return self.known.get(self._getPath(directory), (None, None))[0] != mtime
+
+    def getRemovedCount(self, directory, nFiles):
+        """Return how many fewer files a directory has than when it was last recorded
+
+        Files removed from a directory keep their rows in the registry.
+
+        @param[in] directory  directory being scanned
+        @param[in] nFiles  number of files now in it
+        """
+        nKnown = self.known.get(self._getPath(directory), (None, None))[1]
+        return max(nKnown - nFiles, 0) if nKnown is not None else 0
+
+    def record(self, directory, mtime, nFiles):
+        """Record that a directory of nFiles files, as of mtime, has been registered"""
+        self.conn.execute("INSERT OR REPLACE INTO scanned_dir (path, mtime, nFiles) VALUES (?, ?, ?)",
+                          (self._getPath(directory), mtime, nFiles))
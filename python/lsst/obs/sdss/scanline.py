@@ -0,0 +1,168 @@
+#
+# LSST Data Management System
+# Copyright 2008, 2009, 2010 LSST Corporation.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <http://www.lsstcorp.org/LegalNotices/>.
+#
+"""Stitch consecutive fields of a drift scan into one "scanline" exposure
+
+The fields of a (run, camcol, filter) are consecutive slices of one
+continuous scan: each fpC frame overlaps the next field by its top
+FIELD_OVERLAP rows.  Dropping the overlap, field k of a scanline starting at
+field0 covers rows [k*nRows, (k+1)*nRows) of the scanline, with nRows the
+frame height less the overlap.
+"""
+import collections
+
+import numpy as np
+
+import lsst.afw.image as afwImage
+from lsst.obs.sdss.convertasTrans import FRAME_HEIGHT, FRAME_WIDTH, fitTanSip, makeWcsFromSolution
+from lsst.obs.sdss.frameBands import FrameBands, writeBands
+
+__all__ = ["FIELD_OVERLAP", "ScanlineField", "fitScanlineWcs", "makeScanlineExposure", "stitchFields"]
+
+# Rows of each fpC frame shared with the next field
+FIELD_OVERLAP = 128
+
+# What is needed to add one field to a scanline:
+# field: field number
+# fpCPath: path to the fpC file, which is streamed rather than read whole
+# fpM: lsst.obs.sdss.convertfpM.MaskSpans of the field
+# tsField: lsst.obs.sdss.converttsField.TsField of the field
+ScanlineField = collections.namedtuple("ScanlineField", "field fpCPath fpM tsField")
+
+
+def fitScanlineWcs(asTrans, camcol, filt, fields, nRows=FRAME_HEIGHT - FIELD_OVERLAP, width=FRAME_WIDTH,
+                   stepSize=100, order=4):
+    """Fit one TAN-SIP solution to the asTrans transforms of consecutive fields
+
+    Each field's transform is sampled on its own rows only, offset by its
+    position in the scanline, and a single solution is fit to all of them,
+    with the tangent point at the center of the scanline.
+
+    @param[in] asTrans  an lsst.obs.sdss.convertasTrans.AsTransRun
+    @param[in] camcol  camera column
+    @param[in] filt  filter name
+    @param[in] fields  consecutive field numbers, in scanline order
+    @param[in] nRows  number of rows of each field in the scanline
+    @param[in] width  number of columns of the frames
+    @param[in] stepSize  spacing (pixels) of the grid used to fit the SIP polynomials
+    @param[in] order  order of the SIP polynomials
+
+    @return an lsst.obs.sdss.convertasTrans.TanSipSolution, in scanline pixel coordinates
+    """
+    xGrid, yGrid = np.meshgrid(np.append(np.arange(0, width - 1, stepSize), width - 1),
+                               np.append(np.arange(0, nRows - 1, stepSize), nRows - 1))
+    xGrid = xGrid.ravel().astype(float)
+    yGrid = yGrid.ravel().astype(float)
+
+    mappers = []
+    for field in fields:
+        mapper = asTrans.makeMapper(camcol, filt, field)
+        if mapper is None:
+            raise RuntimeError("No asTrans entry for camcol %d, filter %s, field %d" % (camcol, filt, field))
+        mappers.append(mapper)
+
+    # The tangent point (the first position) is at the middle of the scanline
+    middle = len(fields) // 2
+    xCenter = np.array([0.5*(width - 1)])
+    yCenter = np.array([0.5*(len(fields)*nRows - 1)])
+    raCenter, decCenter = mappers[middle].xyToRaDec(xCenter, yCenter - middle*nRows)
+    xs, ys, ra, dec = [xCenter], [yCenter], [raCenter], [decCenter]
+    for k, mapper in enumerate(mappers):
+        fieldRa, fieldDec = mapper.xyToRaDec(xGrid, yGrid)
+        xs.append(xGrid)
+        ys.append(yGrid + k*nRows)
+        ra.append(fieldRa)
+        dec.append(fieldDec)
+
+    return fitTanSip(np.concatenate(xs), np.concatenate(ys), np.concatenate(ra), np.concatenate(dec),
+                     order=order)
+
+
+def stitchFields(fields, overlapSize=FIELD_OVERLAP, pedestal=1000, bandRows=256, calibrate=False):
+    """Stitch the pixels of consecutive fields into one MaskedImage
+
+    The fields are read as lsst.obs.sdss.frameBands.FrameBands, so only one
+    band of rows of one frame is held in memory besides the output, and
+    the overlap rows are never decompressed.  The variance of each field is
+    computed from its own gain.
+
+    @param[in] fields  list of ScanlineField of consecutive fields, in scanline order
+    @param[in] overlapSize  number of rows to drop from the top of each frame
+    @param[in] pedestal  number of counts to subtract
+    @param[in] bandRows  number of rows decompressed at a time
+    @param[in] calibrate  scale each field to the photometric calibration of the first?
+        If False, each field keeps its own counts.
+
+    @return an lsst.afw.image.MaskedImageF
+    """
+    maskedImage = None
+    calibration0 = fields[0].tsField.photoCalib.getCalibrationMean()
+    y0 = 0
+    for field in fields:
+        scale = field.tsField.photoCalib.getCalibrationMean() / calibration0 if calibrate else 1.0
+        with FrameBands(field.fpCPath, field.fpM, field.tsField.gain, overlapSize=overlapSize,
+                        pedestal=pedestal, bandRows=bandRows, scale=scale) as bands:
+            if maskedImage is None:
+                maskedImage = afwImage.MaskedImageF(bands.nCols, bands.nRows*len(fields))
+            elif bands.nCols != maskedImage.getWidth() or bands.nRows*len(fields) != maskedImage.getHeight():
+                raise RuntimeError("Frame %s has dimensions %dx%d, not those of the other fields" %
+                                   (field.fpCPath, bands.nCols, bands.nRows + overlapSize))
+            y0 += writeBands(maskedImage, bands, y0=y0)
+
+    return maskedImage
+
+
+def makeScanlineExposure(fields, asTrans, camcol, filt, overlapSize=FIELD_OVERLAP, pedestal=1000,
+                         bandRows=256, order=4, calibrate=False):
+    """Make a scanline exposure of consecutive fields, with a WCS fit across them
+
+    The PhotoCalib of the exposure is that of its first field, which only
+    applies to the other fields if they are calibrated (see stitchFields).
+
+    @param[in] fields  list of ScanlineField of consecutive fields, in scanline order
+    @param[in] asTrans  an lsst.obs.sdss.convertasTrans.AsTransRun of the run
+    @param[in] camcol  camera column
+    @param[in] filt  filter name
+    @param[in] overlapSize  number of rows to drop from the top of each frame
+    @param[in] pedestal  number of counts to subtract
+    @param[in] bandRows  number of rows decompressed at a time
+    @param[in] order  order of the SIP polynomials of the WCS
+    @param[in] calibrate  scale each field to the photometric calibration of the first?
+
+    @return an lsst.afw.image.ExposureF
+    """
+    maskedImage = stitchFields(fields, overlapSize=overlapSize, pedestal=pedestal, bandRows=bandRows,
+                               calibrate=calibrate)
+    nRows = maskedImage.getHeight() // len(fields)
+    solution = fitScanlineWcs(asTrans, camcol, filt, [field.field for field in fields], nRows=nRows,
+                              width=maskedImage.getWidth(), order=order)
+    exposure = afwImage.ExposureF(maskedImage, makeWcsFromSolution(solution))
+
+    expInfo = exposure.getInfo()
+    expInfo.setPhotoCalib(fields[0].tsField.photoCalib)
+    expInfo.setFilter(afwImage.Filter(filt))
+    md = exposure.getMetadata()
+    md.set("CAMCOL", camcol)
+    md.set("FIELD0", fields[0].field, "First field of the scanline")
+    md.set("NFIELDS", len(fields), "Number of fields in the scanline")
+    md.set("FIELDROW", nRows, "Number of rows of each field")
+    md.set("FIELDCAL", calibrate, "Fields scaled to the calibration of the first?")
+    return exposure
@@ -20,17 +20,28 @@
 # see <http://www.lsstcorp.org/LegalNotices/>.
 #
 
+import collections
+import concurrent.futures
 import os
 import re
+import time
 
+import lsst.afw.image as afwImage
 import lsst.daf.persistence as dafPersist
 from lsst.obs.base import CameraMapper, exposureFromImage
+from lsst.obs.sdss.convertfpC import convertfpC
 from lsst.obs.sdss.convertfpM import convertfpM
+from lsst.obs.sdss.frameCache import FrameCache
 from lsst.obs.sdss.convertpsField import convertpsField
-from lsst.obs.sdss.convertasTrans import convertasTrans
-from lsst.obs.sdss.converttsField import converttsField
+from lsst.obs.sdss.convertasTrans import computeFootprints, convertasTrans, getAsTrans, readSidecarWcs
+from lsst.obs.sdss.converttsField import converttsField, getTsFieldTable
+from lsst.obs.sdss.scanline import FIELD_OVERLAP, ScanlineField, makeScanlineExposure
 import lsst.afw.image.utils as afwImageUtils
 
+# Everything needed to assemble a post-ISR exposure for one frame;
+# timings is a dict of dataset type: seconds spent reading it
+FrameBundle = collections.namedtuple("FrameBundle", "fpC fpM asTrans tsField psField timings")
+
 
 class SdssMapper(CameraMapper):
     packageName = 'obs_sdss'
@@ -39,14 +50,57 @@ class SdssMapper(CameraMapper):
         policyFile = dafPersist.Policy.defaultPolicyFile(self.packageName, "SdssMapper.yaml", "policy")
         policy = dafPersist.Policy(policyFile)
 
+        # Read all fpM planes, including the object planes, by default?
         self.doFootprints = False
+        # Number of rows at the top of each frame that fpCFloat and fpCScanline drop
+        self.fpCOverlapSize = FIELD_OVERLAP
+        # Default number of fields stitched by fpCScanline, whether it scales them to the
+        # calibration of the first, and counts it subtracts
+        self.scanlineFields = 1
+        self.scanlineCalibrate = False
+        self.fpCPedestal = 1000
+        # Directory and size budget (MB) of an on-disk cache of decompressed fpC frames,
+        # used by the fpCFloat reads only (see bypass_fpCFloat)
+        fpCCacheDir = None
+        fpCCacheSize = 10000
+        # Return the exact asTrans transform from bypass_asTrans instead of a TAN-SIP fit?
+        self.exactAsTransWcs = False
+        # Serve tsField from one table per (run, camcol), optionally persisted next to the files?
+        self.tsFieldTables = False
+        self.persistTsFieldTables = False
+        # fpM planes to read (e.g. ["CR", "SATUR"]); None for the default set
+        self.fpMPlanes = None
         if inputPolicy is not None:
             for kw in inputPolicy.paramNames(True):
                 if kw == "doFootprints":
-                    self.doFootprints = True
+                    self.doFootprints = bool(inputPolicy.get(kw))
+                elif kw == "fpCOverlapSize":
+                    self.fpCOverlapSize = int(inputPolicy.get(kw))
+                elif kw == "scanlineFields":
+                    self.scanlineFields = int(inputPolicy.get(kw))
+                elif kw == "scanlineCalibrate":
+                    self.scanlineCalibrate = bool(inputPolicy.get(kw))
+                elif kw == "fpCPedestal":
+                    self.fpCPedestal = int(inputPolicy.get(kw))
+                elif kw == "fpCCacheDir":
+                    fpCCacheDir = inputPolicy.get(kw)
+                elif kw == "fpCCacheSize":
+                    fpCCacheSize = float(inputPolicy.get(kw))
+                elif kw == "exactAsTransWcs":
+                    self.exactAsTransWcs = bool(inputPolicy.get(kw))
+                elif kw == "tsFieldTables":
+                    self.tsFieldTables = bool(inputPolicy.get(kw))
+                elif kw == "persistTsFieldTables":
+                    self.persistTsFieldTables = bool(inputPolicy.get(kw))
+                elif kw == "fpMPlanes":
+                    self.fpMPlanes = self._parsePlaneList(inputPolicy.get(kw))
                 else:
                     kwargs[kw] = inputPolicy.get(kw)
 
+        self.fpCCache = None
+        if fpCCacheDir is not None:
+            self.fpCCache = FrameCache(fpCCacheDir, int(fpCCacheSize*1024**2))
+
         super(SdssMapper, self).__init__(policy, os.path.dirname(policyFile), **kwargs)
         # define filters?
         self.filterIdMap = dict(u=0, g=1, r=2, i=3, z=4)
@@ -106,18 +160,151 @@ class SdssMapper(CameraMapper):
 
 ###############################################################################
 
+    @staticmethod
+    def _parsePlaneList(planes):
+        """Return a list of plane names from a list or a comma/space separated string"""
+        if isinstance(planes, str):
+            planes = re.split(r"[\s,]+", planes.strip())
+        return [plane for plane in planes if plane]
+
+    def bypass_fpC(self, datasetType, pythonType, location, dataId):
+        """Read an fpC file into the ExposureU the butler would read
+
+        Use the fpCFloat dataset to read the pixels straight into an ExposureF;
+        only that goes through the decompressed-frame cache of fpCCacheDir.
+        """
+        infile = location.getLocationsWithRoot()[0]
+        item = afwImage.DecoratedImageU(infile)
+        return self._standardizeExposure(self.exposures[datasetType], item, dataId)
+
+    def bypass_fpCFloat(self, datasetType, pythonType, location, dataId):
+        """Read the rows of an fpC file that belong to its field into an ExposureF
+
+        The gzipped pixels are streamed straight into the float image, and the
+        fpCOverlapSize rows (a mapper policy entry; default FIELD_OVERLAP) at
+        the top of the frame, which overlap the next field, are dropped without
+        being decompressed.  The frame is read through the decompressed-frame
+        cache if the mapper has an fpCCacheDir.
+        """
+        return convertfpC(location.getLocationsWithRoot()[0], overlapSize=self.fpCOverlapSize,
+                          cache=self.fpCCache)
+
     def bypass_fpM(self, datasetType, pythonType, location, dataId):
-        return convertfpM(location.getLocationsWithRoot()[0])
+        """Read an fpM file as a Mask
+
+        Only the planes of the fpMPlanes mapper policy entry are read, if it is
+        set; otherwise the INTERP, SATUR and CR planes, or all planes (including
+        the object planes) if the mapper policy sets doFootprints to true.
+        """
+        return convertfpM(location.getLocationsWithRoot()[0], allPlanes=self.doFootprints,
+                          planes=self.fpMPlanes)
+
+    def bypass_fpMSpans(self, datasetType, pythonType, location, dataId):
+        """Read an fpM file as a MaskSpans, with the planes of bypass_fpM"""
+        return convertfpM(location.getLocationsWithRoot()[0], allPlanes=self.doFootprints, asSpans=True,
+                          planes=self.fpMPlanes)
 
     def bypass_psField(self, datasetType, pythonType, location, dataId):
         return convertpsField(location.getLocationsWithRoot()[0], dataId['filter'])
 
     def bypass_asTrans(self, datasetType, pythonType, location, dataId):
-        return convertasTrans(location.getLocationsWithRoot()[0], dataId['filter'],
-                              dataId['camcol'], dataId['field'])
+        infile = location.getLocationsWithRoot()[0]
+        if not self.exactAsTransWcs:
+            # Use the WCS precomputed by precomputeWcs.py if there is one
+            wcs = readSidecarWcs(infile, dataId['filter'], dataId['camcol'], dataId['field'])
+            if wcs is not None:
+                return wcs
+        return convertasTrans(infile, dataId['filter'], dataId['camcol'], dataId['field'],
+                              exact=self.exactAsTransWcs)
+
+    def bypass_asTransFootprints(self, datasetType, pythonType, location, dataId):
+        asTrans = getAsTrans(location.getLocationsWithRoot()[0])
+        return computeFootprints(asTrans, dataId['camcol'], dataId['filter'])
 
     def bypass_tsField(self, datasetType, pythonType, location, dataId):
-        return converttsField(location.getLocationsWithRoot()[0], dataId['filter'])
+        infile = location.getLocationsWithRoot()[0]
+        if self.tsFieldTables:
+            table = getTsFieldTable(os.path.dirname(infile), dataId['run'], dataId['camcol'],
+                                    persist=self.persistTsFieldTables)
+            return table.getTsField(dataId['field'], dataId['filter'])
+        return converttsField(infile, dataId['filter'])
+
+    def bypass_sdssFrameBundle(self, datasetType, pythonType, location, dataId):
+        dataId = location.dataId if location.dataId is not None else dataId
+        return self.loadFrameBundle(dataId)
+
+    def bypass_sdssFrameBundleFloat(self, datasetType, pythonType, location, dataId):
+        """Read a FrameBundle whose fpC is the fpCFloat of the frame"""
+        dataId = location.dataId if location.dataId is not None else dataId
+        return self.loadFrameBundle(dataId, fpCDatasetType="fpCFloat")
+
+    def loadFrameBundle(self, dataId, fpCDatasetType="fpC"):
+        """Read the fpC, fpM, asTrans, tsField and psField of a frame concurrently
+
+        All locations are resolved first (registry lookups stay in the calling
+        thread); the reads then run on a thread pool, as FITS decompression
+        and parsing largely release the GIL.
+
+        @param dataId (dict) Data identifier with run, rerun, filter, camcol, field
+        @param fpCDatasetType (str) dataset type to read for the fpC, "fpC" or "fpCFloat"
+        @return (FrameBundle) the datasets and the time spent reading each
+        """
+        fields = FrameBundle._fields[:-1]
+        datasetTypes = dict(zip(fields, (fpCDatasetType,) + fields[1:]))
+        locations = dict((name, self.map(datasetTypes[name], dataId)) for name in fields)
+
+        def read(name):
+            t0 = time.time()
+            dsType = datasetTypes[name]
+            location = locations[name]
+            item = getattr(self, "bypass_" + dsType)(dsType, None, location, location.dataId)
+            return item, time.time() - t0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(fields)) as executor:
+            results = dict(zip(fields, executor.map(read, fields)))
+
+        return FrameBundle(timings=dict((name, results[name][1]) for name in fields),
+                           **dict((name, results[name][0]) for name in fields))
+
+    def bypass_fpCScanline(self, datasetType, pythonType, location, dataId):
+        """Read consecutive fields of a drift scan as one stitched exposure
+
+        The scanline starts at the field of the dataId and has the number of
+        fields given by its nFields key, if any, or else by the scanlineFields
+        mapper policy entry (default 1).  The fpCOverlapSize (default
+        FIELD_OVERLAP) rows are dropped from the top of each frame and
+        fpCPedestal (default 1000) counts subtracted, and the fields are
+        scaled to the calibration of the first if scanlineCalibrate (default
+        False), also mapper policy entries; see
+        lsst.obs.sdss.scanline.makeScanlineExposure.
+        """
+        dataId = dict(location.dataId if location.dataId is not None else dataId)
+        nFields = int(dataId.pop("nFields", self.scanlineFields))
+        fields = []
+        for k in range(nFields):
+            fieldId = dict(dataId, field=dataId["field"] + k)
+            fpMLocation = self.map("fpMSpans", fieldId)
+            tsFieldLocation = self.map("tsField", fieldId)
+            fields.append(ScanlineField(
+                field=fieldId["field"],
+                fpCPath=self.map("fpC", fieldId).getLocationsWithRoot()[0],
+                fpM=self.bypass_fpMSpans("fpMSpans", None, fpMLocation, fpMLocation.dataId),
+                tsField=self.bypass_tsField("tsField", None, tsFieldLocation, tsFieldLocation.dataId),
+            ))
+        asTrans = getAsTrans(self.map("asTrans", dataId).getLocationsWithRoot()[0])
+        return makeScanlineExposure(fields, asTrans, dataId["camcol"], dataId["filter"],
+                                    overlapSize=self.fpCOverlapSize, pedestal=self.fpCPedestal,
+                                    calibrate=self.scanlineCalibrate)
+
+    def getRegistryConnection(self):
+        """Return the sqlite3 connection to the registry of this repository
+
+        @return (sqlite3.Connection) the connection, or None if the registry is not an sqlite3 one
+        """
+        return getattr(self.registry, "conn", None)
+
+    def bypass_sdssRegistryConnection(self, datasetType, pythonType, location, dataId):
+        return self.getRegistryConnection()
 
     def bypass_ccdExposureId(self, datasetType, pythonType, location, dataId):
         return self._computeCcdExposureId(dataId)
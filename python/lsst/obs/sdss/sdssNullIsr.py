@@ -19,11 +19,14 @@
 # the GNU General Public License along with this program.  If not,
 # see <https://www.lsstcorp.org/LegalNotices/>.
 #
+import numpy as np
+
 import lsst.pex.config as pexConfig
 import lsst.pipe.base as pipeBase
 import lsst.afw.image as afwImage
 import lsst.geom as geom
 from lsst.pipe.tasks.processCcd import ProcessCcdTask
+from lsst.obs.sdss.frameBands import FrameBands, writeBands
 
 
 class SdssNullIsrConfig(ProcessCcdTask.ConfigClass):
@@ -48,6 +51,29 @@ class SdssNullIsrConfig(ProcessCcdTask.ConfigClass):
         doc="Number of pixels to remove from top of the fpC file",
         default=128,
     )
+    useFrameBundle = pexConfig.Field(
+        dtype=bool,
+        doc="Read the fpC, fpM, asTrans, tsField and psField concurrently as one sdssFrameBundle?",
+        default=False,
+    )
+    useFloatfpC = pexConfig.Field(
+        dtype=bool,
+        doc="Read the fpC as an fpCFloat, with its pixels streamed straight into a float image "
+            "without decompressing the overlap rows (the fpCOverlapSize mapper policy entry)? "
+            "The fpC is read as usual if the mapper drops more rows than overlapSize",
+        default=False,
+    )
+    streamBands = pexConfig.Field(
+        dtype=bool,
+        doc="Read the fpC and fpM and compute the variance in bands of rows (see getFrameBands), "
+            "rather than frame by frame?",
+        default=False,
+    )
+    bandRows = pexConfig.Field(
+        dtype=int,
+        doc="Number of rows per band, if streamBands",
+        default=256,
+    )
     doWrite = pexConfig.Field(
         dtype=bool,
         doc="Persist loaded data as a postISRCCD? The default is false, to avoid duplicating data.",
@@ -60,6 +86,25 @@ class SdssNullIsrConfig(ProcessCcdTask.ConfigClass):
     )
 
 
+def fillMaskedImage(maskedImage, fpCArray, maskArray, pedestal, gain):
+    """Fill a float MaskedImage from fpC and fpM pixel arrays
+
+    The fpC pixels are converted and the pedestal removed in one
+    pass into the image plane, and the variance is computed from that
+    directly into the variance plane, without intermediate images.
+
+    @param[out] maskedImage  lsst.afw.image.MaskedImageF with the shape of the arrays
+    @param[in] fpCArray  fpC pixel array (uint16, or float32; may be the image plane itself)
+    @param[in] maskArray  fpM mask pixel array
+    @param[in] pedestal  number of counts to subtract
+    @param[in] gain  gain (e-/DN)
+    """
+    image = maskedImage.getImage().array
+    np.subtract(fpCArray, pedestal, out=image, dtype=np.float32)
+    np.divide(image, gain, out=maskedImage.getVariance().array)
+    maskedImage.getMask().array[:] = maskArray
+
+
 # \addtogroup LSST_task_documentation
 # \{
 # \page SdssNullIsrTask
@@ -112,31 +157,91 @@ class SdssNullIsrTask(pipeBase.Task):
         - PhotoCalib is from tsField
         - Psf is from psField
         """
-        originalExp = sensorRef.get("fpC").convertF()
-        image = originalExp.getMaskedImage().getImage()
-        if self.config.removePedestal:
-            image -= self.config.pedestalVal
-        mask = sensorRef.get("fpM")
-        wcs = sensorRef.get("asTrans")
-        tsField = sensorRef.get("tsField")
-        photoCalib = tsField.photoCalib
-        gain = tsField.gain
-        var = afwImage.ImageF(image, True)
-        var /= gain
-
-        mi = afwImage.MaskedImageF(image, mask, var)
-
-        if self.config.removeOverlap:
-            bbox = mi.getBBox()
-            begin = bbox.getBegin()
-            extent = bbox.getDimensions()
-            extent -= geom.Extent2I(0, self.config.overlapSize)
-            tbbox = geom.BoxI(begin, extent)
-            mi = afwImage.MaskedImageF(mi, tbbox)
-
-        exposure = afwImage.ExposureF(mi, wcs)
+        overlapSize = self.config.overlapSize if self.config.removeOverlap else 0
+        if self.config.streamBands:
+            wcs = sensorRef.get("asTrans")
+            tsField = sensorRef.get("tsField")
+            psf = sensorRef.get('psField')
+            with self.getFrameBands(sensorRef, tsField.gain) as bands:
+                mi = afwImage.MaskedImageF(bands.nCols, bands.nRows)
+                writeBands(mi, bands)
+            return self.makeExposure(sensorRef, mi, wcs, tsField, psf)
+        elif self.config.useFrameBundle:
+            bundle = sensorRef.get("sdssFrameBundleFloat" if self.config.useFloatfpC else "sdssFrameBundle")
+            for datasetType, duration in bundle.timings.items():
+                self.metadata.set("%sReadTime" % (datasetType,), duration)
+            fpC = bundle.fpC
+            mask = bundle.fpM
+            wcs = bundle.asTrans
+            tsField = bundle.tsField
+            psf = bundle.psField
+        else:
+            fpC = sensorRef.get("fpCFloat" if self.config.useFloatfpC else "fpC")
+            mask = sensorRef.get("fpM")
+            wcs = sensorRef.get("asTrans")
+            tsField = sensorRef.get("tsField")
+            psf = sensorRef.get('psField')
+
+        if isinstance(fpC, afwImage.ExposureF):
+            nRows = fpC.getMetadata().getScalar("NAXIS2") - overlapSize
+            if fpC.getHeight() < nRows:
+                # The mapper dropped more of the overlap than we are to remove
+                self.log.debug("fpCFloat has %d rows, fewer than the %d to keep; reading the fpC" %
+                               (fpC.getHeight(), nRows))
+                fpC = sensorRef.get("fpC")
+        if isinstance(fpC, afwImage.ExposureF):
+            # Already float, and the mapper may have dropped (some of) the
+            # overlap; work in the image plane, or the view of it we keep
+            image = fpC.getImage()
+            if image.getHeight() > nRows:
+                bbox = geom.BoxI(image.getXY0(), geom.Extent2I(image.getWidth(), nRows))
+                image = afwImage.ImageF(image, bbox)
+            mi = afwImage.MaskedImageF(image)
+            fpCArray = mi.getImage().array
+        else:
+            # Crop the overlap from the uint16 data before converting, and
+            # convert, remove the pedestal and compute the variance straight
+            # into the output planes
+            bbox = fpC.getBBox()
+            if self.config.removeOverlap:
+                extent = bbox.getDimensions() - geom.Extent2I(0, overlapSize)
+                bbox = geom.BoxI(bbox.getBegin(), extent)
+            mi = afwImage.MaskedImageF(bbox)
+            fpCArray = fpC.getMaskedImage().getImage().array[:bbox.getHeight()]
+        nRows = mi.getHeight()
+        fillMaskedImage(mi, fpCArray, mask.array[:nRows],
+                        self.config.pedestalVal if self.config.removePedestal else 0, tsField.gain)
+        return self.makeExposure(sensorRef, mi, wcs, tsField, psf)
+
+    def getFrameBands(self, sensorRef, gain):
+        """Return the post-ISR pixels of a frame as bands of rows
+
+        The fpC and fpM are converted with the pedestal and overlap settings
+        of this task, one band of config.bandRows rows at a time, so tasks
+        that can consume a frame band by band never hold all of it.
+
+        @param[in] sensorRef  butler data reference for the frame
+        @param[in] gain  gain (e-/DN) of the frame, for the variance
+
+        @return an lsst.obs.sdss.frameBands.FrameBands, to be iterated over once
+        """
+        return FrameBands(sensorRef.get("fpC_filename")[0], sensorRef.get("fpMSpans"), gain,
+                          overlapSize=self.config.overlapSize if self.config.removeOverlap else 0,
+                          pedestal=self.config.pedestalVal if self.config.removePedestal else 0,
+                          bandRows=self.config.bandRows)
+
+    def makeExposure(self, sensorRef, maskedImage, wcs, tsField, psf):
+        """Make the post-ISR exposure of a frame from its pixels and calibrations
+
+        @param[in] sensorRef  butler data reference for the frame
+        @param[in] maskedImage  lsst.afw.image.MaskedImageF of the frame
+        @param[in] wcs  lsst.afw.geom.SkyWcs from asTrans
+        @param[in] tsField  lsst.obs.sdss.converttsField.TsField
+        @param[in] psf  PSF from psField
+        """
+        exposure = afwImage.ExposureF(maskedImage, wcs)
         expInfo = exposure.getInfo()
-        expInfo.setPhotoCalib(photoCalib)
+        expInfo.setPhotoCalib(tsField.photoCalib)
 
         camera = sensorRef.get('camera')
         detector = camera["%(filter)s%(camcol)d" % sensorRef.dataId]
@@ -151,7 +256,6 @@ class SdssNullIsrTask(pipeBase.Task):
         expInfo.setVisitInfo(visitInfo)
 
         # Install the SDSS PSF here; if we want to overwrite it later, we can.
-        psf = sensorRef.get('psField')
         exposure.setPsf(psf)
 
         return exposure
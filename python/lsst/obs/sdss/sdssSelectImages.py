@@ -0,0 +1,341 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import collections
+import sqlite3
+
+import numpy as np
+
+import lsst.daf.persistence as dafPersist
+import lsst.geom as geom
+import lsst.pex.config as pexConfig
+import lsst.pipe.base as pipeBase
+import lsst.sphgeom as sphgeom
+from lsst.pipe.tasks.selectImages import BaseExposureInfo, WcsSelectImagesTask
+from lsst.obs.sdss.registryUtils import FOOTPRINT_COLUMNS
+
+__all__ = ["FrameFootprints", "SdssSelectImagesConfig", "SdssSelectImagesTask", "getRegistryConnection",
+           "hasFootprint", "overlapsPolygon", "queryFootprints", "raDecToVector"]
+
+# Footprints of registered frames, as returned by queryFootprints:
+# dataIds: list of dict(run, camcol, field, filter)
+# corners: array of shape (n, 4, 2) of (RA, Dec) going around each frame, in degrees
+# centers: array of shape (n, 2) of (RA, Dec) of the frame centers, in degrees
+# radii: array of the radii of the circles about the centers containing the frames, in degrees
+FrameFootprints = collections.namedtuple("FrameFootprints", "dataIds corners centers radii")
+
+# Maximum number of sky tile ranges OR'd together in one query
+MAX_RANGES_PER_QUERY = 200
+
+
+def raDecToVector(radec):
+    """Convert (RA, Dec) in degrees to unit vectors
+
+    @param[in] radec  array of shape (..., 2)
+
+    @return array of shape (..., 3)
+    """
+    ra, dec = np.radians(radec[..., 0]), np.radians(radec[..., 1])
+    cosDec = np.cos(dec)
+    return np.stack([cosDec*np.cos(ra), cosDec*np.sin(ra), np.sin(dec)], axis=-1)
+
+
+def _getEdgeNormals(vertices):
+    """Return the normals of the great circles through the edges of convex polygons
+
+    The normals point into the polygons, whichever way round their vertices go.
+
+    @param[in] vertices  array of shape (..., k, 3) of unit vectors going around each polygon
+
+    @return array of shape (..., k, 3)
+    """
+    normals = np.cross(vertices, np.roll(vertices, -1, axis=-2))
+    centers = vertices.sum(axis=-2, keepdims=True)
+    normals *= np.sign(np.sum(normals*centers, axis=-1, keepdims=True))
+    return normals
+
+
+def overlapsPolygon(corners, polygon):
+    """Test which of a set of convex spherical quadrilaterals overlap a convex polygon
+
+    Two convex polygons lying in a common hemisphere are disjoint if and only if
+    the great circle through an edge of one of them has the other entirely on
+    its outer side (the separating axis theorem, under a gnomonic projection),
+    so all edges of all frames are tested at once.  The frames and the polygon
+    must be small and close enough to lie in a common hemisphere; queryFootprints
+    only returns frames within a few degrees of the patch.
+
+    @param[in] corners  array of shape (n, k, 2) of (RA, Dec) going around each frame, in degrees
+    @param[in] polygon  array of shape (m, 2) of (RA, Dec) going around the polygon, in degrees
+
+    @return boolean array of length n
+    """
+    frameVertices = raDecToVector(np.asarray(corners, dtype=float))
+    polyVertices = raDecToVector(np.asarray(polygon, dtype=float))
+    if len(frameVertices) == 0:
+        return np.zeros(0, dtype=bool)
+
+    # Frames entirely outside an edge of the polygon: (n, m edges, k vertices)
+    polyNormals = _getEdgeNormals(polyVertices)
+    outside = np.einsum("ed,nvd->nev", polyNormals, frameVertices) < 0
+    separated = outside.all(axis=2).any(axis=1)
+
+    # Polygon entirely outside an edge of a frame: (n, k edges, m vertices)
+    frameNormals = _getEdgeNormals(frameVertices)
+    outside = np.einsum("ned,vd->nev", frameNormals, polyVertices) < 0
+    separated |= outside.all(axis=2).any(axis=1)
+    return ~separated
+
+
+def _withinCircles(centers, radii, center, radius):
+    """Which circles (centers and radii in degrees) may overlap a circle?"""
+    cosSep = np.dot(raDecToVector(centers), raDecToVector(np.asarray(center, dtype=float)))
+    return cosSep >= np.cos(np.radians(np.minimum(radii + radius, 180.0)))
+
+
+def _getBoundingCircle(polygon):
+    """Return the (center (RA, Dec), radius) of a circle containing a convex polygon, in degrees"""
+    vertices = raDecToVector(np.asarray(polygon, dtype=float))
+    center = vertices.sum(axis=0)
+    center /= np.linalg.norm(center)
+    radius = np.degrees(np.arccos(np.clip(np.dot(vertices, center), -1.0, 1.0)).max())
+    ra = np.degrees(np.arctan2(center[1], center[0])) % 360.0
+    dec = np.degrees(np.arcsin(np.clip(center[2], -1.0, 1.0)))
+    return (ra, dec), radius
+
+
+def queryFootprints(conn, polygon, skyTileRanges=None, filter=None):
+    """Return the registered frames that overlap a convex polygon on the sky
+
+    The frame footprints come from the raw_footprint table written by the
+    registry generation scripts.  The candidates are those sharing a sky tile
+    with the polygon, then those whose bounding circle reaches the polygon's,
+    and finally those that pass the polygon overlap test of overlapsPolygon.
+
+    @param[in] conn  sqlite3 connection to the registry
+    @param[in] polygon  array of shape (m, 2) of (RA, Dec) going around the polygon, in degrees
+    @param[in] skyTileRanges  iterable of [begin, end) ranges of the raw_skyTile ids
+        that may overlap the polygon; if None, every frame with a footprint is a candidate
+    @param[in] filter  restrict the frames to this filter, if not None
+
+    @return a FrameFootprints of the overlapping frames
+    """
+    columns = ", ".join(["raw.run", "raw.camcol", "raw.field", "raw.filter"]
+                        + ["fp.%s" % (col,) for col in FOOTPRINT_COLUMNS])
+    filterClause = "" if filter is None else " AND raw.filter = ?"
+    filterArgs = [] if filter is None else [filter]
+
+    rows = {}
+    if skyTileRanges is None:
+        sql = "SELECT fp.id, %s FROM raw_footprint AS fp JOIN raw ON raw.id = fp.id WHERE 1%s" % \
+            (columns, filterClause)
+        rows.update((row[0], row[1:]) for row in conn.execute(sql, filterArgs))
+    else:
+        skyTileRanges = [(int(begin), int(end)) for begin, end in skyTileRanges]
+        for i in range(0, len(skyTileRanges), MAX_RANGES_PER_QUERY):
+            chunk = skyTileRanges[i:i + MAX_RANGES_PER_QUERY]
+            sql = """SELECT DISTINCT st.id, %s FROM raw_skyTile AS st
+                JOIN raw_footprint AS fp ON fp.id = st.id JOIN raw ON raw.id = st.id
+                WHERE (%s)%s""" % (columns, " OR ".join(["(st.skyTile >= ? AND st.skyTile < ?)"]*len(chunk)),
+                                   filterClause)
+            args = [value for tileRange in chunk for value in tileRange] + filterArgs
+            rows.update((row[0], row[1:]) for row in conn.execute(sql, args))
+
+    rows = [row for row in rows.values() if None not in row]
+    if len(rows) == 0:
+        return FrameFootprints([], np.zeros((0, 4, 2)), np.zeros((0, 2)), np.zeros(0))
+    values = np.array([row[4:] for row in rows], dtype=float)
+    corners = values[:, :8].reshape(-1, 4, 2)
+    centers = values[:, 8:10]
+    radii = values[:, 10]
+
+    center, radius = _getBoundingCircle(polygon)
+    good = np.flatnonzero(_withinCircles(centers, radii, center, radius))
+    good = good[overlapsPolygon(corners[good], polygon)]
+    dataIds = [dict(run=rows[i][0], camcol=rows[i][1], field=rows[i][2], filter=rows[i][3]) for i in good]
+    return FrameFootprints(dataIds, corners[good], centers[good], radii[good])
+
+
+def hasFootprint(conn, key):
+    """Does the registry have the footprint of a frame, given as (run, camcol, field, filter)?"""
+    row = conn.execute("""SELECT 1 FROM raw JOIN raw_footprint AS fp ON fp.id = raw.id
+        WHERE raw.run = ? AND raw.camcol = ? AND raw.field = ? AND raw.filter = ?""", key).fetchone()
+    return row is not None
+
+
+def getRegistryConnection(butler):
+    """Return the sqlite3 connection of the registry of a butler's input repository, or None
+
+    This is the sdssRegistryConnection dataset (see SdssMapper.getRegistryConnection).
+    """
+    try:
+        return butler.get("sdssRegistryConnection")
+    except dafPersist.NoResults:
+        return None
+
+
+class SdssSelectImagesConfig(WcsSelectImagesTask.ConfigClass):
+    """Config for SdssSelectImagesTask"""
+    useFootprints = pexConfig.Field(
+        dtype=bool,
+        doc="Select frames from the footprints in the registry, rather than from their WCS?",
+        default=True,
+    )
+    htmLevel = pexConfig.Field(
+        dtype=int,
+        doc="HTM level of the sky tiles in the registry (see genInputRegistry.py --htmLevel)",
+        default=9,
+    )
+    registryPath = pexConfig.Field(
+        dtype=str,
+        doc="Path of the registry holding the frame footprints; if None, that of the input repository",
+        default=None,
+        optional=True,
+    )
+    selectAllRegistered = pexConfig.Field(
+        dtype=bool,
+        doc="Without selectDataList, select the registered frames overlapping the patch that have a "
+            "datasetType? If False, nothing is selected, as in WcsSelectImagesTask",
+        default=False,
+    )
+    datasetType = pexConfig.Field(
+        dtype=str,
+        doc="Dataset type of the data references to make for frames found in the registry",
+        default="calexp",
+    )
+
+
+class SdssSelectImagesTask(WcsSelectImagesTask):
+    """!Select SDSS frames overlapping a patch from the frame footprints in the registry
+
+    The footprints of the frames are computed from their asTrans files when
+    the registry is generated (see genInputRegistry.py), so selection needs
+    neither the calexps nor their WCS.  The frames of selectDataList are
+    selected as in WcsSelectImagesTask, except that registered frames are
+    tested against their footprints.  Without selectDataList, nothing is
+    selected unless config.selectAllRegistered is set, in which case every
+    registered frame of the patch's filter that overlaps the patch and has a
+    config.datasetType is selected.  If the registry has no footprints, this
+    falls back to WcsSelectImagesTask.
+    """
+    ConfigClass = SdssSelectImagesConfig
+    _DefaultName = "select"
+
+    def __init__(self, *args, **kwargs):
+        WcsSelectImagesTask.__init__(self, *args, **kwargs)
+        self.pixelization = sphgeom.HtmPixelization(self.config.htmLevel)
+        self._conn = None
+
+    def getConnection(self, butler):
+        """Return the sqlite3 connection to the registry holding the footprints, or None"""
+        if self.config.registryPath is not None:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.config.registryPath)
+            return self._conn
+        return getRegistryConnection(butler)
+
+    def selectFootprints(self, conn, coordList, filter=None):
+        """Return the FrameFootprints of the registered frames overlapping a patch
+
+        @param[in] conn  sqlite3 connection to the registry
+        @param[in] coordList  list of lsst.geom.SpherePoint going around the patch
+        @param[in] filter  restrict the frames to this filter, if not None
+
+        @return a FrameFootprints, or None if the registry has no footprints
+        """
+        if conn.execute("SELECT 1 FROM raw_footprint LIMIT 1").fetchone() is None:
+            return None
+        polygon = np.array([(coord.getRa().asDegrees(), coord.getDec().asDegrees()) for coord in coordList])
+        patchPoly = sphgeom.ConvexPolygon.convexHull([coord.getVector() for coord in coordList])
+        skyTileRanges = list(self.pixelization.envelope(patchPoly))
+        return queryFootprints(conn, polygon, skyTileRanges=skyTileRanges, filter=filter)
+
+    def runDataRef(self, dataRef, coordList, makeDataRefList=True, selectDataList=[]):
+        """Select frames that overlap a patch
+
+        @param[in] dataRef  data reference for the coadd or tempExp (with tract, patch and filter)
+        @param[in] coordList  list of lsst.geom.SpherePoint going around the patch
+        @param[in] makeDataRefList  construct a list of data references?
+        @param[in] selectDataList  list of SelectStruct to consider for selection;
+            if empty, all registered frames are considered if config.selectAllRegistered
+
+        @return a pipeBase.Struct with fields:
+        - dataRefList: list of data references of the selected frames, or None if not makeDataRefList
+        - exposureInfoList: list of BaseExposureInfo of the selected frames
+        """
+        useFootprints = self.config.useFootprints and \
+            (len(selectDataList) > 0 or self.config.selectAllRegistered)
+        if not useFootprints:
+            return WcsSelectImagesTask.runDataRef(self, dataRef, coordList, makeDataRefList=makeDataRefList,
+                                                  selectDataList=selectDataList)
+
+        butler = dataRef.getButler()
+        conn = self.getConnection(butler)
+        try:
+            footprints = None if conn is None else \
+                self.selectFootprints(conn, coordList, filter=dataRef.dataId.get("filter"))
+        except sqlite3.OperationalError as e:
+            self.log.warn("Cannot read frame footprints from the registry: %s" % (e,))
+            footprints = None
+        if footprints is None:
+            return WcsSelectImagesTask.runDataRef(self, dataRef, coordList, makeDataRefList=makeDataRefList,
+                                                  selectDataList=selectDataList)
+
+        def getKey(dataId):
+            return tuple(dataId.get(key) for key in ("run", "camcol", "field", "filter"))
+
+        selected = collections.OrderedDict((getKey(dataId), corners) for dataId, corners in
+                                           zip(footprints.dataIds, footprints.corners))
+        dataRefList = []
+        exposureInfoList = []
+
+        def addFrame(frameRef, dataId, corners):
+            dataRefList.append(frameRef)
+            exposureInfoList.append(BaseExposureInfo(
+                dataId, [geom.SpherePoint(ra, dec, geom.degrees) for ra, dec in corners]))
+
+        if len(selectDataList) == 0:
+            for key, corners in selected.items():
+                dataId = dict(run=key[0], camcol=key[1], field=key[2], filter=key[3])
+                if not butler.datasetExists(self.config.datasetType, dataId):
+                    continue
+                frameRef = butler.dataRef(self.config.datasetType, dataId=dataId) if makeDataRefList else None
+                addFrame(frameRef, dataId, corners)
+        else:
+            # Frames without a footprint in the registry are tested against their WCS
+            unregistered = []
+            for data in selectDataList:
+                key = getKey(data.dataRef.dataId)
+                if key in selected:
+                    addFrame(data.dataRef, data.dataRef.dataId, selected[key])
+                elif not hasFootprint(conn, key):
+                    unregistered.append(data)
+            if len(unregistered) > 0:
+                result = WcsSelectImagesTask.runDataRef(self, dataRef, coordList, makeDataRefList=True,
+                                                        selectDataList=unregistered)
+                dataRefList += result.dataRefList
+                exposureInfoList += result.exposureInfoList
+
+        self.log.info("Selected %d frames overlapping the patch" % (len(exposureInfoList),))
+        return pipeBase.Struct(
+            dataRefList=dataRefList if makeDataRefList else None,
+            exposureInfoList=exposureInfoList,
+        )
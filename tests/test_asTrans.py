@@ -0,0 +1,188 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from astropy.io import fits
+import numpy as np
+
+import lsst.utils.tests
+import lsst.geom
+from lsst.afw.geom import SkyWcs
+from lsst.obs.sdss.convertasTrans import (AsTransRun, FRAME_HEIGHT, FRAME_WIDTH, computeFootprints,
+                                          convertasTrans, getAsTrans, fitAsTransTable, getSidecarPath,
+                                          makeFitGrid, readSidecarWcs, writeWcsSidecar)
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+TSFIELD = os.path.join(ROOT, "data", "dr7", "runs", "5754", "40", "calibChunks", "3",
+                       "tsField-005754-3-40-0280.fit")
+
+
+def makeAsTrans(outfile, camcol=3, field=280):
+    """Write a minimal asTrans file for one camcol and field
+
+    The tsField file carries the same astrometric coefficients as the
+    asTrans file of its run, so we use it to build the test input.
+    """
+    with fits.open(TSFIELD) as ptr:
+        node = ptr[0].header['NODE']
+        incl = ptr[0].header['INCL']
+        filts = ptr[0].header['FILTERS'].split()
+        row = ptr[1].data[0]
+        coeffs = dict((name, row[name]) for name in AsTransRun.columns[1:])
+
+    asTransFilters = ['r', 'i', 'u', 'z', 'g']
+    primary = fits.PrimaryHDU()
+    primary.header['CCDARRAY'] = 'photo'
+    primary.header['CAMCOLS'] = str(camcol)
+    primary.header['FILTERS'] = ' '.join(asTransFilters)
+    primary.header['NODE'] = node
+    primary.header['INCL'] = incl
+    hdus = [primary]
+    for filt in asTransFilters:
+        idx = filts.index(filt)
+        cols = [fits.Column(name='field', format='J', array=np.array([field]))]
+        cols += [fits.Column(name=name, format='D', array=np.array([coeffs[name][idx]]))
+                 for name in AsTransRun.columns[1:]]
+        hdu = fits.BinTableHDU.from_columns(cols)
+        hdu.header['CAMCOL'] = camcol
+        hdu.header['FILTER'] = filt
+        hdus.append(hdu)
+    fits.HDUList(hdus).writeto(outfile)
+
+
+class AsTransTestCase(lsst.utils.tests.TestCase):
+    """Test conversion of asTrans files to WCS"""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=ROOT, prefix='AsTransTestCase-')
+        self.asTransFile = os.path.join(self.testDir, "asTrans-005754.fit")
+        makeAsTrans(self.asTransFile)
+
+    def tearDown(self):
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def testCache(self):
+        """Test that an asTrans file is parsed once and reparsed when it changes"""
+        asTrans = getAsTrans(self.asTransFile)
+        self.assertIs(getAsTrans(self.asTransFile), asTrans)
+        self.assertEqual(asTrans.getRowIndex(3, 'r', 280), 0)
+        self.assertIsNone(asTrans.getRowIndex(3, 'r', 281))
+        self.assertIsNone(asTrans.makeMapper(1, 'r', 280))
+
+        stat = os.stat(self.asTransFile)
+        os.utime(self.asTransFile, (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNot(getAsTrans(self.asTransFile), asTrans)
+
+    def testConvert(self):
+        """Test that the fitted WCS matches the result for the dr7 test data"""
+        wcs = convertasTrans(self.asTransFile, 'r', 3, 280)
+        # comparison is to results from lsst.afw.image.TanWcs class
+        self.assertSpherePointsAlmostEqual(wcs.pixelToSky(700, 1000),
+                                           lsst.geom.SpherePoint(343.6507738304687, -0.3509870420713227,
+                                                                 lsst.geom.degrees),
+                                           maxSep=0.01*lsst.geom.arcseconds)
+        self.assertIsNone(convertasTrans(self.asTransFile, 'r', 3, 281))
+
+    def testFitGrid(self):
+        """Test that the fit grid covers the frame, with x along its width"""
+        xs, ys = makeFitGrid(50)
+        self.assertEqual((xs.min(), ys.min()), (0, 0))
+        self.assertGreaterEqual(xs.max(), FRAME_WIDTH - 1)
+        self.assertLess(xs.max(), FRAME_WIDTH + 50)
+        self.assertGreaterEqual(ys.max(), FRAME_HEIGHT - 1)
+        self.assertLess(ys.max(), FRAME_HEIGHT + 50)
+
+    def testVectorizedFit(self):
+        """Test that the NumPy SIP fit agrees with the reference-match fit"""
+        wcs = convertasTrans(self.asTransFile, 'r', 3, 280)
+        matcherWcs = convertasTrans(self.asTransFile, 'r', 3, 280, useMatcher=True)
+        mapper = getAsTrans(self.asTransFile).makeMapper(3, 'r', 280)
+        for x, y in [(0, 0), (700, 1000), (2047, 1488), (1024, 744), (10, 1400)]:
+            ra, dec = mapper.xyToRaDec(x, y)
+            truth = lsst.geom.SpherePoint(ra, dec, lsst.geom.radians)
+            self.assertSpherePointsAlmostEqual(wcs.pixelToSky(x, y), matcherWcs.pixelToSky(x, y),
+                                               maxSep=0.01*lsst.geom.arcseconds)
+            self.assertSpherePointsAlmostEqual(wcs.pixelToSky(x, y), truth,
+                                               maxSep=0.001*lsst.geom.arcseconds)
+            self.assertPairsAlmostEqual(wcs.skyToPixel(truth), lsst.geom.Point2D(x, y), maxDiff=0.01)
+
+    def testExactWcs(self):
+        """Test that the exact WCS reproduces the asTrans transform"""
+        wcs = convertasTrans(self.asTransFile, 'r', 3, 280, exact=True)
+        self.assertIsInstance(wcs, SkyWcs)
+        self.assertFalse(wcs.isFlipped)
+        self.assertEqual(wcs.getFrameDict().getAllDomains(), {"PIXELS", "IWC", "SKY"})
+        mapper = getAsTrans(self.asTransFile).makeMapper(3, 'r', 280)
+        for x, y in [(0, 0), (700, 1000), (2047, 1488), (1024, 744), (10, 1400)]:
+            ra, dec = mapper.xyToRaDec(x, y)
+            truth = lsst.geom.SpherePoint(ra, dec, lsst.geom.radians)
+            self.assertSpherePointsAlmostEqual(wcs.pixelToSky(x, y), truth,
+                                               maxSep=1e-6*lsst.geom.arcseconds)
+            self.assertPairsAlmostEqual(wcs.skyToPixel(truth), lsst.geom.Point2D(x, y), maxDiff=1e-4)
+
+    def testSidecar(self):
+        """Test that the precomputed sidecar WCS matches the fitted one"""
+        self.assertIsNone(readSidecarWcs(self.asTransFile, 'r', 3, 280))
+        asTrans = getAsTrans(self.asTransFile)
+        rows = [fitAsTransTable(asTrans, camcol, filt) for camcol in asTrans.camcols
+                for filt in asTrans.filters]
+        writeWcsSidecar(getSidecarPath(self.asTransFile), rows)
+
+        sidecarWcs = readSidecarWcs(self.asTransFile, 'r', 3, 280)
+        wcs = convertasTrans(self.asTransFile, 'r', 3, 280)
+        for x, y in [(0, 0), (700, 1000), (2047, 1488)]:
+            self.assertSpherePointsAlmostEqual(sidecarWcs.pixelToSky(x, y), wcs.pixelToSky(x, y),
+                                               maxSep=1e-6*lsst.geom.arcseconds)
+        self.assertIsNone(readSidecarWcs(self.asTransFile, 'r', 3, 281))
+
+    def testFootprints(self):
+        """Test that the vectorized footprints match the per-field transform"""
+        asTrans = getAsTrans(self.asTransFile)
+        footprints = computeFootprints(asTrans, 3, 'r')
+        self.assertEqual(list(footprints.fields), [280])
+        self.assertEqual(footprints.corners.shape, (1, 4, 2))
+        mapper = asTrans.makeMapper(3, 'r', 280)
+        center = lsst.geom.SpherePoint(*footprints.centers[0], lsst.geom.degrees)
+        for i, (x, y) in enumerate([(-0.5, -0.5), (2047.5, -0.5), (2047.5, 1488.5), (-0.5, 1488.5)]):
+            ra, dec = mapper.xyToRaDec(x, y)
+            corner = lsst.geom.SpherePoint(*footprints.corners[0, i], lsst.geom.degrees)
+            self.assertSpherePointsAlmostEqual(corner, lsst.geom.SpherePoint(ra, dec, lsst.geom.radians),
+                                               maxSep=1e-6*lsst.geom.arcseconds)
+            self.assertLessEqual(center.separation(corner).asDegrees(), footprints.radii[0] + 1e-12)
+        self.assertEqual(len(computeFootprints(asTrans, 1, 'r').fields), 0)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,110 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from astropy.io import fits
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.image as afwImage
+from lsst.obs.sdss.convertfpC import convertfpC, readfpCRaw
+from lsst.obs.sdss.frameCache import FrameCache
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+FPC = os.path.join(ROOT, "data", "dr7", "runs", "5754", "40", "corr", "3", "fpC-005754-r3-0280.fit.gz")
+
+
+class FpCTestCase(lsst.utils.tests.TestCase):
+    """Test the direct float reader of fpC frames"""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=ROOT, prefix='FpCTestCase-')
+        self.truth = fits.getdata(FPC).astype(np.float32)
+
+    def tearDown(self):
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def testConvert(self):
+        """Test that the float reader matches the FITS pixels, without the overlap"""
+        exposure = convertfpC(FPC, overlapSize=128, pedestal=1000)
+        self.assertIsInstance(exposure, afwImage.ExposureF)
+        self.assertFloatsEqual(exposure.image.array, self.truth[:-128] - 1000)
+        self.assertEqual(exposure.getMetadata().getScalar("FRAME"), 280)
+
+    def testCache(self):
+        """Test that frames are decompressed into the cache once and then memory-mapped"""
+        cache = FrameCache(os.path.join(self.testDir, "cache"), 100*1024**2)
+        nRead = []
+
+        def reader(infile):
+            nRead.append(infile)
+            return readfpCRaw(infile)
+
+        header, data = cache.get(FPC, reader)
+        header2, data2 = cache.get(FPC, reader)
+        self.assertEqual(len(nRead), 1)
+        self.assertIsInstance(data2, np.memmap)
+        self.assertFloatsEqual(data2, data)
+        self.assertEqual(header2['RUN'], header['RUN'])
+
+        exposure = convertfpC(FPC, overlapSize=128, cache=cache)
+        self.assertFloatsEqual(exposure.image.array, self.truth[:-128])
+        self.assertEqual(len(cache), 1)
+
+        # A modified file is a new entry, and the budget evicts the old one
+        infile = os.path.join(self.testDir, os.path.basename(FPC))
+        shutil.copy(FPC, infile)
+        cache.maxBytes = data.nbytes + 50000
+        cache.get(infile, reader)
+        self.assertEqual(len(cache), 1)
+        stat = os.stat(infile)
+        os.utime(infile, (stat.st_atime, stat.st_mtime + 10))
+        cache.get(infile, reader)
+        self.assertEqual(len(nRead), 3)
+        self.assertEqual(len(cache), 1)
+
+        # Leftovers of interrupted writes count towards the budget, and are evicted
+        orphans = [os.path.join(cache.directory, name) for name in ("orphan.hdr", "orphan.tmp")]
+        for path in orphans:
+            with open(path, "wb") as fd:
+                fd.write(b"\0"*60000)
+            os.utime(path, (0, 0))
+        cache.evict()
+        self.assertFalse(any(os.path.exists(path) for path in orphans))
+        self.assertEqual(len(cache), 1)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,90 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import unittest
+
+from astropy.io import fits
+import numpy as np
+
+import lsst.utils.tests
+from lsst.obs.sdss.convertfpM import decodeSpans, readfpMSpans, setMaskFromSpans
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+FPM = os.path.join(ROOT, "data", "dr7", "runs", "5754", "40", "objcs", "3", "fpM-005754-r3-0280.fit")
+
+
+def setMaskSlow(maskArray, data, bitmask):
+    """Reference implementation: decode and set one span at a time"""
+    nrow, ncol = maskArray.shape
+    for frow in data:
+        span = [int(b) for b in frow[9]]
+        nspan = frow[1] if len(span) > 0 else 0
+        for i in range(nspan):
+            y = ((span[6*i] << 8) + span[6*i + 1]) - frow[2]
+            x1 = ((span[6*i + 2] << 8) + span[6*i + 3]) - frow[3]
+            x2 = ((span[6*i + 4] << 8) + span[6*i + 5]) - frow[3]
+            if y < 0 or y >= nrow:
+                continue
+            maskArray[y, max(x1, 0):min(x2, ncol - 1) + 1] |= bitmask
+
+
+class FpMTestCase(lsst.utils.tests.TestCase):
+    """Test decoding of fpM mask planes"""
+
+    def testDecodeSpans(self):
+        """Test that vectorized span decoding matches span-by-span decoding"""
+        with fits.open(FPM) as hdulist:
+            nRows = hdulist[0].header['MASKROWS']
+            nCols = hdulist[0].header['MASKCOLS']
+            for plane in range(1, hdulist[0].header['NPLANE'] + 1):
+                data = hdulist[plane].data
+                if data is None:
+                    continue
+                expected = np.zeros((nRows, nCols), dtype=np.int32)
+                setMaskSlow(expected, data, 0x4)
+                mask = np.zeros((nRows, nCols), dtype=np.int32)
+                setMaskFromSpans(mask, decodeSpans(data), 0x4)
+                self.assertFloatsEqual(mask, expected)
+
+    def testPlaneSelection(self):
+        """Test reading a subset of the fpM planes"""
+        self.assertEqual(readfpMSpans(FPM).getPlaneNames(), ["INTRP", "SAT", "CR"])
+        self.assertEqual(len(readfpMSpans(FPM, allPlanes=True).getPlaneNames()), 10)
+
+        maskSpans = readfpMSpans(FPM, planes=["CR", "S_MASK_OBJECT"])
+        self.assertEqual(maskSpans.getPlaneNames(), ["CR", "OBJECT"])
+        with fits.open(FPM) as hdulist:
+            expected = decodeSpans(hdulist[4].data)
+        self.assertFloatsEqual(maskSpans.planeSpans["OBJECT"].x1, expected.x1)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,92 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+#
+import os
+import unittest
+
+from astropy.io import fits
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.image as afwImage
+from lsst.obs.sdss.convertfpM import readfpMSpans
+from lsst.obs.sdss.frameBands import FrameBands, iterMaskBands, writeBands
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+RUNDIR = os.path.join(ROOT, "data", "dr7", "runs", "5754", "40")
+FPC = os.path.join(RUNDIR, "corr", "3", "fpC-005754-r3-0280.fit.gz")
+FPM = os.path.join(RUNDIR, "objcs", "3", "fpM-005754-r3-0280.fit")
+
+
+class FrameBandsTestCase(lsst.utils.tests.TestCase):
+    """Test the processing of frames in bands of rows"""
+
+    def setUp(self):
+        self.truth = fits.getdata(FPC).astype(np.float32)
+        self.maskSpans = readfpMSpans(FPM)
+
+    def testMaskBands(self):
+        mask = self.maskSpans.getMask()
+        bitmasks = dict((name, mask.getPlaneBitMask(name)) for name in self.maskSpans.getPlaneNames())
+        for bandRows in (1, 100, 1489, 5000):
+            bands = list(iterMaskBands(self.maskSpans, bitmasks, 1361, 2048, bandRows=bandRows))
+            self.assertEqual([y0 for y0, band in bands], list(range(0, 1361, bandRows)))
+            self.assertFloatsEqual(np.concatenate([band for y0, band in bands]), mask.array[:1361])
+
+    def testFrameBands(self):
+        gain = 4.72
+        mask = self.maskSpans.getMask()
+        for bandRows in (100, 1361):
+            with FrameBands(FPC, self.maskSpans, gain, overlapSize=128, pedestal=1000,
+                            bandRows=bandRows) as bands:
+                self.assertEqual((bands.nRows, bands.nCols), (1361, 2048))
+                maskedImage = afwImage.MaskedImageF(bands.nCols, bands.nRows)
+                self.assertEqual(writeBands(maskedImage, bands), 1361)
+            image = self.truth[:1361] - 1000
+            self.assertFloatsEqual(maskedImage.image.array, image)
+            self.assertFloatsEqual(maskedImage.variance.array, np.divide(image, gain, dtype=np.float32))
+            self.assertFloatsEqual(maskedImage.mask.array, mask.array[:1361])
+
+        # The bands are only decompressed once
+        bands = FrameBands(FPC, self.maskSpans, gain)
+        self.assertEqual(len(list(bands)), 6)
+        with self.assertRaises(RuntimeError):
+            list(bands)
+
+    def testScale(self):
+        with FrameBands(FPC, self.maskSpans, 2.0, pedestal=1000, scale=3.0) as bands:
+            band = next(iter(bands))
+        self.assertFloatsAlmostEqual(band.image, 3*(self.truth[:256] - 1000), rtol=1e-6)
+        self.assertFloatsAlmostEqual(band.variance, 3*band.image/2.0, rtol=1e-6)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
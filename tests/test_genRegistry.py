@@ -0,0 +1,147 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import importlib.util
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import lsst.utils.tests
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+BINDIR = os.path.join(ROOT, os.path.pardir, "bin.src")
+RUNSDIR = os.path.join(ROOT, "data", "dr7", "runs")
+FPC = os.path.join("5754", "40", "corr", "3", "fpC-005754-r3-%04d.fit.gz")
+
+
+def importScript(name):
+    """Import a registry generation script of bin.src as a module"""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(BINDIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class GenInputRegistryTestCase(lsst.utils.tests.TestCase):
+    """Test the update and header-free modes of genInputRegistry.py"""
+
+    def setUp(self):
+        self.script = importScript("genInputRegistry")
+        self.testDir = tempfile.mkdtemp(dir=ROOT, prefix='GenInputRegistryTestCase-')
+        self.runsDir = os.path.join(self.testDir, "runs")
+        shutil.copytree(RUNSDIR, self.runsDir, ignore=shutil.ignore_patterns("registry.sqlite3"))
+
+    def tearDown(self):
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def getRows(self, registry):
+        conn = sqlite3.connect(registry)
+        try:
+            return conn.execute("SELECT run, rerun, filter, camcol, field, taiObs, strip FROM raw "
+                                "ORDER BY field").fetchall()
+        finally:
+            conn.close()
+
+    def testUpdate(self):
+        registry = os.path.join(self.testDir, "registry.sqlite3")
+        self.script.process([self.runsDir], None, registry, htmLevel=None)
+        rows = self.getRows(registry)
+        self.assertEqual([row[:5] for row in rows], [(5754, 40, 'r', 3, 280)])
+
+        # A new frame is all an update registers
+        shutil.copy(os.path.join(self.runsDir, FPC % 280), os.path.join(self.runsDir, FPC % 281))
+        self.script.process([self.runsDir], None, registry, update=True, htmLevel=None)
+        newRows = self.getRows(registry)
+        self.assertEqual(newRows[0], rows[0])
+        self.assertEqual([row[:5] for row in newRows], [(5754, 40, 'r', 3, 280), (5754, 40, 'r', 3, 281)])
+
+        # Directories that look unchanged are not scanned again
+        conn = sqlite3.connect(registry)
+        (mtime, nFiles), = conn.execute("SELECT mtime, nFiles FROM scanned_dir").fetchall()
+        conn.close()
+        self.assertEqual(nFiles, 2)
+        shutil.copy(os.path.join(self.runsDir, FPC % 280), os.path.join(self.runsDir, FPC % 282))
+        os.utime(os.path.dirname(os.path.join(self.runsDir, FPC % 282)), (mtime, mtime))
+        self.script.process([self.runsDir], None, registry, update=True, htmLevel=None)
+        self.assertEqual(self.getRows(registry), newRows)
+
+    def testHeaderFree(self):
+        registry = os.path.join(self.testDir, "registry.sqlite3")
+        self.script.process([self.runsDir], None, registry, htmLevel=None)
+        noHeadersRegistry = os.path.join(self.testDir, "noHeaders.sqlite3")
+        self.script.process([self.runsDir], None, noHeadersRegistry, headerFree=True, nCheck=1,
+                            htmLevel=None)
+        rows = self.getRows(registry)
+        derivedRows = self.getRows(noHeadersRegistry)
+        self.assertEqual(len(derivedRows), len(rows))
+        for derived, fromHeader in zip(derivedRows, rows):
+            self.assertTrue(self.script.checkFrameInfo(derived, fromHeader))
+
+
+class GenCoaddRegistryTestCase(lsst.utils.tests.TestCase):
+    """Test the update mode of genCoaddRegistry.py"""
+
+    def setUp(self):
+        self.script = importScript("genCoaddRegistry")
+        self.testDir = tempfile.mkdtemp(dir=ROOT, prefix='GenCoaddRegistryTestCase-')
+        self.coaddDir = os.path.join(self.testDir, "coadd")
+        os.makedirs(os.path.join(self.coaddDir, "r"))
+
+    def tearDown(self):
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def addPiece(self, run, camcol, field):
+        open(os.path.join(self.coaddDir, "r", "fpC-%06d-r%d-%04d_ts_coaddNorm_NN.fit.gz" %
+                          (run, camcol, field)), "w").close()
+
+    def getRows(self, registry):
+        conn = sqlite3.connect(registry)
+        try:
+            return conn.execute("SELECT run, filter, camcol, field FROM raw ORDER BY field").fetchall()
+        finally:
+            conn.close()
+
+    def testUpdate(self):
+        registry = os.path.join(self.testDir, "registry.sqlite3")
+        self.addPiece(5754, 3, 280)
+        self.script.process([self.coaddDir], None, registry)
+        self.assertEqual(self.getRows(registry), [(5754, 'r', 3, 280)])
+
+        self.addPiece(5754, 3, 281)
+        self.script.process([self.coaddDir], None, registry, update=True)
+        self.assertEqual(self.getRows(registry), [(5754, 'r', 3, 280), (5754, 'r', 3, 281)])
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,114 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import unittest
+
+from astropy.io import fits
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.image as afwImage
+from lsst.obs.sdss.convertpsField import (convertpsField, getPsField, filtToHdu, skMatrixPos2TriSeqPosT,
+                                          computePsfImages)
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+PSFIELD = os.path.join(ROOT, "data", "dr7", "runs", "5754", "40", "objcs", "3", "psField-005754-3-0280.fit")
+
+
+def getSpatialParametersSlow(infile, filt, rcscale=0.001, MAX_ORDER_B=5, LSST_ORDER=4):
+    """Reference implementation: remap the spatial coefficients one term at a time"""
+    pstruct = fits.getdata(infile, ext=filtToHdu[filt])
+    spaParList = []
+    for i in range(len(pstruct)):
+        nrow_b = pstruct[i][0]
+        ncol_b = pstruct[i][1]
+        cmat = pstruct[i][2].reshape((MAX_ORDER_B, MAX_ORDER_B))
+        spaParamsTri = np.zeros(MAX_ORDER_B * MAX_ORDER_B)
+        for k in range(nrow_b * ncol_b):
+            row = k % nrow_b
+            col = k // nrow_b
+            scale = pow(rcscale, row) * pow(rcscale, col)
+            spaParamsTri[skMatrixPos2TriSeqPosT[col * MAX_ORDER_B + row]] = cmat[row, col] * scale
+        spaParList.append(spaParamsTri[:(LSST_ORDER + 1) * (LSST_ORDER + 2) // 2])
+    return spaParList
+
+
+class PsFieldTestCase(lsst.utils.tests.TestCase):
+    """Test conversion of psField files to PSFs"""
+
+    def testCache(self):
+        """Test that all filters are decoded once and their kernels shared"""
+        psField = getPsField(PSFIELD)
+        self.assertEqual(sorted(psField.keys()), ['g', 'i', 'r', 'u', 'z'])
+        self.assertIs(getPsField(PSFIELD), psField)
+
+        band = psField['r']
+        self.assertEqual(band.getKernels().shape, (4, 31, 31))
+        self.assertFalse(band.kernels.flags.writeable)
+
+        self.assertIs(band.getKernelList(), band.getKernelList())
+        psf = convertpsField(PSFIELD, 'r')
+        psf2 = convertpsField(PSFIELD, 'r')
+        self.assertIsNot(psf2, psf)
+        self.assertFloatsEqual(psf2.computeKernelImage().array, psf.computeKernelImage().array)
+        self.assertEqual(psf.getKernel().getWidth(), 31)
+        self.assertEqual(convertpsField(PSFIELD, 'r', trim=False).getKernel().getWidth(), 51)
+
+    def testSpatialParameters(self):
+        """Test that the vectorized coefficient remapping matches the term-by-term one"""
+        psField = getPsField(PSFIELD)
+        for filt in filtToHdu:
+            spaParList = psField[filt].getSpatialParameters()
+            expected = getSpatialParametersSlow(PSFIELD, filt)
+            self.assertEqual(len(spaParList), len(expected))
+            for spaPar, exp in zip(spaParList, expected):
+                self.assertFloatsEqual(spaPar, exp)
+
+    def testComputeImages(self):
+        """Test batch evaluation of the PSF against Kernel.computeImage"""
+        xs = np.array([0.0, 500.5, 2047.0, 1024.0])
+        ys = np.array([0.0, 1000.0, 1488.0, 10.25])
+        for filt in filtToHdu:
+            band = getPsField(PSFIELD)[filt]
+            images = band.computeImages(xs, ys)
+            self.assertEqual(images.shape, (4, 31, 31))
+            self.assertFloatsAlmostEqual(computePsfImages(convertpsField(PSFIELD, filt), xs, ys), images,
+                                         rtol=1e-12)
+
+            kernel = convertpsField(PSFIELD, filt).getKernel()
+            kImage = afwImage.ImageD(kernel.getDimensions())
+            for x, y, image in zip(xs, ys, images):
+                kernel.computeImage(kImage, True, x, y)
+                self.assertFloatsAlmostEqual(image, kImage.array, rtol=1e-10, atol=1e-14)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
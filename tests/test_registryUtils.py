@@ -0,0 +1,118 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+import lsst.sphgeom as sphgeom
+from lsst.obs.sdss.convertasTrans import getAsTrans
+from lsst.obs.sdss.registryUtils import (DirectoryScanner, getFramesWithoutFootprint, getRegisteredKeys,
+                                         registerFootprints)
+from test_asTrans import makeAsTrans
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+
+
+class RegistryUtilsTestCase(lsst.utils.tests.TestCase):
+    """Test the helpers of the registry generation scripts"""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=ROOT, prefix='RegistryUtilsTestCase-')
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                          "run INT, filter TEXT, camcol INT, field INT)")
+        self.conn.execute("CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)")
+
+    def tearDown(self):
+        self.conn.close()
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def testRegisteredKeys(self):
+        self.conn.executemany("INSERT INTO raw VALUES (NULL, ?, ?, ?, ?)",
+                              [(5754, 'r', 3, 280), (5754, 'g', 3, 280)])
+        self.conn.execute("INSERT INTO raw VALUES (NULL, 5754, 'r', 4, 280)")
+        self.assertEqual(getRegisteredKeys(self.conn, ("run", "filter", "camcol", "field")),
+                         {(5754, 'r', 3, 280), (5754, 'g', 3, 280), (5754, 'r', 4, 280)})
+        self.assertEqual(getRegisteredKeys(self.conn, ("filter", "field"), run=5754, camcol=3),
+                         {('r', 280), ('g', 280)})
+        self.assertEqual(getRegisteredKeys(self.conn, ("camcol",), filter='r', run=5754), {(3,), (4,)})
+        self.assertEqual(getRegisteredKeys(self.conn, ("field",), run=1033), set())
+
+    def testScanner(self):
+        """Test that only directories changed since they were recorded need a scan"""
+        scanner = DirectoryScanner(self.conn)
+        mtime = scanner.getMtime(self.testDir)
+        self.assertTrue(scanner.needsScan(self.testDir, mtime))
+        self.assertEqual(scanner.getRemovedCount(self.testDir, 0), 0)
+        scanner.record(self.testDir, mtime, 5)
+
+        # Without update, everything is scanned again
+        self.assertTrue(DirectoryScanner(self.conn).needsScan(self.testDir, mtime))
+        scanner = DirectoryScanner(self.conn, update=True)
+        self.assertFalse(scanner.needsScan(self.testDir, mtime))
+        self.assertTrue(scanner.needsScan(self.testDir, mtime + 10))
+        self.assertEqual(scanner.getRemovedCount(self.testDir, 3), 2)
+        self.assertEqual(scanner.getRemovedCount(self.testDir, 7), 0)
+
+    def testFootprints(self):
+        """Test that frame footprints and sky tiles are recorded from asTrans"""
+        asTransFile = os.path.join(self.testDir, "asTrans-005754.fit")
+        makeAsTrans(asTransFile)
+        self.conn.executemany("INSERT INTO raw VALUES (NULL, ?, ?, ?, ?)",
+                              [(5754, 'r', 3, 280), (5754, 'r', 3, 281)])
+        frames = getFramesWithoutFootprint(self.conn, [5754], hasRerun=False)
+        self.assertEqual(len(frames), 2)
+        pixelization = sphgeom.HtmPixelization(9)
+        nFootprints = registerFootprints(self.conn, frames, lambda run, rerun: asTransFile, pixelization)
+        self.assertEqual(nFootprints, 1)
+        self.assertEqual(getFramesWithoutFootprint(self.conn, [5754], hasRerun=False),
+                         [(2, 5754, None, 'r', 3, 281)])
+
+        corners = np.array(self.conn.execute("SELECT * FROM raw_footprint WHERE id=1").fetchone()[1:])
+        mapper = getAsTrans(asTransFile).makeMapper(3, 'r', 280)
+        ra, dec = mapper.xyToRaDec(np.array([-0.5, 2047.5]), np.array([-0.5, 1488.5]))
+        self.assertFloatsAlmostEqual(corners[[0, 4]], np.degrees(ra) % 360, atol=1e-10)
+        self.assertFloatsAlmostEqual(corners[[1, 5]], np.degrees(dec), atol=1e-10)
+
+        ra, dec = mapper.xyToRaDec(1024.0, 744.0)
+        center = sphgeom.UnitVector3d(sphgeom.LonLat.fromRadians(ra, dec))
+        skyTiles = [row[0] for row in self.conn.execute("SELECT skyTile FROM raw_skyTile WHERE id=1")]
+        self.assertIn(pixelization.index(center), skyTiles)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
@@ -0,0 +1,112 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+#
+import os
+import unittest
+
+from astropy.io import fits
+import numpy as np
+
+import lsst.utils.tests
+import lsst.afw.image as afwImage
+import lsst.geom
+from lsst.obs.sdss.convertasTrans import AsTransRun, deg2rad, makeWcsFromSolution
+from lsst.obs.sdss.convertfpM import readfpMSpans
+from lsst.obs.sdss.converttsField import converttsField
+from lsst.obs.sdss.scanline import ScanlineField, fitScanlineWcs, stitchFields
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+RUNDIR = os.path.join(ROOT, "data", "dr7", "runs", "5754", "40")
+FPC = os.path.join(RUNDIR, "corr", "3", "fpC-005754-r3-0280.fit.gz")
+FPM = os.path.join(RUNDIR, "objcs", "3", "fpM-005754-r3-0280.fit")
+TSFIELD = os.path.join(RUNDIR, "calibChunks", "3", "tsField-005754-3-40-0280.fit")
+
+
+def makeAsTransRun(fields, camcol=3, filt='r', nRows=1361):
+    """Make an AsTransRun of consecutive fields continuing the scan of field 280 of the tsField file"""
+    with fits.open(TSFIELD) as ptr:
+        node = ptr[0].header['NODE']
+        incl = ptr[0].header['INCL']
+        idx = ptr[0].header['FILTERS'].split().index(filt)
+        row = ptr[1].data[0]
+        table = dict((name, np.full(len(fields), row[name][idx], dtype=np.float64))
+                     for name in AsTransRun.columns[1:])
+    offsets = (np.array(fields) - fields[0]) * nRows
+    table["a"] += offsets * table["b"]
+    table["d"] += offsets * table["e"]
+    table["field"] = np.array(fields, dtype=np.int32)
+    return AsTransRun(node * deg2rad, incl * deg2rad, [camcol], [filt], {(camcol, filt): table})
+
+
+class ScanlineTestCase(lsst.utils.tests.TestCase):
+    """Test the stitching of consecutive fields into a scanline"""
+
+    def testWcs(self):
+        """Test that one WCS reproduces the asTrans transform of every field"""
+        fields = list(range(280, 285))
+        asTrans = makeAsTransRun(fields)
+        wcs = makeWcsFromSolution(fitScanlineWcs(asTrans, 3, 'r', fields))
+        for k, field in enumerate(fields):
+            mapper = asTrans.makeMapper(3, 'r', field)
+            for x, y in [(0, 0), (700, 1000), (2047, 1360)]:
+                ra, dec = mapper.xyToRaDec(float(x), float(y))
+                self.assertSpherePointsAlmostEqual(wcs.pixelToSky(x, y + k*1361),
+                                                   lsst.geom.SpherePoint(ra, dec, lsst.geom.radians),
+                                                   maxSep=0.001*lsst.geom.arcseconds)
+
+    def testStitch(self):
+        """Test that the fields are stacked without their overlap, optionally on one calibration"""
+        tsField = converttsField(TSFIELD, 'r')
+        tsField2 = tsField._replace(photoCalib=afwImage.PhotoCalib(2*tsField.photoCalib.getCalibrationMean()),
+                                    gain=2*tsField.gain)
+        fpM = readfpMSpans(FPM)
+        fields = [ScanlineField(280, FPC, fpM, tsField), ScanlineField(281, FPC, fpM, tsField2)]
+        maskedImage = stitchFields(fields, bandRows=100, calibrate=True)
+        self.assertEqual(maskedImage.getDimensions(), lsst.geom.Extent2I(2048, 2*1361))
+
+        truth = fits.getdata(FPC).astype(np.float32)[:1361] - 1000
+        image = maskedImage.image.array
+        self.assertFloatsEqual(image[:1361], truth)
+        self.assertFloatsAlmostEqual(image[1361:], 2*truth, rtol=1e-6)
+        self.assertFloatsAlmostEqual(maskedImage.variance.array[:1361], truth / tsField.gain, rtol=1e-6)
+        self.assertFloatsAlmostEqual(maskedImage.variance.array[1361:], 2*truth / tsField.gain, rtol=1e-6)
+        mask = fpM.getMask().array[:1361]
+        self.assertFloatsEqual(maskedImage.mask.array[:1361], mask)
+        self.assertFloatsEqual(maskedImage.mask.array[1361:], mask)
+
+        # Uncalibrated, each field keeps its own counts
+        maskedImage = stitchFields(fields, bandRows=100)
+        self.assertFloatsEqual(maskedImage.image.array[1361:], truth)
+        self.assertFloatsAlmostEqual(maskedImage.variance.array[1361:], truth / tsField2.gain, rtol=1e-6)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
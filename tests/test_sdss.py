@@ -31,7 +31,8 @@ from lsst.daf.base import DateTime
 import lsst.afw.image
 from lsst.afw.geom import SkyWcs
 import lsst.afw.detection
-from lsst.geom import SpherePoint, degrees
+from lsst.geom import SpherePoint, arcseconds, degrees
+from lsst.obs.sdss.sdssSelectImages import getRegistryConnection
 
 
 class SdssMapperTestCase(lsst.utils.tests.TestCase):
@@ -43,6 +44,10 @@ class SdssMapperTestCase(lsst.utils.tests.TestCase):
             root=os.path.join(obsSdssDir, "tests", "data", "dr7", "runs"))
         sub = butler.subset("fpC", run=5754, camcol=3, field=280, filter="r")
         self.assertEqual(len(sub), 1)
+        conn = getRegistryConnection(butler)
+        self.assertIs(conn, butler.get("sdssRegistryConnection"))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM raw WHERE run = 5754 AND camcol = 3 "
+                                      "AND field = 280 AND filter = 'r'").fetchone()[0], 1)
         for ref in sub:
             im = ref.get("fpC")
             w, h = im.getWidth(), im.getHeight()
@@ -50,6 +55,13 @@ class SdssMapperTestCase(lsst.utils.tests.TestCase):
             self.assertEqual(w, 2048)
             self.assertEqual(h, 1489)
 
+            imF = ref.get("fpCFloat")
+            self.assertEqual(imF.__class__, lsst.afw.image.ExposureF)
+            self.assertEqual(imF.getWidth(), 2048)
+            self.assertEqual(imF.getHeight(), 1361)
+            self.assertFloatsEqual(imF.image.array, im.image.array[:1361])
+            self.assertEqual(imF.getMetadata().getScalar("RUN"), 5754)
+
             im_md = ref.get("fpC_md")
             self.assertEqual(im_md.getScalar("RUN"), 5754)
             self.assertEqual(im_md.getScalar("FRAME"), 280)
@@ -61,6 +73,13 @@ class SdssMapperTestCase(lsst.utils.tests.TestCase):
             self.assertEqual(w, 2048)
             self.assertEqual(h, 1489)
 
+            maskSpans = ref.get("fpMSpans")
+            self.assertEqual(set(maskSpans.getPlaneNames()), {"INTRP", "SAT", "CR"})
+            self.assertFloatsEqual(maskSpans.getMask().array, msk.array)
+            crBit = msk.getPlaneBitMask("CR")
+            self.assertEqual(maskSpans.getSpanSet("CR").getArea(),
+                             (msk.array & crBit != 0).sum())
+
             psf = ref.get("psField")
             k = psf.getKernel()
             w, h = k.getWidth(), k.getHeight()
@@ -75,6 +94,12 @@ class SdssMapperTestCase(lsst.utils.tests.TestCase):
             self.assertSpherePointsAlmostEqual(wcs.pixelToSky(700, 1000),
                                                SpherePoint(343.6507738304687, -0.3509870420713227, degrees))
 
+            footprints = ref.get("asTransFootprints")
+            idx = list(footprints.fields).index(280)
+            self.assertEqual(footprints.corners.shape[1:], (4, 2))
+            self.assertSpherePointsAlmostEqual(wcs.pixelToSky(-0.5, -0.5),
+                                               SpherePoint(*footprints.corners[idx, 0], degrees))
+
             tsField = ref.get("tsField")
             self.assertAlmostEqual(tsField.gain, 4.72, 2)
             self.assertAlmostEqual(tsField.airmass, 1.2815132857671601)
@@ -84,6 +109,31 @@ class SdssMapperTestCase(lsst.utils.tests.TestCase):
                                    DateTime.TAI)
             self.assertAlmostEqual(tsField.dateAvg.get(), predDateAvg.get())
 
+            scanline = ref.get("fpCScanline")
+            self.assertEqual(scanline.getDimensions(), imF.getDimensions())
+            self.assertFloatsAlmostEqual(scanline.image.array, imF.image.array - 1000)
+            self.assertFloatsAlmostEqual(scanline.variance.array, scanline.image.array / tsField.gain,
+                                         rtol=1e-6)
+            self.assertFloatsEqual(scanline.mask.array, msk.array[:1361])
+            self.assertSpherePointsAlmostEqual(scanline.getWcs().pixelToSky(700, 1000),
+                                               wcs.pixelToSky(700, 1000), maxSep=0.01*arcseconds)
+            self.assertEqual(scanline.getMetadata().getScalar("NFIELDS"), 1)
+            self.assertFalse(scanline.getMetadata().getScalar("FIELDCAL"))
+            scanline = butler.get("fpCScanline", dataId=dict(ref.dataId, nFields=1))
+            self.assertEqual(scanline.getMetadata().getScalar("NFIELDS"), 1)
+
+            bundle = ref.get("sdssFrameBundle")
+            self.assertEqual(bundle.fpC.__class__, lsst.afw.image.ExposureU)
+            self.assertFloatsEqual(bundle.fpC.image.array, im.image.array)
+            self.assertFloatsEqual(bundle.fpM.array, msk.array)
+            self.assertIsInstance(bundle.asTrans, SkyWcs)
+            self.assertEqual(bundle.psField.__class__, lsst.meas.algorithms.PcaPsf)
+            self.assertAlmostEqual(bundle.tsField.gain, tsField.gain)
+            self.assertEqual(set(bundle.timings.keys()), {"fpC", "fpM", "asTrans", "tsField", "psField"})
+            bundle = ref.get("sdssFrameBundleFloat")
+            self.assertEqual(bundle.fpC.__class__, lsst.afw.image.ExposureF)
+            self.assertFloatsEqual(bundle.fpC.image.array, imF.image.array)
+
 
 class TestMemory(lsst.utils.tests.MemoryTestCase):
     pass
@@ -0,0 +1,77 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import itertools
+import os
+import unittest
+
+import lsst.utils.tests
+import lsst.daf.persistence as dafPersist
+from lsst.obs.sdss.sdssNullIsr import SdssNullIsrTask
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+DATAID = dict(run=5754, camcol=3, field=280, filter="r")
+
+
+class SdssNullIsrTestCase(lsst.utils.tests.TestCase):
+    """Test that the ways of loading a frame give the same post-ISR exposure"""
+
+    def setUp(self):
+        butler = dafPersist.Butler(root=os.path.join(ROOT, "data", "dr7", "runs"))
+        self.sensorRef = butler.dataRef("fpC", **DATAID)
+
+    def tearDown(self):
+        del self.sensorRef
+
+    def loadExposure(self, **kwargs):
+        config = SdssNullIsrTask.ConfigClass()
+        for name, value in kwargs.items():
+            setattr(config, name, value)
+        return SdssNullIsrTask(config=config).loadExposure(self.sensorRef)
+
+    def testConfigs(self):
+        names = ("useFrameBundle", "useFloatfpC", "streamBands")
+        for removeOverlap in (True, False):
+            truth = self.loadExposure(removeOverlap=removeOverlap)
+            self.assertEqual(truth.getHeight(), 1361 if removeOverlap else 1489)
+            for values in itertools.product((False, True), repeat=len(names)):
+                kwargs = dict(zip(names, values))
+                with self.subTest(removeOverlap=removeOverlap, **kwargs):
+                    exposure = self.loadExposure(removeOverlap=removeOverlap, **kwargs)
+                    self.assertEqual(exposure.getBBox(), truth.getBBox())
+                    self.assertFloatsEqual(exposure.image.array, truth.image.array)
+                    self.assertFloatsEqual(exposure.mask.array, truth.mask.array)
+                    self.assertFloatsAlmostEqual(exposure.variance.array, truth.variance.array,
+                                                 rtol=1e-6)
+                    self.assertEqual(exposure.getPhotoCalib(), truth.getPhotoCalib())
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
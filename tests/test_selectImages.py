@@ -0,0 +1,115 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+#
+import sqlite3
+import unittest
+
+import numpy as np
+
+import lsst.utils.tests
+from lsst.obs.sdss.registryUtils import createFootprintTable
+from lsst.obs.sdss.sdssSelectImages import hasFootprint, overlapsPolygon, queryFootprints
+
+
+def makeFrame(ra, dec, width=0.2, height=0.15, angle=0.0):
+    """Return the corners, going around, of a small frame centered at (ra, dec), in degrees"""
+    dx = np.array([-0.5, 0.5, 0.5, -0.5])*width
+    dy = np.array([-0.5, -0.5, 0.5, 0.5])*height
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    return np.stack([ra + (c*dx - s*dy)/np.cos(np.radians(dec)), dec + s*dx + c*dy], axis=-1)
+
+
+class SelectImagesTestCase(lsst.utils.tests.TestCase):
+    """Test the selection of frames overlapping a patch from registry footprints"""
+
+    def setUp(self):
+        self.patch = makeFrame(10.0, 0.0, width=0.5, height=0.5)
+
+    def testOverlaps(self):
+        frames = np.array([
+            makeFrame(10.0, 0.0),           # inside
+            makeFrame(10.3, 0.3),           # overlapping a corner
+            makeFrame(10.36, 0.0),          # just outside the right edge
+            makeFrame(9.66, -0.34, angle=45),  # corner-to-corner, disjoint but with overlapping bboxes
+            makeFrame(9.7, -0.3, angle=45),  # corner-to-corner, overlapping
+            makeFrame(10.0, 0.0, width=2, height=2),  # containing the patch
+        ])
+        self.assertEqual(overlapsPolygon(frames, self.patch).tolist(),
+                         [True, True, False, False, True, True])
+        # Orientation of the polygons does not matter
+        self.assertEqual(overlapsPolygon(frames[:, ::-1], self.patch[::-1]).tolist(),
+                         [True, True, False, False, True, True])
+
+    def testWrap(self):
+        """Test frames and patches straddling RA=0"""
+        patch = makeFrame(0.0, 0.0, width=0.5, height=0.5)
+        frames = np.array([makeFrame(359.9, 0.1), makeFrame(0.1, -0.1), makeFrame(359.5, 0.0)])
+        patch[:, 0] %= 360
+        frames[:, :, 0] %= 360
+        self.assertEqual(overlapsPolygon(frames, patch).tolist(), [True, True, False])
+
+    def testQuery(self):
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE raw (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                     "run INT, filter TEXT, camcol INT, field INT)")
+        conn.execute("CREATE TABLE raw_skyTile (id INTEGER, skyTile INTEGER)")
+        createFootprintTable(conn)
+        frames = [((5754, 'r', 3, 280), makeFrame(10.1, 0.1), 1),
+                  ((5754, 'g', 3, 280), makeFrame(10.1, 0.1), 1),
+                  ((5754, 'r', 3, 281), makeFrame(10.5, 0.1), 2),
+                  ((5754, 'r', 3, 282), makeFrame(20.0, 0.1), 3)]
+        for i, (key, corners, skyTile) in enumerate(frames, 1):
+            conn.execute("INSERT INTO raw VALUES (?, ?, ?, ?, ?)", (i,) + key)
+            center = corners.mean(axis=0)
+            conn.execute("INSERT INTO raw_footprint VALUES (%s)" % (", ".join("?"*12),),
+                         [i] + corners.flatten().tolist() + center.tolist() + [0.15])
+            conn.execute("INSERT INTO raw_skyTile VALUES (?, ?)", (i, skyTile))
+
+        def getIds(footprints):
+            return sorted((d["run"], d["filter"], d["camcol"], d["field"]) for d in footprints.dataIds)
+
+        footprints = queryFootprints(conn, self.patch, filter='r')
+        self.assertEqual(getIds(footprints), [(5754, 'r', 3, 280)])
+        self.assertFloatsAlmostEqual(footprints.corners[0], frames[0][1], atol=1e-12)
+        self.assertEqual(getIds(queryFootprints(conn, self.patch)),
+                         [(5754, 'g', 3, 280), (5754, 'r', 3, 280)])
+        # Only the frames in the given sky tiles are candidates
+        self.assertEqual(getIds(queryFootprints(conn, self.patch, skyTileRanges=[(2, 4)])), [])
+        footprints = queryFootprints(conn, self.patch, skyTileRanges=[(0, 2), (3, 4)], filter='r')
+        self.assertEqual(getIds(footprints), [(5754, 'r', 3, 280)])
+
+        self.assertTrue(hasFootprint(conn, (5754, 3, 281, 'r')))
+        self.assertFalse(hasFootprint(conn, (5754, 3, 283, 'r')))
+        conn.close()
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()
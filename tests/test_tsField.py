@@ -0,0 +1,130 @@
+#
+# LSST Data Management System
+# Copyright 2008-2015 AURA/LSST.
+#
+# This product includes software developed by the
+# LSST Project (http://www.lsst.org/).
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the LSST License Statement and
+# the GNU General Public License along with this program.  If not,
+# see <https://www.lsstcorp.org/LegalNotices/>.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from astropy.io import fits
+
+import lsst.utils.tests
+from lsst.obs.sdss.converttsField import (converttsField, getTsFieldTable, getTsFieldTablePath,
+                                          readTsFieldTable, TsFieldTable)
+
+ROOT = os.path.abspath(os.path.dirname(__file__))
+TSFIELD = os.path.join(ROOT, "data", "dr7", "runs", "5754", "40", "calibChunks", "3",
+                       "tsField-005754-3-40-0280.fit")
+
+
+class TsFieldTableTestCase(lsst.utils.tests.TestCase):
+    """Test reading tsField files of a whole camcol into one table"""
+
+    def setUp(self):
+        self.testDir = tempfile.mkdtemp(dir=ROOT, prefix='TsFieldTableTestCase-')
+        # A second field, with a different calibration
+        shutil.copy(TSFIELD, self.testDir)
+        with fits.open(TSFIELD) as ptr:
+            ptr[1].data['field'][0] = 281
+            ptr[1].data['aa'][0] += 0.1
+            ptr[1].data['mjd'][0] += 0.001
+            ptr.writeto(os.path.join(self.testDir, "tsField-005754-3-40-0281.fit"))
+
+    def tearDown(self):
+        if os.path.exists(self.testDir):
+            shutil.rmtree(self.testDir)
+
+    def assertTsFieldsEqual(self, tsField1, tsField2):
+        self.assertEqual(tsField1.gain, tsField2.gain)
+        self.assertEqual(tsField1.airmass, tsField2.airmass)
+        self.assertEqual(tsField1.exptime, tsField2.exptime)
+        self.assertEqual(tsField1.dateAvg.nsecs(), tsField2.dateAvg.nsecs())
+        self.assertEqual(tsField1.photoCalib, tsField2.photoCalib)
+
+    def testTable(self):
+        """Test that the table serves the same TsField as the files"""
+        infiles = [os.path.join(self.testDir, "tsField-005754-3-40-%04d.fit" % field) for field in (281, 280)]
+        table = readTsFieldTable(infiles)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(list(table.fields), [280, 281])
+        self.assertIsNone(table.getRowIndex(282))
+        for field, infile in zip((281, 280), infiles):
+            for filt in "ugriz":
+                self.assertTsFieldsEqual(table.getTsField(field, filt), converttsField(infile, filt))
+        self.assertNotEqual(table.getTsField(280, 'r').photoCalib, table.getTsField(281, 'r').photoCalib)
+        with self.assertRaises(LookupError):
+            table.getTsField(282, 'r')
+
+        outfile = os.path.join(self.testDir, "table.npz")
+        table.writeto(outfile)
+        table2 = TsFieldTable.readfrom(outfile)
+        self.assertEqual(table2.filters, table.filters)
+        self.assertTsFieldsEqual(table2.getTsField(281, 'g'), table.getTsField(281, 'g'))
+
+    def testPhotoCalibArrays(self):
+        """Test that the batch calibration matches the per-field TsField"""
+        table = getTsFieldTable(self.testDir, 5754, 3)
+        for filt in "ugriz":
+            calibs = table.getPhotoCalibArrays(filt)
+            self.assertEqual(len(calibs), 2)
+            for i, field in enumerate(table.fields):
+                tsField = table.getTsField(field, filt)
+                self.assertAlmostEqual(calibs.fluxMag0[i],
+                                       tsField.photoCalib.getInstFluxAtZeroMagnitude(), delta=1e-6)
+                self.assertEqual(calibs.getPhotoCalib(i), tsField.photoCalib)
+                self.assertAlmostEqual(calibs.zeroPoint[i],
+                                       tsField.photoCalib.instFluxToMagnitude(1.0), places=10)
+                self.assertEqual(calibs.getDateAvg(i).nsecs(), tsField.dateAvg.nsecs())
+                self.assertLessEqual(abs(calibs.taiAvgNsecs[i] - tsField.dateAvg.nsecs()), 1000)
+
+    def testGetTable(self):
+        """Test that a camcol table is read once, persisted and reused"""
+        table = getTsFieldTable(self.testDir, 5754, 3, persist=True)
+        self.assertEqual(len(table), 2)
+        self.assertTrue(os.path.exists(getTsFieldTablePath(self.testDir, 5754, 3)))
+        # Persisting the table does not invalidate it
+        self.assertIs(getTsFieldTable(self.testDir, 5754, 3), table)
+
+        # A tsField file rewritten in place is read again
+        infile = os.path.join(self.testDir, "tsField-005754-3-40-0281.fit")
+        with fits.open(infile) as ptr:
+            ptr[1].data['aa'][0] += 0.1
+            ptr.writeto(infile, overwrite=True)
+        stat = os.stat(infile)
+        os.utime(infile, (stat.st_atime, stat.st_mtime + 10))
+        table2 = getTsFieldTable(self.testDir, 5754, 3)
+        self.assertIsNot(table2, table)
+        self.assertEqual(list(table2.fields), [280, 281])
+        self.assertFloatsAlmostEqual(table2.columns["aa"][1], table.columns["aa"][1] + 0.1, rtol=1e-6)
+        self.assertIs(getTsFieldTable(self.testDir, 5754, 3), table2)
+
+
+class TestMemory(lsst.utils.tests.MemoryTestCase):
+    pass
+
+
+def setup_module(module):
+    lsst.utils.tests.init()
+
+
+if __name__ == "__main__":
+    lsst.utils.tests.init()
+    unittest.main()